@@ -2,9 +2,33 @@ import sys
 import json
 import numpy as np
 import cv2
+import tensorflow as tf
 from tensorflow.keras.models import load_model
 from tensorflow.keras.preprocessing import image
 import os
+from model_cache import MODEL_CACHE
+import parallelism
+
+# UNAI_INTRA_OP_THREADS / UNAI_INTER_OP_THREADS, applied before TensorFlow runs anything
+parallelism.configure_framework('tensorflow', tf)
+
+DEFAULT_MODEL_PATH = 'models/DeepFake.h5'
+
+def get_model(model_path=DEFAULT_MODEL_PATH):
+    """Loaded detection model, shared across calls (see model_cache.py)"""
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(f"Model file not found: {model_path}")
+    return MODEL_CACHE.get(model_path, load_model, device='tensorflow')
+
+def warmup(model_path=DEFAULT_MODEL_PATH):
+    """Load the model and run one prediction so the first real call only pays for inference"""
+    model = get_model(model_path)
+    model.predict(np.zeros((1, 224, 224, 3), dtype=np.float32), verbose=0)
+    return model
+
+def evict(model_path=None):
+    """Drop the cached model (all cached models when model_path is None)"""
+    return MODEL_CACHE.evict(model_path)
 
 def preprocess_image(img_path, target_size=(224, 224)):
     """Preprocess image for deepfake detection"""
@@ -30,14 +54,11 @@ def preprocess_image(img_path, target_size=(224, 224)):
     except Exception as e:
         raise Exception(f"Error preprocessing image: {str(e)}")
 
-def detect_deepfake(img_path, model_path='models/DeepFake.h5'):
+def detect_deepfake(img_path, model_path=DEFAULT_MODEL_PATH):
     """Detect if image is deepfake using trained model"""
     try:
-        # Load the trained model
-        if not os.path.exists(model_path):
-            raise FileNotFoundError(f"Model file not found: {model_path}")
-        
-        model = load_model(model_path)
+        # Load the trained model (only on the first call)
+        model = get_model(model_path)
         
         # Preprocess image
         processed_img = preprocess_image(img_path)
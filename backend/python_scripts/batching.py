@@ -0,0 +1,100 @@
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+from detection_pipeline import debug_print
+from instrumentation import stage
+
+class BatchingDetector:
+    """Groups concurrent detect() calls into batched forward passes"""
+
+    def __init__(self, detector, max_batch_size=8, max_wait_ms=5):
+        self.detector = detector
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.pending = queue.Queue()
+        self.running = True
+        self.batches = 0
+        self.images = 0
+
+        self.thread = threading.Thread(target=self._run, name='detector-batcher', daemon=True)
+        self.thread.start()
+
+    @property
+    def model(self):
+        return self.detector.model
+
+    @property
+    def model_path(self):
+        return self.detector.model_path
+
+    @property
+    def variant(self):
+        return self.detector.variant
+
+    def submit(self, img_path):
+        """Queue an image and return a Future for its detection result"""
+        future = Future()
+        if not self.running:
+            future.set_exception(RuntimeError('Batching detector is closed'))
+            return future
+        self.pending.put((img_path, future))
+        return future
+
+    def detect(self, img_path):
+        """Same interface as DeepfakeDetector.detect, but batched with other callers"""
+        # The batch runs on the scheduler thread, which records its own stages in the
+        # metrics registry; the request only sees queueing plus the shared forward pass
+        with stage('detect', metrics=False):
+            return self.submit(img_path).result()
+
+    def detect_batch(self, img_paths):
+        return self.detector.detect_batch(img_paths)
+
+    def close(self):
+        """Stop the scheduler once everything already queued has been served"""
+        self.running = False
+        self.pending.put(None)
+        self.thread.join()
+
+    def _collect(self):
+        """Block for the first request, then gather more until the batch is full or the wait expires"""
+        first = self.pending.get()
+        if first is None:
+            return None
+
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self.pending.get(timeout=remaining) if remaining > 0 else self.pending.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Put the sentinel back so the loop exits after this batch
+                self.pending.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                break
+
+            img_paths = [img_path for img_path, _ in batch]
+            try:
+                results = self.detector.detect_batch(img_paths)
+            except Exception as e:
+                debug_print(f"❌ Batched detection failed: {str(e)}")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.images += len(batch)
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
@@ -0,0 +1,399 @@
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from detection_pipeline import DeepfakeDetector, ImageRegenerator, debug_print, timed_import, safe_print_json
+from preprocessing import DecodedImage, decode_image, detector_batch, generator_batch
+from batching import BatchingDetector
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+RESOLUTIONS = [(256, 256), (1024, 768), (3000, 2000)]
+FORMATS = [('JPEG', '.jpg'), ('PNG', '.png'), ('WEBP', '.webp')]
+BATCH_SIZES = [1, 4, 8, 16]
+CONCURRENCY = [1, 2, 4, 8]
+OUTPUT_ENCODINGS = [
+    {'format': 'jpeg', 'quality': 95},
+    {'format': 'jpeg', 'quality': 85},
+    {'format': 'jpeg', 'quality': 85, 'optimize': True, 'progressive': True},
+    {'format': 'webp', 'quality': 80},
+    {'format': 'png'},
+]
+# torch.compile needs a minute or more per model to build; graph_optimize.py --modes compile measures it
+GRAPH_MODES = ['eager', 'fold', 'script']
+
+def summarize(samples_ms):
+    """Latency percentiles in milliseconds"""
+    samples = np.asarray(samples_ms, dtype=np.float64)
+    return {
+        'n': int(samples.size),
+        'mean': round(float(samples.mean()), 3),
+        'p50': round(float(np.percentile(samples, 50)), 3),
+        'p95': round(float(np.percentile(samples, 95)), 3),
+        'p99': round(float(np.percentile(samples, 99)), 3),
+    }
+
+def measure(fn, repeat, warmup=1):
+    """Run fn repeatedly and return per-call latencies in milliseconds"""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+def make_images(workdir, resolutions=RESOLUTIONS, formats=FORMATS):
+    """Write synthetic photo-like images (smooth gradients plus noise) in every resolution/format"""
+    rng = np.random.default_rng(0)
+    images = []
+    for width, height in resolutions:
+        y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+        base = np.stack([x / width, y / height, (x + y) / (width + height)], axis=-1) * 200
+        pixels = np.clip(base + rng.normal(0, 20, base.shape), 0, 255).astype(np.uint8)
+        for fmt, ext in formats:
+            path = os.path.join(workdir, f"synthetic_{width}x{height}{ext}")
+            Image.fromarray(pixels).save(path, fmt)
+            images.append({'path': path, 'resolution': f"{width}x{height}", 'format': fmt})
+    return images
+
+def make_stand_in_detector(workdir):
+    """Small Keras classifier with the same input/output contract as DeepFake.h5"""
+    tf = timed_import('tensorflow')
+    model = tf.keras.Sequential([
+        tf.keras.layers.Input(shape=(None, None, 3)),
+        tf.keras.layers.Conv2D(32, 3, activation='relu'),
+        tf.keras.layers.Conv2D(64, 3, strides=2, activation='relu'),
+        tf.keras.layers.GlobalAveragePooling2D(),
+        tf.keras.layers.Dense(1, activation='sigmoid')
+    ])
+    path = os.path.join(workdir, 'DeepFake.h5')
+    model.save(path)
+    return path
+
+def make_stand_in_generator(workdir):
+    """Randomly initialised Generator with the real architecture"""
+    torch = timed_import('torch')
+    from generator_model import Generator
+    path = os.path.join(workdir, 'regenerator_model.pth')
+    torch.save(Generator().state_dict(), path)
+    return path
+
+def make_stand_in_unet(workdir):
+    """Randomly initialised regenerator.py U-Net"""
+    torch = timed_import('torch')
+    from regenerator import ImageRegenerator as UNet
+    path = os.path.join(workdir, 'unet_regenerator.pth')
+    torch.save(UNet().state_dict(), path)
+    return path
+
+def resolve_models(workdir, stand_in):
+    """Use the real weights when they load, otherwise create stand-ins"""
+    models = {'stand_in': {}}
+
+    detector_path = None if stand_in else DeepfakeDetector.find_deepfake_model()
+    if detector_path:
+        probe = DeepfakeDetector(model_path=detector_path, use_artifacts=False)
+        if probe.model_path is None:
+            detector_path = None
+    if not detector_path:
+        detector_path = make_stand_in_detector(workdir)
+        models['stand_in']['detector'] = True
+    models['detector'] = detector_path
+
+    generator_path = None if stand_in else ImageRegenerator.find_regenerator_model()
+    if generator_path:
+        probe = ImageRegenerator(model_path=generator_path, use_artifacts=False)
+        if probe.ensure_loaded() is None:
+            generator_path = None
+    if not generator_path:
+        generator_path = make_stand_in_generator(workdir)
+        models['stand_in']['generator'] = True
+    models['generator'] = generator_path
+
+    models['unet'] = make_stand_in_unet(workdir)
+    models['stand_in']['unet'] = True
+    return models
+
+def bench_cold_start(models, repeat):
+    """Fresh interpreter: imports + model load + one detection, as spawned per upload today"""
+    code = (
+        "import sys; sys.path.insert(0, sys.argv[1]);"
+        "from detection_pipeline import DeepfakeDetector, ImageRegenerator;"
+        "d = DeepfakeDetector(model_path=sys.argv[2]);"
+        "r = ImageRegenerator(model_path=sys.argv[3]); r.ensure_loaded()"
+    )
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, '-c', code, SCRIPT_DIR, models['detector'], models['generator']],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True
+        )
+        samples.append((time.perf_counter() - start) * 1000)
+    return summarize(samples)
+
+def bench_model_load(models, repeat):
+    def load_detector():
+        DeepfakeDetector(model_path=models['detector'])
+
+    def load_generator():
+        ImageRegenerator(model_path=models['generator']).ensure_loaded()
+
+    return {
+        'detector': summarize(measure(load_detector, repeat)),
+        'generator': summarize(measure(load_generator, repeat)),
+    }
+
+def bench_preprocess(images, repeat):
+    results = []
+    for image in images:
+        path = image['path']
+        entry = dict(image)
+        entry['path'] = os.path.basename(path)
+        entry['decode'] = summarize(measure(lambda: decode_image(path), repeat))
+        pil_image = decode_image(path).image
+        # Fresh DecodedImage each time so the resize is not served from its cache
+        entry['detector_input'] = summarize(measure(lambda: detector_batch([DecodedImage(pil_image)]), repeat))
+        entry['generator_input'] = summarize(measure(lambda: generator_batch([DecodedImage(pil_image)]), repeat))
+        results.append(entry)
+    return results
+
+def bench_inference(detector, regenerator, sample, repeat):
+    decoded = decode_image(sample)
+    detector_input = detector_batch([decoded])
+    generator_input = generator_batch([decoded])
+    return {
+        'detect': summarize(measure(lambda: detector.model.predict(detector_input, verbose=0), repeat)),
+        'regenerate': summarize(measure(lambda: regenerator.forward(generator_input), repeat)),
+    }
+
+def bench_save(regenerator, sample, workdir, repeat):
+    output_image = regenerator.to_images(regenerator.forward(generator_batch([decode_image(sample)])))[0]
+    output_path = os.path.join(workdir, 'save_benchmark.jpg')
+    return summarize(measure(lambda: regenerator.save_image(output_image, output_path), repeat))
+
+def bench_encoding(regenerator, sample, workdir, repeat):
+    """Encode latency and size of the output encodings, in memory and with the file write"""
+    from image_encoding import ENCODER_POOL, OutputEncoding
+
+    output_image = regenerator.to_images(regenerator.forward(generator_batch([decode_image(sample)])))[0]
+    results = []
+    for settings in OUTPUT_ENCODINGS:
+        encoding = OutputEncoding(**settings)
+        output_path = os.path.join(workdir, f'encode_benchmark{encoding.extension}')
+        results.append(dict(
+            settings,
+            bytes=len(ENCODER_POOL.encode(output_image, encoding)),
+            memory=summarize(measure(lambda: ENCODER_POOL.encode(output_image, encoding), repeat)),
+            file=summarize(measure(lambda: ENCODER_POOL.save(output_image, encoding, output_path), repeat)),
+        ))
+    return results
+
+def bench_batch_throughput(detector, regenerator, sample, repeat, batch_sizes):
+    decoded = decode_image(sample)
+    results = []
+    for batch_size in batch_sizes:
+        detector_input = detector_batch([decoded] * batch_size)
+        generator_input = generator_batch([decoded] * batch_size)
+        detect_ms = measure(lambda: detector.model.predict(detector_input, batch_size=batch_size, verbose=0), repeat)
+        regenerate_ms = measure(lambda: regenerator.forward(generator_input), repeat)
+        results.append({
+            'batch_size': batch_size,
+            'detect_images_per_s': round(batch_size * 1000 / float(np.median(detect_ms)), 2),
+            'regenerate_images_per_s': round(batch_size * 1000 / float(np.median(regenerate_ms)), 2),
+        })
+    return results
+
+def bench_concurrency(detector, sample, requests, levels, max_batch_size):
+    """End-to-end detect() throughput with several callers, with and without micro-batching"""
+    results = []
+    for concurrency in levels:
+        for batched in (False, True):
+            target = BatchingDetector(detector, max_batch_size=max_batch_size) if batched else detector
+            latencies = []
+
+            def call():
+                start = time.perf_counter()
+                target.detect(sample)
+                latencies.append((time.perf_counter() - start) * 1000)
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                for future in [executor.submit(call) for _ in range(requests)]:
+                    future.result()
+            elapsed = time.perf_counter() - start
+            if batched:
+                target.close()
+
+            results.append({
+                'concurrency': concurrency,
+                'micro_batching': batched,
+                'images_per_s': round(requests / elapsed, 2),
+                'latency_ms': summarize(latencies),
+            })
+    return results
+
+def bench_streaming(regenerator, images, workdir, batch_size):
+    """Regeneration throughput one image at a time vs. the overlapped streaming pipeline"""
+    paths = [i['path'] for i in images]
+    output_dir = os.path.join(workdir, 'streaming')
+    os.makedirs(output_dir, exist_ok=True)
+    output_paths = [os.path.join(output_dir, f"{n}.jpg") for n in range(len(paths))]
+
+    start = time.perf_counter()
+    for path, output_path in zip(paths, output_paths):
+        regenerator.regenerate(path, output_path)
+    sequential = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in regenerator.regenerate_stream(paths, output_paths, batch_size=batch_size):
+        pass
+    streamed = time.perf_counter() - start
+
+    return {
+        'images': len(paths),
+        'sequential_images_per_s': round(len(paths) / sequential, 2),
+        'streaming_images_per_s': round(len(paths) / streamed, 2),
+    }
+
+def bench_library_scripts(models, sample, workdir, repeat):
+    """Per-call latency of the app.py and regenerator.py library functions"""
+    import app
+    import regenerator as unet_regenerator
+
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        return {
+            'app.detect_deepfake': summarize(measure(lambda: app.detect_deepfake(sample, models['detector']), repeat)),
+            'regenerator.regenerate_image': summarize(
+                measure(lambda: unet_regenerator.regenerate_image(sample, models['unet']), repeat)
+            ),
+            # What every call used to cost before the model cache
+            'app.detect_deepfake_uncached': summarize(
+                measure(lambda: (app.evict(), app.detect_deepfake(sample, models['detector'])), repeat)
+            ),
+            'regenerator.regenerate_image_uncached': summarize(
+                measure(lambda: (unet_regenerator.evict(), unet_regenerator.regenerate_image(sample, models['unet'])), repeat)
+            ),
+        }
+    finally:
+        os.chdir(cwd)
+
+def bench_graph_optimization(models, repeat):
+    """Parity and latency of the optimized generator builds against the eager models"""
+    torch = timed_import('torch')
+    import regenerator as unet_regenerator
+    from graph_optimize import compare
+
+    generator = ImageRegenerator(model_path=models['generator'], use_artifacts=False, backend='native', graph_mode='eager',
+                                 precision='fp32', channels_last=False)
+    unet = unet_regenerator.load_regenerator_model(models['unet'])[0]
+    return {
+        'generator': compare(generator.ensure_loaded().cpu(), torch.randn(1, 3, 128, 128), GRAPH_MODES, repeat),
+        'unet': compare(unet.cpu(), torch.randn(1, 3, 256, 256), GRAPH_MODES, repeat),
+    }
+
+def bench_execution_modes(models, images, repeat):
+    """Latency and PSNR against fp32 of the channels_last/bf16 generator modes on one image batch"""
+    torch = timed_import('torch')
+    from graph_optimize import compare_execution
+
+    generator = ImageRegenerator(model_path=models['generator'], use_artifacts=False, backend='native', graph_mode='eager',
+                                 precision='fp32', channels_last=False)
+    inputs = generator_batch([decode_image(i['path']) for i in images[:max(BATCH_SIZES)]])
+    return compare_execution(generator.ensure_loaded().cpu(), torch.from_numpy(inputs), repeat=repeat)
+
+def environment():
+    info = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+    }
+    for name in ('numpy', 'PIL', 'tensorflow', 'torch'):
+        module = sys.modules.get(name)
+        if module is not None:
+            info[f"{name}_version"] = getattr(module, '__version__', None)
+    return info
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Python detection/regeneration pipeline')
+    parser.add_argument('--output', help='Write the JSON report here (default: stdout)')
+    parser.add_argument('--repeat', type=int, default=20, help='Samples per latency measurement')
+    parser.add_argument('--cold-start-runs', type=int, default=3)
+    parser.add_argument('--requests', type=int, default=64, help='Requests per concurrency level')
+    parser.add_argument('--stand-in', action='store_true', help='Always use generated stand-in models')
+    parser.add_argument('--quick', action='store_true', help='Small run for smoke testing')
+    parser.add_argument('--skip', nargs='*', default=[], help='Sections to skip (e.g. cold_start library_scripts)')
+    args = parser.parse_args()
+
+    if args.quick:
+        args.repeat = 3
+        args.cold_start_runs = 1
+        args.requests = 16
+
+    workdir = tempfile.mkdtemp(prefix='unai-bench-')
+    try:
+        images = make_images(workdir)
+        sample = next(i['path'] for i in images if i['resolution'] == '1024x768' and i['format'] == 'JPEG')
+        models = resolve_models(workdir, args.stand_in)
+        debug_print(f"Benchmark models: {models}")
+
+        detector = DeepfakeDetector(model_path=models['detector'])
+        regenerator = ImageRegenerator(model_path=models['generator'])
+        regenerator.ensure_loaded()
+
+        sections = {
+            'cold_start': lambda: bench_cold_start(models, args.cold_start_runs),
+            'model_load': lambda: bench_model_load(models, max(1, args.repeat // 4)),
+            'preprocess': lambda: bench_preprocess(images, args.repeat),
+            'inference': lambda: bench_inference(detector, regenerator, sample, args.repeat),
+            'save': lambda: bench_save(regenerator, sample, workdir, args.repeat),
+            'encoding': lambda: bench_encoding(regenerator, sample, workdir, args.repeat),
+            'batch_throughput': lambda: bench_batch_throughput(detector, regenerator, sample, max(1, args.repeat // 2), BATCH_SIZES),
+            'concurrency': lambda: bench_concurrency(detector, sample, args.requests, CONCURRENCY, max(BATCH_SIZES)),
+            'streaming': lambda: bench_streaming(regenerator, images * max(1, args.repeat // 4), workdir, max(BATCH_SIZES)),
+            'library_scripts': lambda: bench_library_scripts(models, sample, workdir, max(1, args.repeat // 4)),
+            'graph_optimization': lambda: bench_graph_optimization(models, max(1, args.repeat // 4)),
+            'execution_modes': lambda: bench_execution_modes(models, images, max(1, args.repeat // 4)),
+        }
+
+        report = {'environment': environment(), 'models': models, 'results': {}}
+        for name, run in sections.items():
+            if name in args.skip:
+                continue
+            debug_print(f"Running benchmark: {name}")
+            try:
+                report['results'][name] = run()
+            except Exception as e:
+                debug_print(f"❌ Benchmark {name} failed: {str(e)}")
+                report['results'][name] = {'error': str(e)}
+
+        # Paths inside the temp dir are meaningless after the run
+        report['models'] = {'stand_in': models['stand_in']}
+        report['environment'] = environment()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        debug_print(f"Report written to: {args.output}")
+    else:
+        safe_print_json(report)
+
+if __name__ == "__main__":
+    main()
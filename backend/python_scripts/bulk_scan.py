@@ -0,0 +1,218 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import multiprocessing
+
+import numpy as np
+
+from detection_pipeline import debug_print, expand_image_paths
+import parallelism
+
+# Resume state lives next to the output in <output>.done: one fixed-size
+# digest of the image path per successful result, appended as results arrive
+CHECKPOINT_SUFFIX = '.done'
+CHECKPOINT_RECORD = 8
+CHECKPOINT_DTYPE = '<u8'
+
+# Set in each worker process by init_worker
+_pipeline = None
+
+def read_manifest(path):
+    """Image paths from a manifest: one path per line, or JSON lines with an image_path field"""
+    paths = []
+    base_dir = os.path.dirname(os.path.abspath(path))
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if line.startswith('{'):
+                line = json.loads(line)['image_path']
+            paths.append(line if os.path.isabs(line) else os.path.join(base_dir, line))
+    return paths
+
+def path_digest(path):
+    """8-byte key of an image path, the unit of the checkpoint file"""
+    return hashlib.blake2b(path.encode('utf-8'), digest_size=CHECKPOINT_RECORD).digest()
+
+def checkpoint_path(output_path):
+    return output_path + CHECKPOINT_SUFFIX
+
+def drop_torn_line(path, chunk_size=64 * 1024):
+    """Cut a partial record a crashed run left at the end of a JSON lines file, reading only its tail"""
+    with open(path, 'rb+') as f:
+        size = f.seek(0, os.SEEK_END)
+        position = size
+        end = 0
+        while position > 0:
+            step = min(chunk_size, position)
+            position -= step
+            f.seek(position)
+            newline = f.read(step).rfind(b'\n')
+            if newline >= 0:
+                end = position + newline + 1
+                break
+        if end < size:
+            f.truncate(end)
+
+def rebuild_checkpoint(output_path):
+    """Write the checkpoint of an output that has none (a run from before checkpoints existed), line by line"""
+    with open(output_path, 'rb') as f, open(checkpoint_path(output_path), 'wb') as checkpoint:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get('pipeline_status') == 'success' and 'image_path' in record:
+                checkpoint.write(path_digest(record['image_path']))
+
+def load_checkpoint(output_path):
+    """Digests of the images a previous run scanned successfully, as a sorted uint64 array
+
+    Only successes are recorded, so images that failed are scanned again.
+    The checkpoint holds CHECKPOINT_RECORD bytes per image instead of the
+    whole result, so resuming millions of images stays fast and small.
+    """
+    path = checkpoint_path(output_path)
+    if not os.path.exists(output_path):
+        if os.path.exists(path):
+            # Left by a run whose output was deleted; it does not describe this one
+            os.remove(path)
+        return np.empty(0, dtype=np.uint64)
+    drop_torn_line(output_path)
+    if not os.path.exists(path):
+        debug_print(f"No {CHECKPOINT_SUFFIX} checkpoint for {output_path}, rebuilding it from the output")
+        rebuild_checkpoint(output_path)
+
+    size = os.path.getsize(path)
+    if size % CHECKPOINT_RECORD:
+        # The previous run died mid-write; cut the partial record
+        with open(path, 'rb+') as f:
+            f.truncate(size - size % CHECKPOINT_RECORD)
+    return np.unique(np.fromfile(path, dtype=CHECKPOINT_DTYPE).astype(np.uint64))
+
+def remaining(paths, done):
+    """paths whose digest is not in done"""
+    if not len(done) or not paths:
+        return paths
+    digests = np.frombuffer(b''.join(path_digest(p) for p in paths), dtype=CHECKPOINT_DTYPE).astype(np.uint64)
+    keep = ~np.isin(digests, done)
+    return [p for p, k in zip(paths, keep) if k]
+
+def parse_shard(parser, spec):
+    """(index, count) from INDEX/COUNT, exiting with a usage error unless 0 <= INDEX < COUNT"""
+    try:
+        index, count = (int(x) for x in spec.split('/'))
+    except ValueError:
+        parser.error(f"--shard must be INDEX/COUNT, e.g. 0/4: {spec}")
+    if count < 1 or not 0 <= index < count:
+        parser.error(f"--shard index must be between 0 and COUNT - 1: {spec}")
+    return index, count
+
+def init_worker(counter, workers, threads, affinity, backend, precision, cache_dir, detect_only):
+    """Build one Pipeline per process so the models are loaded once, not per image"""
+    global _pipeline
+
+    with counter.get_lock():
+        index = counter.value
+        counter.value += 1
+
+    # Workers split the cores between them; oversubscribing the math libraries
+    # in every process makes the whole pool slower
+    parallelism.configure(threads, 1, affinity, workers, index if affinity else None)
+
+    from detection_pipeline import Pipeline
+    from result_cache import ResultCache
+
+    cache = ResultCache(cache_dir) if cache_dir else None
+    _pipeline = Pipeline(cache=cache, backend=backend, precision=precision, skip_regeneration=detect_only)
+    _pipeline.get_detector()
+    if not detect_only:
+        _pipeline.get_regenerator().ensure_loaded()
+
+def scan_one(img_path):
+    try:
+        result = _pipeline.process(img_path)
+    except Exception as e:
+        result = {'pipeline_status': 'error', 'error': str(e)}
+    result['image_path'] = img_path
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description='Scan many images with a pool of pipeline processes')
+    parser.add_argument('inputs', nargs='*', help='Image files, globs or directories')
+    parser.add_argument('--manifest', action='append', default=[], help='File listing one image path per line (repeatable)')
+    parser.add_argument('--output', required=True, help='JSON lines output; <output>.done is the checkpoint for --resume')
+    parser.add_argument('--resume', action='store_true', help='Skip images already scanned successfully and append to --output')
+    parser.add_argument('--workers', type=int, help='Worker processes (default: $UNAI_WORKERS or one per core)')
+    parser.add_argument('--threads-per-worker', type=int, help='Math library threads per worker (default: cores / workers)')
+    parser.add_argument('--cpu-affinity', help='Pin each worker to its own slice of these cores, e.g. 0-15')
+    parser.add_argument('--chunk-size', type=int, default=8, help='Images handed to a worker at a time')
+    parser.add_argument('--shard', help='Only scan shard INDEX/COUNT of the inputs, to split a scan across machines')
+    parser.add_argument('--detect-only', action='store_true', help='Skip regeneration of detected deepfakes')
+    parser.add_argument('--backend', choices=['native', 'onnx'])
+    parser.add_argument('--precision', choices=['fp32', 'int8', 'bf16'])
+    parser.add_argument('--cache-dir', help='Shared result cache directory')
+    args = parser.parse_args()
+
+    paths = expand_image_paths(args.inputs) if args.inputs else []
+    for manifest in args.manifest:
+        paths.extend(read_manifest(manifest))
+    paths = [os.path.abspath(p) for p in paths]
+
+    if args.shard:
+        index, count = parse_shard(parser, args.shard)
+        paths = paths[index::count]
+
+    if args.resume:
+        done = load_checkpoint(args.output)
+        paths = remaining(paths, done)
+        debug_print(f"Resuming: {len(done)} already scanned")
+    elif os.path.exists(args.output):
+        debug_print(f"❌ {args.output} exists; pass --resume to continue it")
+        sys.exit(1)
+    elif os.path.exists(checkpoint_path(args.output)):
+        # Left by a run whose output was deleted; it does not describe this one
+        os.remove(checkpoint_path(args.output))
+
+    if not paths:
+        debug_print("Nothing to scan")
+        return
+
+    workers = args.workers or int(os.environ.get('UNAI_WORKERS') or parallelism.available_cpus())
+    workers = max(1, min(workers, len(paths)))
+    threads = args.threads_per_worker or int(os.environ.get('UNAI_INTRA_OP_THREADS') or 0) \
+        or max(1, parallelism.available_cpus() // workers)
+    debug_print(f"Scanning {len(paths)} images with {workers} workers x {threads} threads")
+
+    # spawn, not fork: TensorFlow and torch thread pools do not survive a fork
+    context = multiprocessing.get_context('spawn')
+    counter = context.Value('i', 0)
+    initargs = (counter, workers, threads, args.cpu_affinity, args.backend, args.precision, args.cache_dir, args.detect_only)
+
+    start = time.perf_counter()
+    counts = {'success': 0, 'error': 0, 'deepfake': 0}
+    with open(args.output, 'a', encoding='utf-8') as out, open(checkpoint_path(args.output), 'ab') as checkpoint, \
+            context.Pool(workers, initializer=init_worker, initargs=initargs) as pool:
+        for n, result in enumerate(pool.imap_unordered(scan_one, paths, chunksize=args.chunk_size), 1):
+            # The result line goes first: a crash in between only means scanning the image again
+            out.write(json.dumps(result) + '\n')
+            out.flush()
+            if result['pipeline_status'] == 'success':
+                checkpoint.write(path_digest(result['image_path']))
+                checkpoint.flush()
+
+            counts[result['pipeline_status']] = counts.get(result['pipeline_status'], 0) + 1
+            if result.get('detection', {}).get('is_deepfake'):
+                counts['deepfake'] += 1
+            if n % 100 == 0 or n == len(paths):
+                rate = n / (time.perf_counter() - start)
+                debug_print(f"{n}/{len(paths)} scanned ({rate:.1f} images/s)")
+
+    debug_print(f"Done: {counts}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+import os
+import sys
+import time
+import argparse
+import threading
+
+import numpy as np
+
+from detection_pipeline import DeepfakeDetector, debug_print, expand_image_paths, safe_print_json
+from instrumentation import METRICS
+from preprocessing import decode_image
+
+DEFAULT_LOW = 0.1
+DEFAULT_HIGH = 0.9
+
+class CascadeDetector:
+    """Two-stage detector: a cheap model settles the clear cases, the full model the rest
+
+    Images the first stage scores at or below `low` are reported authentic and at
+    or above `high` deepfake; only the uncertain band in between is re-scored
+    by the full model. Same interface as DeepfakeDetector.
+    """
+
+    def __init__(self, fast, full, low=DEFAULT_LOW, high=DEFAULT_HIGH):
+        if not 0.0 <= low <= 0.5 <= high <= 1.0:
+            raise ValueError('Cascade thresholds must satisfy 0 <= low <= 0.5 <= high <= 1')
+        self.fast = fast
+        self.full = full
+        self.low = low
+        self.high = high
+        self.lock = threading.Lock()
+        self.routed = {'fast': 0, 'full': 0}
+        # Images that reached the full model, and how many of them the fast stage had on the same side of 0.5
+        self.compared = 0
+        self.agreed = 0
+
+    @property
+    def model(self):
+        return self.full.model
+
+    @property
+    def model_path(self):
+        return self.full.model_path
+
+    @property
+    def variant(self):
+        return self.full.variant
+
+    def is_decisive(self, result):
+        return result['status'] == 'success' and (result['confidence'] <= self.low or result['confidence'] >= self.high)
+
+    def detect(self, img_path):
+        return self.detect_batch([img_path])[0]
+
+    def detect_batch(self, img_paths):
+        """Score everything with the fast model, then the uncertain ones with the full model"""
+        # Decode once for both stages; failures are left for the fast stage to report
+        inputs = []
+        for img_path in img_paths:
+            try:
+                inputs.append(decode_image(img_path))
+            except Exception:
+                inputs.append(img_path)
+
+        results = [dict(r, cascade_stage='fast') if r['status'] == 'success' else r
+                   for r in self.fast.detect_batch(inputs)]
+        uncertain = [i for i, r in enumerate(results) if r['status'] == 'success' and not self.is_decisive(r)]
+
+        compared = agreed = 0
+        if uncertain:
+            for i, result in zip(uncertain, self.full.detect_batch([inputs[i] for i in uncertain])):
+                if result['status'] == 'success':
+                    compared += 1
+                    agreed += (results[i]['confidence'] > 0.5) == (result['confidence'] > 0.5)
+                results[i] = dict(result, cascade_stage='full') if result['status'] == 'success' else result
+
+        decided = sum(1 for r in results if r.get('cascade_stage') == 'fast')
+        with self.lock:
+            self.routed['fast'] += decided
+            self.routed['full'] += len(uncertain)
+            self.compared += compared
+            self.agreed += agreed
+        METRICS.increment('unai_cascade_routed_total', 'Images settled by each cascade stage', decided, stage='fast')
+        METRICS.increment('unai_cascade_routed_total', 'Images settled by each cascade stage', len(uncertain), stage='full')
+        METRICS.increment('unai_cascade_stage_agreement_total', 'Full-model images by whether the fast stage agreed',
+                          agreed, outcome='agree')
+        METRICS.increment('unai_cascade_stage_agreement_total', 'Full-model images by whether the fast stage agreed',
+                          compared - agreed, outcome='disagree')
+        return results
+
+    def stats(self):
+        with self.lock:
+            total = self.routed['fast'] + self.routed['full']
+            return {
+                'low': self.low,
+                'high': self.high,
+                'images': total,
+                'routed': dict(self.routed),
+                'full_model_rate': self.routed['full'] / total if total else None,
+                # Measured only on the uncertain band, so it is a lower bound for the early exits
+                'stage_agreement': self.agreed / self.compared if self.compared else None,
+            }
+
+def build_cascade(low=DEFAULT_LOW, high=DEFAULT_HIGH, backend=None, fast_model_path=None):
+    """Cascade of a small model (or the INT8 detector) in front of the FP32 detector
+
+    Falls back to the plain FP32 detector when no cheaper first stage exists.
+    """
+    from model_artifacts import QUANTIZED_DETECTOR_SUFFIX, find_artifact
+
+    # Look for the first stage on disk before loading anything, so a missing
+    # one does not cost a second full detector load
+    fast_model_path = fast_model_path or os.environ.get('UNAI_CASCADE_MODEL')
+    if not fast_model_path:
+        source_path = DeepfakeDetector.find_deepfake_model()
+        fast_model_path = source_path and find_artifact(source_path, QUANTIZED_DETECTOR_SUFFIX)
+    if not fast_model_path or not os.path.exists(fast_model_path):
+        debug_print("No cheap first-stage detector available, cascade disabled")
+        return DeepfakeDetector(backend=backend, precision='fp32')
+
+    fast = DeepfakeDetector(backend=backend, model_path=fast_model_path)
+    if fast.variant == 'mock':
+        debug_print("First-stage detector failed to load, cascade disabled")
+        return DeepfakeDetector(backend=backend, precision='fp32')
+
+    debug_print(f"Cascade enabled: first stage {fast.variant}, thresholds {low}/{high}")
+    full = DeepfakeDetector(backend=backend, precision='fp32')
+    return CascadeDetector(fast, full, low, high)
+
+def cascade_from_env():
+    """(low, high) thresholds when UNAI_CASCADE=1, else None"""
+    if os.environ.get('UNAI_CASCADE', '0') != '1':
+        return None
+    return (
+        float(os.environ.get('UNAI_CASCADE_LOW', DEFAULT_LOW)),
+        float(os.environ.get('UNAI_CASCADE_HIGH', DEFAULT_HIGH)),
+    )
+
+def score_all(detector, images, batch_size=32):
+    """Confidences of one stage for every image, plus its mean latency per image"""
+    scores = []
+    start = time.perf_counter()
+    for i in range(0, len(images), batch_size):
+        for result in detector.detect_batch(images[i:i + batch_size]):
+            scores.append(result['confidence'] if result['status'] == 'success' else np.nan)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    return np.array(scores, dtype=np.float64), elapsed_ms / max(1, len(images))
+
+def routing_report(fast_scores, full_scores, low, high, fast_ms, full_ms):
+    """What a (low, high) cascade would have done on already scored images"""
+    valid = ~(np.isnan(fast_scores) | np.isnan(full_scores))
+    fast_scores = fast_scores[valid]
+    full_scores = full_scores[valid]
+    total = len(fast_scores)
+
+    decisive = (fast_scores <= low) | (fast_scores >= high)
+    final = np.where(decisive, fast_scores, full_scores)
+    agree = (final > 0.5) == (full_scores > 0.5)
+    early_agree = agree[decisive]
+    full_rate = float(np.mean(~decisive)) if total else 0.0
+
+    return {
+        'low': low,
+        'high': high,
+        'images': int(total),
+        'routing_rate': {'fast': 1.0 - full_rate, 'full': full_rate},
+        'agreement_with_full_model': float(np.mean(agree)) if total else None,
+        'agreement_on_early_exits': float(np.mean(early_agree)) if len(early_agree) else None,
+        'mean_ms_per_image': round(fast_ms + full_rate * full_ms, 3),
+        'cost_vs_full_model': round((fast_ms + full_rate * full_ms) / full_ms, 3) if full_ms else None,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Evaluate the early-exit cascade detector against the full model')
+    parser.add_argument('--images', nargs='+', required=True, help='Evaluation images (files, globs or directories)')
+    parser.add_argument('--low', type=float, default=DEFAULT_LOW)
+    parser.add_argument('--high', type=float, default=DEFAULT_HIGH)
+    parser.add_argument('--cascade-model', help='First-stage model (default: the INT8 detector)')
+    parser.add_argument('--backend', choices=['native', 'onnx'])
+    parser.add_argument('--max-images', type=int, default=1000)
+    args = parser.parse_args()
+
+    paths = expand_image_paths(args.images)[:args.max_images]
+    if not paths:
+        debug_print("❌ No evaluation images found")
+        sys.exit(1)
+
+    cascade = build_cascade(args.low, args.high, args.backend, args.cascade_model)
+    if not isinstance(cascade, CascadeDetector):
+        debug_print("❌ Run quantize_models.py calibrate or pass --cascade-model first")
+        sys.exit(1)
+
+    images = [decode_image(p) for p in paths]
+    # Warm both stages so the first batch does not count graph setup
+    cascade.fast.detect_batch(images[:1])
+    cascade.full.detect_batch(images[:1])
+    fast_scores, fast_ms = score_all(cascade.fast, images)
+    full_scores, full_ms = score_all(cascade.full, images)
+
+    sweep = [routing_report(fast_scores, full_scores, m, 1.0 - m, fast_ms, full_ms) for m in (0.02, 0.05, 0.1, 0.2, 0.3, 0.4)]
+    safe_print_json({
+        'fast_stage': cascade.fast.variant,
+        'fast_ms_per_image': round(fast_ms, 3),
+        'full_ms_per_image': round(full_ms, 3),
+        'configured': routing_report(fast_scores, full_scores, args.low, args.high, fast_ms, full_ms),
+        'sweep': sweep,
+    })
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,14 @@
+import sys
+import json
+
+# Output helpers shared by every script; stdout is reserved for JSON results,
+# everything else goes to stderr. Kept free of imports so small modules
+# (model_cache, graph_optimize, parallelism) can log without loading the pipeline.
+
+def debug_print(message):
+    """Print debug messages to stderr only, not stdout"""
+    print(message, file=sys.stderr)
+
+def safe_print_json(data):
+    """Only function allowed to print to stdout - clean JSON only"""
+    print(json.dumps(data), flush=True)
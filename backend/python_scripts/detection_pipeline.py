@@ -1,6 +1,6 @@
 import os
 import sys
-import json
+import shutil
 
 # Suppress TensorFlow logging
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
@@ -8,27 +8,84 @@ os.environ['TF_ENABLE_ONEDNN_OPTS'] = '0'
 os.environ['PYTHONWARNINGS'] = 'ignore'
 
 import io
+import time
+import importlib
+import threading
 from contextlib import redirect_stderr, redirect_stdout
 import numpy as np
 from PIL import Image
 
-def debug_print(message):
-    """Print debug messages to stderr only, not stdout"""
-    print(message, file=sys.stderr)
+from preprocessing import (
+    MODEL_SIZE, decode_image, detector_batch, detector_shape, generator_batch, generator_shape, batch_buffer,
+    generator_buffer
+)
+from instrumentation import METRICS, record_timings, stage, timings_enabled
+from image_encoding import ENCODER_POOL, OutputEncoding, deliver, resolve_delivery
+from console import debug_print, safe_print_json
 
-def safe_print_json(data):
-    """Only function allowed to print to stdout - clean JSON only"""
-    print(json.dumps(data), flush=True)
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp')
+
+def expand_image_paths(patterns):
+    """Expand files, globs and directories into a sorted list of image paths"""
+    import glob
+    
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            candidates = glob.glob(os.path.join(pattern, '**', '*'), recursive=True)
+        else:
+            candidates = glob.glob(pattern)
+        paths.extend(p for p in sorted(candidates) if p.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(p))
+    return paths
+
+IMPORT_TIMINGS = {}
+
+def timed_import(module_name):
+    """Import a module and record how long the first import took"""
+    module = sys.modules.get(module_name)
+    if module is None:
+        start = time.perf_counter()
+        module = importlib.import_module(module_name)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        IMPORT_TIMINGS[module_name] = round(elapsed_ms, 2)
+        debug_print(f"Imported {module_name} in {elapsed_ms:.1f} ms")
+    
+    # Size the framework's thread pools before anything runs on them, also
+    # when another module imported it first (a no-op once applied)
+    from parallelism import configure_framework
+    configure_framework(module_name, module)
+    return module
+
+def resolve_backend(backend=None):
+    """Inference backend: 'native' (TensorFlow/PyTorch) or 'onnx' (ONNX Runtime)"""
+    backend = backend or os.environ.get('UNAI_BACKEND', 'native')
+    if backend not in ('native', 'onnx'):
+        raise ValueError(f"Unknown backend: {backend}")
+    return backend
 
 class DeepfakeDetector:
     """Deepfake detection with clean output"""
     
-    def __init__(self):
+    def __init__(self, backend=None, use_artifacts=True, precision=None, model_path=None):
         self.model = None
-        self.load_model()
+        self.model_path = None
+        # Which form of the model ended up loaded: keras, tflite, int8, onnx or mock
+        self.variant = None
+        self.requested_path = model_path
+        self.backend = resolve_backend(backend)
+        self.use_artifacts = use_artifacts
+        self.precision = precision
+        with stage('model_load'):
+            self.load_model()
     
-    def find_deepfake_model(self):
-        """Find DeepFake model using absolute path"""
+    @staticmethod
+    def find_deepfake_model():
+        """Find the DeepFake model: the registry's configured version, else the usual file names"""
+        from model_registry import resolve_model
+        registered = resolve_model('detector')
+        if registered:
+            return registered
+        
         models_base_path = '/home/varun-kasnia/Documents/Programming Files/Projects/UnAI/models/'
         
         possible_paths = [
@@ -56,19 +113,54 @@ class DeepfakeDetector:
         """Load the deepfake detection model"""
         try:
             # Find the model
-            model_path = self.find_deepfake_model()
+            with stage('model_locate'):
+                model_path = self.requested_path or self.find_deepfake_model()
             
             if not model_path:
                 debug_print("No DeepFake model found, creating mock model")
                 self.create_mock_model()
                 return
             
+            if self.backend == 'onnx':
+                from onnx_backend import load_detector
+                model = load_detector(model_path)
+                if model is not None:
+                    self.model = model
+                    self.model_path = model_path
+                    self.variant = 'onnx'
+                    debug_print("✅ Successfully loaded ONNX DeepFake model")
+                    return
+                debug_print("No ONNX detector found, falling back to native backend")
+            
+            # Prefer an exported flatbuffer, which skips rebuilding the Keras graph
+            from model_artifacts import (
+                DETECTOR_SUFFIX, QUANTIZED_DETECTOR_SUFFIX, find_artifact, load_detector_artifact, resolve_precision
+            )
+            artifact = None
+            if model_path.endswith(DETECTOR_SUFFIX):
+                # Asked for a flatbuffer directly (e.g. a small first-stage model)
+                artifact = model_path
+            if not artifact and self.use_artifacts and resolve_precision(self.precision) == 'int8':
+                artifact = find_artifact(model_path, QUANTIZED_DETECTOR_SUFFIX)
+                if not artifact:
+                    debug_print("No INT8 detector found, using FP32")
+            if self.use_artifacts and not artifact:
+                artifact = find_artifact(model_path, DETECTOR_SUFFIX)
+            if artifact:
+                self.model = load_detector_artifact(artifact)
+                self.model_path = model_path
+                self.variant = 'int8' if artifact.endswith(QUANTIZED_DETECTOR_SUFFIX) else 'tflite'
+                debug_print("✅ Successfully loaded exported DeepFake model")
+                return
+            
             debug_print(f"Loading DeepFake model from: {model_path}")
             
             with redirect_stderr(io.StringIO()):
-                import tensorflow as tf
+                tf = timed_import('tensorflow')
                 tf.get_logger().setLevel('ERROR')
                 self.model = tf.keras.models.load_model(model_path)
+                self.model_path = model_path
+                self.variant = 'keras'
                 debug_print("✅ Successfully loaded DeepFake model")
                 
         except Exception as e:
@@ -78,7 +170,7 @@ class DeepfakeDetector:
     def create_mock_model(self):
         """Create a simple mock model for testing"""
         try:
-            import tensorflow as tf
+            tf = timed_import('tensorflow')
             
             debug_print("Creating mock deepfake detection model...")
             
@@ -90,49 +182,47 @@ class DeepfakeDetector:
             ])
             
             self.model.compile(optimizer='adam', loss='binary_crossentropy')
+            self.variant = 'mock'
             debug_print("✅ Mock model created successfully")
             
         except Exception as e:
             raise Exception(f"Failed to create mock model: {str(e)}")
     
     def preprocess_image(self, image_path):
-        """Preprocess image for deepfake detection"""
+        """Preprocess image (path, bytes or DecodedImage) for deepfake detection"""
         try:
-            image = Image.open(image_path)
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-            
-            image = image.resize((128, 128))
-            image_array = np.array(image)
-            image_array = image_array.astype('float32') / 255.0
-            image_array = np.expand_dims(image_array, axis=0)
-            return image_array
+            return detector_batch([decode_image(image_path)])
         except Exception as e:
             raise Exception(f"Error preprocessing image: {str(e)}")
     
+    def score_prediction(self, prediction, index=0):
+        """Turn one row of model output into a detection result"""
+        # Handle different prediction formats
+        if len(prediction.shape) > 1 and prediction.shape[1] > 1:
+            score = prediction[index][1]  # Multi-class output
+        else:
+            score = prediction[index][0]  # Binary output
+            
+        # Ensure score is between 0 and 1
+        score = float(np.clip(score, 0, 1))
+        is_deepfake = score > 0.5
+        
+        return {
+            'is_deepfake': bool(is_deepfake),
+            'confidence': score,
+            'status': 'success'
+        }
+    
     def detect(self, img_path):
         """Detect if image is deepfake"""
         try:
-            processed_image = self.preprocess_image(img_path)
+            with stage('preprocess'):
+                processed_image = self.preprocess_image(img_path)
             
-            with redirect_stderr(io.StringIO()):
+            with stage('detect'), redirect_stderr(io.StringIO()):
                 prediction = self.model.predict(processed_image, verbose=0)
             
-            # Handle different prediction formats
-            if len(prediction.shape) > 1 and prediction.shape[1] > 1:
-                score = prediction[0][1]  # Multi-class output
-            else:
-                score = prediction[0][0]  # Binary output
-                
-            # Ensure score is between 0 and 1
-            score = float(np.clip(score, 0, 1))
-            is_deepfake = score > 0.5
-            
-            return {
-                'is_deepfake': bool(is_deepfake),
-                'confidence': score,
-                'status': 'success'
-            }
+            return self.score_prediction(prediction)
         except Exception as e:
             return {
                 'is_deepfake': False,
@@ -140,17 +230,82 @@ class DeepfakeDetector:
                 'status': 'error',
                 'error': str(e)
             }
+    
+    def detect_batch(self, img_paths):
+        """Detect a list of images with a single forward pass"""
+        results = [None] * len(img_paths)
+        images = []
+        indices = []
+        
+        # Decode separately so one bad image does not fail the batch
+        for i, img_path in enumerate(img_paths):
+            try:
+                try:
+                    with stage('decode'):
+                        images.append(decode_image(img_path))
+                except Exception as e:
+                    raise Exception(f"Error preprocessing image: {str(e)}")
+                indices.append(i)
+            except Exception as e:
+                results[i] = {
+                    'is_deepfake': False,
+                    'confidence': 0.0,
+                    'status': 'error',
+                    'error': str(e)
+                }
+        
+        if images:
+            try:
+                with stage('preprocess'):
+                    batch = detector_batch(images, out=batch_buffer('detector', detector_shape(len(images))))
+                with stage('detect'), redirect_stderr(io.StringIO()):
+                    prediction = self.model.predict(batch, batch_size=len(images), verbose=0)
+                for row, i in enumerate(indices):
+                    results[i] = self.score_prediction(prediction, row)
+            except Exception as e:
+                for i in indices:
+                    results[i] = {
+                        'is_deepfake': False,
+                        'confidence': 0.0,
+                        'status': 'error',
+                        'error': str(e)
+                    }
+        
+        return results
 
 class ImageRegenerator:
     """Image regeneration with clean output"""
     
-    def __init__(self):
+    def __init__(self, lazy=True, use_artifacts=True, backend=None, precision=None, model_path=None, graph_mode=None,
+                 channels_last=None, encoding=None):
         self.model = None
+        # Output format and encoder options (UNAI_OUTPUT_*), see image_encoding.py
+        self.encoding = encoding or OutputEncoding()
+        self.use_artifacts = use_artifacts
+        self.graph_mode = graph_mode
+        # channels_last/bf16 execution (UNAI_CHANNELS_LAST, precision 'bf16'), see graph_optimize.py
+        self.channels_last = channels_last
+        self.execution = None
+        self.backend = resolve_backend(backend)
+        self.precision = precision
         self.device = None
-        self.load_model()
+        self.loaded = False
+        self.load_lock = threading.Lock()
+        
+        # Locating the weights is cheap; importing torch and reading them is not
+        with stage('model_locate'):
+            self.model_path = model_path or self.find_regenerator_model()
+        if not lazy:
+            self.ensure_loaded()
     
-    def find_regenerator_model(self):
-        """Find regenerator model using absolute path"""
+    @staticmethod
+    def find_regenerator_model():
+        """Find the regenerator model: the registry's configured version, else the usual file names"""
+        from model_registry import resolve_model
+        registered = resolve_model('generator')
+        if registered:
+            return registered
+        
         models_base_path = '/home/varun-kasnia/Documents/Programming Files/Projects/UnAI/models/'
         
         possible_paths = [
@@ -175,154 +330,111 @@ class ImageRegenerator:
         
         return None
     
+    def ensure_loaded(self):
+        """Import torch and materialise the generator weights on first use"""
+        if self.loaded:
+            return self.model
+        with self.load_lock:
+            if not self.loaded:
+                with stage('model_load'):
+                    self.load_model()
+                self.loaded = True
+        return self.model
+    
     def load_model(self):
         """Load regenerator model"""
+        if self.backend == 'onnx':
+            from onnx_backend import load_generator
+            try:
+                model = load_generator(self.model_path)
+            except Exception as e:
+                debug_print(f"❌ Error loading ONNX regenerator model: {str(e)}")
+                model = None
+            if model is not None:
+                # ONNX Runtime works on NumPy arrays, so torch is never imported
+                self.model = model
+                self.channels_last = False
+                debug_print("✅ ONNX regenerator model loaded successfully")
+                return
+            debug_print("No ONNX generator found, falling back to native backend")
+            self.backend = 'native'
+        
         try:
-            import torch
-            import torch.nn as nn
-            import torch.nn.functional as F
-            from torchvision import transforms
+            torch = timed_import('torch')
+            generator_model = timed_import('generator_model')
             
             self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
             debug_print(f"Using device: {self.device}")
             
-            # Find the model
-            model_path = self.find_regenerator_model()
+            model_path = self.model_path
             
             if not model_path:
                 debug_print("❌ No regenerator model found, regeneration will be disabled")
                 return
             
-            debug_print(f"Loading regenerator model from: {model_path}")
-            
-            # YOUR EXACT Generator architecture from the notebook
-            class ResidualBlock(nn.Module):
-                def __init__(self, channels):
-                    super().__init__()
-                    self.conv1 = nn.Conv2d(channels, channels, 3, 1, 1, bias=False)
-                    self.bn1 = nn.BatchNorm2d(channels)
-                    self.conv2 = nn.Conv2d(channels, channels, 3, 1, 1, bias=False)
-                    self.bn2 = nn.BatchNorm2d(channels)
-
-                def forward(self, x):
-                    residual = x
-                    out = F.relu(self.bn1(self.conv1(x)))
-                    out = self.bn2(self.conv2(out))
-                    return F.relu(out + residual)
-
-            class Generator(nn.Module):
-                def __init__(self, input_channels=3, output_channels=3):
-                    super().__init__()
-                    
-                    # Encoder with proper normalization
-                    self.enc1 = self._make_layer(input_channels, 64)  # 128 -> 64
-                    self.enc2 = self._make_layer(64, 128)  # 64 -> 32
-                    self.enc3 = self._make_layer(128, 256)  # 32 -> 16
-                    self.enc4 = self._make_layer(256, 512)  # 16 -> 8
-                    
-                    # Fixed bottleneck with proper residual blocks
-                    self.bottleneck = nn.Sequential(
-                        ResidualBlock(512),
-                        ResidualBlock(512),
-                        ResidualBlock(512),
-                    )
-                    
-                    # Separate attention mechanism
-                    self.attention = nn.Sequential(
-                        nn.AdaptiveAvgPool2d(1),
-                        nn.Conv2d(512, 512//16, 1),
-                        nn.ReLU(inplace=True),
-                        nn.Conv2d(512//16, 512, 1),
-                        nn.Sigmoid(),
-                    )
-                    
-                    # Decoder with skip connections
-                    self.dec4 = self._make_decoder_layer(1024, 256)  # 8 -> 16
-                    self.dec3 = self._make_decoder_layer(512, 128)   # 16 -> 32
-                    self.dec2 = self._make_decoder_layer(256, 64)    # 32 -> 64
-                    self.dec1 = self._make_decoder_layer(128, 64)    # 64 -> 128
-                    
-                    # Final layers for better color control
-                    self.final_conv = nn.Sequential(
-                        nn.Conv2d(64, 32, 3, 1, 1),
-                        nn.BatchNorm2d(32),
-                        nn.ReLU(inplace=True),
-                        nn.Conv2d(32, output_channels, 3, 1, 1),
-                        nn.Tanh(),
-                    )
-                
-                def _make_layer(self, in_channels, out_channels):
-                    return nn.Sequential(
-                        nn.Conv2d(in_channels, out_channels, 4, 2, 1, bias=False),
-                        nn.BatchNorm2d(out_channels),
-                        nn.LeakyReLU(0.2, inplace=True),
-                    )
+            from model_artifacts import (
+                GENERATOR_SUFFIX, QUANTIZED_GENERATOR_SUFFIX, find_artifact, load_generator_artifact, resolve_precision
+            )
+            artifact = None
+            if self.use_artifacts and resolve_precision(self.precision) == 'int8':
+                artifact = find_artifact(model_path, QUANTIZED_GENERATOR_SUFFIX)
+                if artifact:
+                    # Quantized kernels only exist on CPU
+                    self.device = torch.device('cpu')
+                else:
+                    debug_print("No INT8 generator found, using FP32")
+            if self.use_artifacts and not artifact:
+                artifact = find_artifact(model_path, GENERATOR_SUFFIX)
+            
+            if artifact:
+                # Exported TorchScript already carries the weights
+                model = load_generator_artifact(artifact, self.device)
+                checkpoint = None
+            else:
+                debug_print(f"Loading regenerator model from: {model_path}")
                 
-                def _make_decoder_layer(self, in_channels, out_channels):
-                    return nn.Sequential(
-                        nn.ConvTranspose2d(in_channels, out_channels, 4, 2, 1, bias=False),
-                        nn.BatchNorm2d(out_channels),
-                        nn.ReLU(inplace=True),
-                    )
+                # Initialize model with YOUR EXACT architecture
+                model = generator_model.Generator()
                 
-                def forward(self, x):
-                    # Encoder
-                    e1 = self.enc1(x)    # [B, 64, 64, 64]
-                    e2 = self.enc2(e1)   # [B, 128, 32, 32]
-                    e3 = self.enc3(e2)   # [B, 256, 16, 16]
-                    e4 = self.enc4(e3)   # [B, 512, 8, 8]
-                    
-                    # Bottleneck
-                    b = self.bottleneck(e4)  # [B, 512, 8, 8]
-                    
-                    # Apply attention
-                    attention_weights = self.attention(e4)  # [B, 512, 1, 1]
-                    b = b * attention_weights  # Broadcast multiply
-                    
-                    # Decoder with skip connections
-                    d4 = self.dec4(torch.cat([b, e4], dim=1))      # [B, 256, 16, 16]
-                    d3 = self.dec3(torch.cat([d4, e3], dim=1))     # [B, 128, 32, 32]
-                    d2 = self.dec2(torch.cat([d3, e2], dim=1))     # [B, 64, 64, 64]
-                    d1 = self.dec1(torch.cat([d2, e1], dim=1))     # [B, 64, 128, 128]
-                    
-                    # Final output with proper color mapping
-                    output = self.final_conv(d1)  # [B, 3, 128, 128]
-                    
-                    return output
-            
-            # Initialize model with YOUR EXACT architecture
-            self.model = Generator()
-            
-            # Load checkpoint
-            checkpoint = torch.load(model_path, map_location=self.device)
+                # Load checkpoint
+                checkpoint = torch.load(model_path, map_location=self.device)
             
             # Handle different checkpoint formats
-            if isinstance(checkpoint, dict):
+            if checkpoint is None:
+                pass
+            elif isinstance(checkpoint, dict):
                 if 'generator_state_dict' in checkpoint:
-                    self.model.load_state_dict(checkpoint['generator_state_dict'])
+                    model.load_state_dict(checkpoint['generator_state_dict'])
                     debug_print("✅ Loaded from 'generator_state_dict'")
                 elif 'model_state_dict' in checkpoint:
-                    self.model.load_state_dict(checkpoint['model_state_dict'])
+                    model.load_state_dict(checkpoint['model_state_dict'])
                     debug_print("✅ Loaded from 'model_state_dict'")
                 elif 'state_dict' in checkpoint:
-                    self.model.load_state_dict(checkpoint['state_dict'])
+                    model.load_state_dict(checkpoint['state_dict'])
                     debug_print("✅ Loaded from 'state_dict'")
                 else:
-                    self.model.load_state_dict(checkpoint)
+                    model.load_state_dict(checkpoint)
                     debug_print("✅ Loaded from checkpoint dict")
             else:
-                self.model.load_state_dict(checkpoint)
+                model.load_state_dict(checkpoint)
                 debug_print("✅ Loaded from direct state dict")
             
-            self.model.to(self.device)
-            self.model.eval()
+            model.to(self.device)
+            model.eval()
             
-            # Transform using ImageNet normalization (from your notebook)
-            self.transform = transforms.Compose([
-                transforms.Resize((128, 128)),
-                transforms.ToTensor(),
-                transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-            ])
+            from graph_optimize import ExecutionMode, optimize
+            execution = ExecutionMode(self.device, self.channels_last, resolve_precision(self.precision))
+            model = execution.prepare(model)
+            example = execution.example(MODEL_SIZE)
+            if checkpoint is not None:
+                # Fold BatchNorm / compile for inference (UNAI_GRAPH_MODE)
+                model = optimize(model, self.graph_mode, example, execution.bf16)
+            model = execution.wrap(model, example)
+            self.execution = execution
+            self.channels_last = execution.channels_last
+            
+            # Inputs use ImageNet normalization (from your notebook), see preprocessing.py
+            self.model = model
             
             debug_print("✅ Regenerator model loaded successfully")
             
@@ -330,9 +442,77 @@ class ImageRegenerator:
             debug_print(f"❌ Error loading regenerator model: {str(e)}")
             self.model = None
     
-    def regenerate(self, img_path, output_path=None):
-        """Regenerate image using absolute paths"""
-        if self.model is None:
+    def default_output_path(self, img_path):
+        """Output path used when the caller does not pass one"""
+        project_root = '/home/varun-kasnia/Documents/Programming Files/Projects/UnAI'
+        output_dir = os.path.join(project_root, 'uploads', 'regenerated')
+        os.makedirs(output_dir, exist_ok=True)
+        base_name = os.path.splitext(os.path.basename(img_path))[0]
+        return os.path.join(output_dir, f"{base_name}_regenerated{self.encoding.extension}")
+    
+    def load_input(self, img_path):
+        """Load and preprocess one image (path, bytes or DecodedImage) into a [3, 128, 128] tensor"""
+        array = generator_batch([decode_image(img_path)], channels_last=bool(self.channels_last))[0]
+        if self.backend == 'onnx':
+            return array
+        import torch
+        return torch.from_numpy(array)
+    
+    def forward(self, inputs):
+        """Run the generator once over a list of preprocessed inputs or a stacked NCHW batch"""
+        if self.backend == 'onnx':
+            return self.model.run(inputs if isinstance(inputs, np.ndarray) else np.stack(inputs))
+        
+        import torch
+        if isinstance(inputs, np.ndarray):
+            input_batch = torch.from_numpy(inputs)
+        else:
+            input_batch = torch.stack(inputs)
+        input_batch = input_batch.to(self.device)
+        with torch.inference_mode():
+            return self.model(input_batch)
+    
+    def to_images(self, output_batch):
+        """Convert a batch of Tanh outputs into PIL images"""
+        if not isinstance(output_batch, np.ndarray):
+            output_batch = output_batch.detach().cpu().numpy()
+        
+        # Postprocess: Tanh output [-1, 1] → [0, 1] → uint8 HWC
+        output_batch = np.clip((output_batch + 1) / 2, 0, 1)
+        output_batch = (output_batch * 255).astype(np.uint8).transpose(0, 2, 3, 1)
+        return [Image.fromarray(array) for array in output_batch]
+    
+    def save_image(self, output_image, output_path):
+        """Encode one regenerated image into a path or file object"""
+        return ENCODER_POOL.save(output_image, self.encoding, output_path)
+    
+    def regenerate_full_resolution(self, img_path, image=None):
+        """Regenerate at the upload's own size by blending overlapping model-sized tiles"""
+        from tiling import regenerate_tiled, DEFAULT_OVERLAP, DEFAULT_TILE_BATCH
+        
+        # A shared decode may have been downscaled by the JPEG draft mode, so
+        # re-read from disk when there is a file (in-memory uploads are decoded
+        # at full size by the caller)
+        source = image.source if image is not None else img_path
+        with stage('decode'):
+            if isinstance(source, str):
+                image = decode_image(source, draft=False)
+            elif image is None:
+                image = decode_image(img_path, draft=False)
+        
+        overlap = int(os.environ.get('UNAI_TILE_OVERLAP', DEFAULT_OVERLAP))
+        batch_size = int(os.environ.get('UNAI_TILE_BATCH', DEFAULT_TILE_BATCH))
+        debug_print(f"Regenerating {image.size[0]}x{image.size[1]} image in tiles (overlap {overlap})")
+        with stage('regenerate'):
+            pixels = regenerate_tiled(self, np.asarray(image.image), overlap=overlap, batch_size=batch_size)
+        return Image.fromarray(pixels)
+    
+    def regenerate(self, img_path, output_path=None, image=None, tiled=False):
+        """Regenerate image using absolute paths (image: an already decoded copy of img_path)
+        
+        tiled: keep the original resolution instead of returning a 128x128 image
+        """
+        if self.ensure_loaded() is None:
             return {
                 'success': False,
                 'output_path': None,
@@ -341,40 +521,34 @@ class ImageRegenerator:
             }
         
         try:
-            import torch
-            from torchvision import transforms
-            
             debug_print(f"Regenerating image: {img_path}")
             
-            # Load and preprocess image
-            image = Image.open(img_path).convert('RGB')
-            input_tensor = self.transform(image).unsqueeze(0).to(self.device)
-            
-            debug_print(f"Input tensor shape: {input_tensor.shape}")
-            
-            # Generate image
-            with torch.no_grad():
-                output_tensor = self.model(input_tensor)
-            
-            debug_print(f"Output tensor shape: {output_tensor.shape}")
-            debug_print(f"Output range: [{output_tensor.min():.3f}, {output_tensor.max():.3f}]")
-            
-            # Postprocess: Tanh output [-1, 1] → [0, 1]
-            output_tensor = (output_tensor + 1) / 2
-            output_tensor = torch.clamp(output_tensor, 0, 1)
-            
-            # Convert to PIL
-            output_image = transforms.ToPILImage()(output_tensor.squeeze(0).cpu())
+            if tiled:
+                output_image = self.regenerate_full_resolution(img_path, image)
+            else:
+                # Load and preprocess image
+                with stage('preprocess'):
+                    input_tensor = self.load_input(image if image is not None else img_path)
+                
+                debug_print(f"Input tensor shape: {tuple(input_tensor.shape)}")
+                
+                # Generate image
+                with stage('regenerate'):
+                    output_tensor = self.forward([input_tensor])
+                
+                debug_print(f"Output tensor shape: {tuple(output_tensor.shape)}")
+                debug_print(f"Output range: [{output_tensor.min():.3f}, {output_tensor.max():.3f}]")
+                
+                output_image = None
             
             # Save with absolute path handling
             if output_path is None:
-                project_root = '/home/varun-kasnia/Documents/Programming Files/Projects/UnAI'
-                output_dir = os.path.join(project_root, 'uploads', 'regenerated')
-                os.makedirs(output_dir, exist_ok=True)
-                base_name = os.path.splitext(os.path.basename(img_path))[0]
-                output_path = os.path.join(output_dir, f"{base_name}_regenerated.jpg")
+                output_path = self.default_output_path(img_path)
             
-            output_image.save(output_path, 'JPEG', quality=95)
+            with stage('encode_save'):
+                if output_image is None:
+                    output_image = self.to_images(output_tensor)[0]
+                self.save_image(output_image, output_path)
             
             debug_print(f"✅ Regenerated image saved to: {output_path}")
             
@@ -392,50 +566,369 @@ class ImageRegenerator:
                 'status': 'error',
                 'error': str(e)
             }
-
-def main():
-    """Main pipeline with clean JSON output"""
-    if len(sys.argv) != 2:
-        safe_print_json({'pipeline_status': 'error', 'error': 'Usage: python detection_pipeline.py <image_path>'})
-        sys.exit(1)
     
-    img_path = sys.argv[1]
+    def regenerate_batch(self, img_paths, output_paths=None, max_workers=4):
+        """Regenerate several images with one forward pass; errors are reported per image"""
+        if output_paths is None:
+            output_paths = [None] * len(img_paths)
+        if len(output_paths) != len(img_paths):
+            raise ValueError('output_paths must have the same length as img_paths')
+        
+        def error_result(e):
+            return {
+                'success': False,
+                'output_path': None,
+                'status': 'error',
+                'error': str(e)
+            }
+        
+        if self.ensure_loaded() is None:
+            return [error_result('Regenerator model not available') for _ in img_paths]
+        
+        from concurrent.futures import ThreadPoolExecutor
+        
+        results = [None] * len(img_paths)
+        
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # Decode in parallel; a bad image only fails its own slot
+            images = []
+            indices = []
+            futures = [executor.submit(decode_image, img_path) for img_path in img_paths]
+            for i, future in enumerate(futures):
+                try:
+                    with stage('decode'):
+                        images.append(future.result())
+                    indices.append(i)
+                except Exception as e:
+                    debug_print(f"❌ Error loading {img_paths[i]}: {str(e)}")
+                    results[i] = error_result(e)
+            
+            if not images:
+                return results
+            
+            try:
+                debug_print(f"Regenerating batch of {len(images)} images")
+                with stage('preprocess'):
+                    inputs = generator_batch(images, out=generator_buffer('generator', generator_shape(len(images)), self.channels_last))
+                with stage('regenerate'):
+                    output_batch = self.forward(inputs)
+                with stage('encode_save'):
+                    output_images = self.to_images(output_batch)
+            except Exception as e:
+                debug_print(f"❌ Error during batch regeneration: {str(e)}")
+                for i in indices:
+                    results[i] = error_result(e)
+                return results
+            
+            # Encode and write in parallel on the shared encoder threads
+            saves = {}
+            for i, output_image in zip(indices, output_images):
+                output_path = output_paths[i] or self.default_output_path(img_paths[i])
+                saves[i] = ENCODER_POOL.submit(self.save_image, output_image, output_path)
+            
+            for i, future in saves.items():
+                try:
+                    with stage('encode_save'):
+                        output_path = future.result()
+                    results[i] = {
+                        'success': True,
+                        'output_path': output_path,
+                        'status': 'success'
+                    }
+                except Exception as e:
+                    debug_print(f"❌ Error saving {img_paths[i]}: {str(e)}")
+                    results[i] = error_result(e)
+        
+        return results
     
-    # Convert to absolute path if relative
-    if not os.path.isabs(img_path):
-        img_path = os.path.abspath(img_path)
+    def regenerate_stream(self, img_paths, output_paths=None, batch_size=8, decode_workers=4):
+        """Yield results for many images with decode, inference and encode overlapped (see streaming.py)"""
+        from streaming import StreamingRegenerator
+        stream = StreamingRegenerator(self, batch_size, decode_workers)
+        return stream.run(img_paths, output_paths)
+
+class Pipeline:
+    """Detection + regeneration pipeline that can be reused across images"""
     
-    debug_print(f"Processing image: {img_path}")
+    def __init__(self, detector=None, regenerator=None, cache=None, backend=None, precision=None, timings=None,
+                 skip_regeneration=False, tiled=None, cascade=None, near_duplicates=None, encoding=None, delivery=None):
+        self.detector = detector
+        self.regenerator = regenerator
+        self.cache = cache
+        # Perceptual-hash index (near_duplicates.py) pointing similar images at cached verdicts
+        self.near_duplicates = near_duplicates if cache is not None else None
+        self.backend = resolve_backend(backend)
+        self.precision = precision
+        self.timings = timings_enabled() if timings is None else timings
+        self.skip_regeneration = skip_regeneration
+        self.tiled = os.environ.get('UNAI_TILED', '0') == '1' if tiled is None else tiled
+        if cascade is None:
+            from cascade import cascade_from_env
+            cascade = cascade_from_env()
+        # (low, high) thresholds of the early-exit cascade, or None for the full model only
+        self.cascade = cascade or None
+        self.encoding = encoding or OutputEncoding()
+        # Default for process(): 'file', or hand the encoded image back in the result ('base64', 'shm')
+        self.delivery = resolve_delivery(delivery)
     
-    if not os.path.exists(img_path):
-        safe_print_json({'pipeline_status': 'error', 'error': f'Image file not found: {img_path}'})
-        sys.exit(1)
+    def get_detector(self):
+        """Build the detector on first use"""
+        if self.detector is None:
+            self.detector = self.build_detector()
+        return self.detector
     
-    try:
-        # Step 1: Initialize detector
+    def build_detector(self):
+        """Plain detector, or the early-exit cascade when thresholds are configured"""
         debug_print("Initializing deepfake detector...")
-        detector = DeepfakeDetector()
+        if self.cascade:
+            from cascade import build_cascade
+            return build_cascade(self.cascade[0], self.cascade[1], backend=self.backend)
+        return DeepfakeDetector(backend=self.backend, precision=self.precision)
+    
+    def get_regenerator(self):
+        """Build the regenerator on first use (only needed for deepfakes)"""
+        if self.regenerator is None:
+            self.regenerator = ImageRegenerator(backend=self.backend, precision=self.precision, encoding=self.encoding)
+        return self.regenerator
+    
+    def cache_variant(self, kind):
+        """Part of the cache key that depends on how the models are run"""
+        from model_artifacts import resolve_precision
+        parts = []
+        precision = resolve_precision(self.precision)
+        if precision != 'fp32':
+            parts.append(precision)
+        if kind == 'detection' and self.cascade:
+            parts.append(f"cascade{self.cascade[0]}-{self.cascade[1]}")
+        if kind == 'regeneration' and self.tiled:
+            parts.append('tiled')
+        if kind == 'regeneration' and self.encoding.variant():
+            # The cached blob is the encoded file
+            parts.append(self.encoding.variant())
+        return '-'.join(parts) or None
+    
+    @staticmethod
+    def select(model, image_hash):
+        """The version serving this image when the model is a VersionRouter (model_registry.py)"""
+        return model.choose(image_hash) if hasattr(model, 'choose') else model
+    
+    @staticmethod
+    def record_version(router, model, result, started):
+        if model is not router:
+            router.record(model, time.perf_counter() - started)
+            result['model_version'] = model.model_version
+    
+    def is_cached(self, kind, image_hash):
+        """Whether the cache holds a result of this stage for an image hash"""
+        if kind == 'detection':
+            model_path = self.select(self.get_detector(), image_hash).model_path
+        else:
+            model_path = self.select(self.get_regenerator(), image_hash).model_path
+        key = self.cache.make_key(kind, image_hash, model_path, self.cache_variant(kind))
+        cached, blob = self.cache.get(key)
+        return cached is not None and (kind == 'detection' or bool(blob))
+    
+    def find_near_duplicate(self, image, image_hash):
+        """(match, hashes): an indexed near-duplicate with a cached verdict, or the hashes to index this image under"""
+        if self.near_duplicates is None or not image_hash:
+            return None, None
+        from near_duplicates import perceptual_hashes
+        
+        with stage('near_duplicate'):
+            hashes = perceptual_hashes(image)
+            match = self.near_duplicates.best(*hashes)
+        if match is None:
+            return None, hashes
+        if match['image_sha256'] == image_hash:
+            # This exact image is already indexed
+            return None, None
+        if not self.is_cached('detection', match['image_sha256']):
+            # Its verdict has been evicted; analyse this image and index it instead
+            return None, hashes
+        debug_print(f"Near-duplicate of {match['image_sha256'][:12]} (distance {match['distance']})")
+        return match, None
+    
+    def detect(self, img_path, image_hash=None, image=None):
+        """Detection step, answered from the cache when possible"""
+        router = self.get_detector()
+        detector = self.select(router, image_hash)
+        key = None
+        if self.cache is not None and image_hash:
+            key = self.cache.make_key('detection', image_hash, detector.model_path, self.cache_variant('detection'))
+            cached, _ = self.cache.get(key)
+            if cached is not None:
+                debug_print("Detection cache hit")
+                return cached
         
-        # Step 2: Detect deepfake
         debug_print("Running deepfake detection...")
-        detection_result = detector.detect(img_path)
+        started = time.perf_counter()
+        detection_result = detector.detect(image if image is not None else img_path)
+        if detection_result['status'] == 'success':
+            self.record_version(router, detector, detection_result, started)
+        if key is not None and detection_result['status'] == 'success':
+            self.cache.put(key, detection_result)
+        return detection_result
+    
+    def regenerate(self, img_path, image_hash=None, image=None, output=None):
+        """Regeneration step, answered from the cache when possible
+        
+        output: file object that receives the JPEG instead of the uploads folder
+        """
+        router = self.get_regenerator()
+        regenerator = self.select(router, image_hash)
+        key = None
+        if self.cache is not None and image_hash:
+            key = self.cache.make_key('regeneration', image_hash, regenerator.model_path, self.cache_variant('regeneration'))
+            cached, blob = self.cache.get(key)
+            if cached is not None and blob:
+                debug_print("Regeneration cache hit")
+                if output is not None:
+                    with open(blob, 'rb') as f:
+                        shutil.copyfileobj(f, output)
+                    return dict(cached, output_path=None)
+                output_path = regenerator.default_output_path(img_path)
+                shutil.copyfile(blob, output_path)
+                return dict(cached, output_path=output_path)
+        
+        started = time.perf_counter()
+        regeneration_result = regenerator.regenerate(img_path, output, image=image, tiled=self.tiled)
+        if regeneration_result['success']:
+            self.record_version(router, regenerator, regeneration_result, started)
+        if output is not None:
+            regeneration_result['output_path'] = None
+        if key is not None and regeneration_result['success']:
+            if output is not None:
+                self.cache.put(key, regeneration_result, blob_bytes=output.getvalue())
+            else:
+                self.cache.put(key, regeneration_result, blob_source=regeneration_result['output_path'])
+        return regeneration_result
+    
+    def process(self, img_path, timings=None, delivery=None):
+        """Run detection and, if needed, regeneration for one image (timings: attach per-stage timings)
+        
+        delivery: 'file', 'base64' or 'shm' (see image_encoding.py), default self.delivery
+        """
+        return self.timed(self.run, timings, img_path, resolve_delivery(delivery or self.delivery))
+    
+    def process_data(self, data, output=None, timings=None):
+        """Like process(), for an upload held in memory; a regenerated image is written to output"""
+        return self.timed(self.run_data, timings, data, output or io.BytesIO())
+    
+    def timed(self, run, timings, *args):
+        if timings is None:
+            timings = self.timings
+        
+        with record_timings(timings) as recorder:
+            result = run(*args)
+        
+        METRICS.count_request(result['pipeline_status'])
+        if recorder is not None:
+            result['timings'] = recorder.to_dict()
+        return result
+    
+    def run(self, img_path, delivery='file'):
+        """Pipeline body behind process()"""
+        # Convert to absolute path if relative
+        if not os.path.isabs(img_path):
+            img_path = os.path.abspath(img_path)
+        
+        debug_print(f"Processing image: {img_path}")
+        
+        if not os.path.exists(img_path):
+            return {'pipeline_status': 'error', 'error': f'Image file not found: {img_path}'}
+        
+        try:
+            image_hash = None
+            if self.cache is not None:
+                from result_cache import file_sha256
+                image_hash = file_sha256(img_path)
+            
+            # Decode once; detection and regeneration share the pixels
+            try:
+                with stage('decode'):
+                    image = decode_image(img_path)
+            except Exception as e:
+                return {
+                    'pipeline_status': 'error',
+                    'error': f"Error preprocessing image: {str(e)}"
+                }
+            
+            # Other deliveries skip the uploads folder: the image is encoded in memory
+            output = io.BytesIO() if delivery != 'file' else None
+            result = self.analyze(img_path, image, image_hash, output)
+            regeneration = result.get('regeneration')
+            if output is not None and regeneration and regeneration['success']:
+                regeneration.update(deliver(output.getvalue(), self.encoding, delivery))
+            return result
+            
+        except Exception as e:
+            debug_print(f"Pipeline error: {str(e)}")
+            return {
+                'pipeline_status': 'error',
+                'error': str(e)
+            }
+    
+    def run_data(self, data, output):
+        """Pipeline body behind process_data()"""
+        try:
+            image_hash = None
+            if self.cache is not None:
+                import hashlib
+                image_hash = hashlib.sha256(data).hexdigest()
+            
+            # Tiled regeneration needs the full-size pixels, so skip the JPEG draft shortcut
+            try:
+                with stage('decode'):
+                    image = decode_image(data, draft=False if self.tiled else None)
+            except Exception as e:
+                return {
+                    'pipeline_status': 'error',
+                    'error': f"Error preprocessing image: {str(e)}"
+                }
+            
+            return self.analyze('<upload>', image, image_hash, output)
+            
+        except Exception as e:
+            debug_print(f"Pipeline error: {str(e)}")
+            return {
+                'pipeline_status': 'error',
+                'error': str(e)
+            }
+    
+    def analyze(self, img_path, image, image_hash=None, output=None):
+        """Detection and, for deepfakes, regeneration of an already decoded image"""
+        # Near-duplicates of an analysed image reuse its cached results
+        near_duplicate, hashes = self.find_near_duplicate(image, image_hash)
+        lookup_hash = near_duplicate['image_sha256'] if near_duplicate else image_hash
+        
+        # Step 1: Detect deepfake
+        detection_result = self.detect(img_path, lookup_hash, image)
         
         if detection_result['status'] == 'error':
-            safe_print_json({
+            return {
                 'pipeline_status': 'error',
                 'error': detection_result['error']
-            })
-            sys.exit(1)
+            }
+        
+        if near_duplicate:
+            detection_result = dict(detection_result, near_duplicate=near_duplicate)
+        elif hashes is not None and self.is_cached('detection', image_hash):
+            self.near_duplicates.add(hashes[0], hashes[1], image_hash)
         
         debug_print(f"Detection result: {detection_result}")
         
-        # Step 3: Regenerate if deepfake detected
+        # Step 2: Regenerate if deepfake detected
         regeneration_result = None
-        if detection_result['is_deepfake']:
+        if detection_result['is_deepfake'] and self.skip_regeneration:
+            debug_print("Deepfake detected, regeneration disabled")
+        elif detection_result['is_deepfake']:
             debug_print("Deepfake detected! Starting regeneration...")
             try:
-                regenerator = ImageRegenerator()
-                regeneration_result = regenerator.regenerate(img_path)
+                if near_duplicate and self.is_cached('regeneration', lookup_hash):
+                    regeneration_result = dict(self.regenerate(img_path, lookup_hash, image, output),
+                                               near_duplicate=near_duplicate)
+                else:
+                    regeneration_result = self.regenerate(img_path, image_hash, image, output)
                 debug_print(f"Regeneration result: {regeneration_result}")
             except Exception as e:
                 debug_print(f"Regeneration error: {str(e)}")
@@ -448,22 +941,30 @@ def main():
         else:
             debug_print("Image is authentic - no regeneration needed")
         
-        # Step 4: Output clean JSON result (ONLY TO STDOUT)
-        result = {
+        return {
             'detection': detection_result,
             'regeneration': regeneration_result,
             'pipeline_status': 'success'
         }
-        
-        safe_print_json(result)
-        
-    except Exception as e:
-        debug_print(f"Pipeline error: {str(e)}")
-        safe_print_json({
-            'pipeline_status': 'error',
-            'error': str(e)
-        })
+
+def main():
+    """Main pipeline with clean JSON output"""
+    if len(sys.argv) != 2:
+        safe_print_json({'pipeline_status': 'error', 'error': 'Usage: python detection_pipeline.py <image_path>'})
+        sys.exit(1)
+    
+    from result_cache import cache_from_env
+    
+    result = Pipeline(cache=cache_from_env()).process(sys.argv[1])
+    
+    if IMPORT_TIMINGS:
+        debug_print(f"Import timings (ms): {IMPORT_TIMINGS}")
+    
+    # Output clean JSON result (ONLY TO STDOUT)
+    safe_print_json(result)
+    
+    if result['pipeline_status'] == 'error':
         sys.exit(1)
 
 if __name__ == "__main__":
-    main()
+    main()
\ No newline at end of file
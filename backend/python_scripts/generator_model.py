@@ -0,0 +1,100 @@
+# Generator architecture for the regeneration stage. Lives in its own module
+# so torch is only imported once a regeneration is actually needed.
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+# YOUR EXACT Generator architecture from the notebook
+class ResidualBlock(nn.Module):
+    def __init__(self, channels):
+        super().__init__()
+        self.conv1 = nn.Conv2d(channels, channels, 3, 1, 1, bias=False)
+        self.bn1 = nn.BatchNorm2d(channels)
+        self.conv2 = nn.Conv2d(channels, channels, 3, 1, 1, bias=False)
+        self.bn2 = nn.BatchNorm2d(channels)
+
+    def forward(self, x):
+        residual = x
+        out = F.relu(self.bn1(self.conv1(x)))
+        out = self.bn2(self.conv2(out))
+        return F.relu(out + residual)
+
+class Generator(nn.Module):
+    def __init__(self, input_channels=3, output_channels=3):
+        super().__init__()
+
+        # Encoder with proper normalization
+        self.enc1 = self._make_layer(input_channels, 64)  # 128 -> 64
+        self.enc2 = self._make_layer(64, 128)  # 64 -> 32
+        self.enc3 = self._make_layer(128, 256)  # 32 -> 16
+        self.enc4 = self._make_layer(256, 512)  # 16 -> 8
+
+        # Fixed bottleneck with proper residual blocks
+        self.bottleneck = nn.Sequential(
+            ResidualBlock(512),
+            ResidualBlock(512),
+            ResidualBlock(512),
+        )
+
+        # Separate attention mechanism
+        self.attention = nn.Sequential(
+            nn.AdaptiveAvgPool2d(1),
+            nn.Conv2d(512, 512//16, 1),
+            nn.ReLU(inplace=True),
+            nn.Conv2d(512//16, 512, 1),
+            nn.Sigmoid(),
+        )
+
+        # Decoder with skip connections
+        self.dec4 = self._make_decoder_layer(1024, 256)  # 8 -> 16
+        self.dec3 = self._make_decoder_layer(512, 128)   # 16 -> 32
+        self.dec2 = self._make_decoder_layer(256, 64)    # 32 -> 64
+        self.dec1 = self._make_decoder_layer(128, 64)    # 64 -> 128
+
+        # Final layers for better color control
+        self.final_conv = nn.Sequential(
+            nn.Conv2d(64, 32, 3, 1, 1),
+            nn.BatchNorm2d(32),
+            nn.ReLU(inplace=True),
+            nn.Conv2d(32, output_channels, 3, 1, 1),
+            nn.Tanh(),
+        )
+
+    def _make_layer(self, in_channels, out_channels):
+        return nn.Sequential(
+            nn.Conv2d(in_channels, out_channels, 4, 2, 1, bias=False),
+            nn.BatchNorm2d(out_channels),
+            nn.LeakyReLU(0.2, inplace=True),
+        )
+
+    def _make_decoder_layer(self, in_channels, out_channels):
+        return nn.Sequential(
+            nn.ConvTranspose2d(in_channels, out_channels, 4, 2, 1, bias=False),
+            nn.BatchNorm2d(out_channels),
+            nn.ReLU(inplace=True),
+        )
+
+    def forward(self, x):
+        # Encoder
+        e1 = self.enc1(x)    # [B, 64, 64, 64]
+        e2 = self.enc2(e1)   # [B, 128, 32, 32]
+        e3 = self.enc3(e2)   # [B, 256, 16, 16]
+        e4 = self.enc4(e3)   # [B, 512, 8, 8]
+
+        # Bottleneck
+        b = self.bottleneck(e4)  # [B, 512, 8, 8]
+
+        # Apply attention
+        attention_weights = self.attention(e4)  # [B, 512, 1, 1]
+        b = b * attention_weights  # Broadcast multiply
+
+        # Decoder with skip connections
+        d4 = self.dec4(torch.cat([b, e4], dim=1))      # [B, 256, 16, 16]
+        d3 = self.dec3(torch.cat([d4, e3], dim=1))     # [B, 128, 32, 32]
+        d2 = self.dec2(torch.cat([d3, e2], dim=1))     # [B, 64, 64, 64]
+        d1 = self.dec1(torch.cat([d2, e1], dim=1))     # [B, 64, 128, 128]
+
+        # Final output with proper color mapping
+        output = self.final_conv(d1)  # [B, 3, 128, 128]
+
+        return output
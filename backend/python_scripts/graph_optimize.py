@@ -0,0 +1,391 @@
+import os
+import sys
+import copy
+import json
+import time
+import math
+import argparse
+import warnings
+
+import torch
+import torch.nn as nn
+import torch.fx
+
+from console import debug_print
+
+# How the generators run at serve time (UNAI_GRAPH_MODE):
+#   eager    the model as trained
+#   fold     BatchNorm folded into the preceding Conv2d/ConvTranspose2d (exact, default)
+#   script   fold + frozen TorchScript with optimize_for_inference (oneDNN conv+activation fusion)
+#   compile  fold + torch.compile with weight freezing (Inductor fuses the pointwise tails)
+MODES = ('eager', 'fold', 'script', 'compile')
+DEFAULT_MODE = 'fold'
+# Largest output difference, on the Tanh [-1, 1] scale, accepted from an optimized build
+PARITY_TOLERANCE = 1e-3
+
+def resolve_mode(mode=None):
+    mode = mode or os.environ.get('UNAI_GRAPH_MODE', DEFAULT_MODE)
+    if mode not in MODES:
+        raise ValueError(f"Unknown graph mode: {mode}")
+    return mode
+
+def fold_conv_bn(conv, bn):
+    """Copy of conv with an eval-mode BatchNorm2d that follows it folded into its weight and bias"""
+    if conv.groups != 1 and isinstance(conv, nn.ConvTranspose2d):
+        return None
+    with torch.no_grad():
+        scale = torch.rsqrt(bn.running_var + bn.eps)
+        shift = -bn.running_mean * scale
+        if bn.affine:
+            scale = scale * bn.weight
+            shift = shift * bn.weight + bn.bias
+        bias = conv.bias if conv.bias is not None else torch.zeros_like(bn.running_mean)
+
+        fused = copy.deepcopy(conv)
+        # Output channels are dim 0 of a Conv2d weight and dim 1 of a ConvTranspose2d weight
+        shape = (1, -1, 1, 1) if isinstance(conv, nn.ConvTranspose2d) else (-1, 1, 1, 1)
+        fused.weight = nn.Parameter(conv.weight * scale.reshape(shape), requires_grad=False)
+        fused.bias = nn.Parameter(bias * scale + shift, requires_grad=False)
+    return fused
+
+class SliceTracer(torch.fx.Tracer):
+    """FX tracer that also follows calls to slices like self.encoder[0:2]
+
+    A slice is a new Sequential that is not registered on the model, which
+    the stock tracer refuses; its layers are, so tracing through it works.
+    """
+
+    def path_of_module(self, mod):
+        try:
+            return super().path_of_module(mod)
+        except NameError:
+            if isinstance(mod, nn.Sequential):
+                return '<slice>'
+            raise
+
+def fold_batchnorm(model):
+    """(GraphModule, folded count): the model traced with every Conv -> BatchNorm pair folded"""
+    graph = SliceTracer().trace(model)
+    module = torch.fx.GraphModule(model, graph)
+    modules = dict(module.named_modules())
+    calls = {}
+    for node in module.graph.nodes:
+        if node.op == 'call_module':
+            calls[node.target] = calls.get(node.target, 0) + 1
+
+    folded = 0
+    for node in list(module.graph.nodes):
+        if node.op != 'call_module' or not isinstance(modules[node.target], nn.BatchNorm2d):
+            continue
+        source = node.args[0]
+        if not isinstance(source, torch.fx.Node) or source.op != 'call_module':
+            continue
+        conv = modules[source.target]
+        # The conv's output must only feed this BatchNorm, and the conv must not be reused elsewhere
+        if not isinstance(conv, (nn.Conv2d, nn.ConvTranspose2d)) or len(source.users) != 1 or calls[source.target] != 1:
+            continue
+        fused = fold_conv_bn(conv, modules[node.target])
+        if fused is None:
+            continue
+
+        parent_name, _, name = source.target.rpartition('.')
+        setattr(module.get_submodule(parent_name) if parent_name else module, name, fused)
+        modules[source.target] = fused
+        node.replace_all_uses_with(source)
+        module.graph.erase_node(node)
+        folded += 1
+
+    module.graph.lint()
+    module.delete_all_unused_submodules()
+    module.recompile()
+    return module, folded
+
+def build(model, mode, example):
+    """The optimized form of an eval-mode model for one mode"""
+    if mode == 'eager':
+        return model
+    optimized, folded = fold_batchnorm(model)
+    debug_print(f"Folded {folded} BatchNorm layers")
+    if mode == 'script':
+        # freeze/optimize_for_inference warn that they are deprecated in favour of torch.compile
+        with warnings.catch_warnings(), torch.no_grad():
+            warnings.simplefilter('ignore')
+            optimized = torch.jit.optimize_for_inference(torch.jit.freeze(torch.jit.trace(optimized, example)))
+    elif mode == 'compile':
+        optimized = torch.compile(optimized, dynamic=True, options={'freezing': True})
+    return optimized
+
+def max_difference(a, b):
+    return float((a.float() - b.float()).abs().max())
+
+def optimize(model, mode=None, example=None, autocast=False):
+    """Optimized inference build of a generator, checked against the eager model
+
+    Falls back to the eager model if the build fails or its output drifts
+    more than PARITY_TOLERANCE from the original on the example input.
+    autocast: the build will run under bf16 autocast
+    """
+    mode = resolve_mode(mode)
+    if mode == 'eager':
+        return model
+    if mode == 'script' and autocast:
+        # optimize_for_inference prepacks the weights as fp32 oneDNN tensors, which bf16 inputs cannot use
+        debug_print("Frozen TorchScript cannot run under bf16 autocast, folding BatchNorm only")
+        mode = 'fold'
+    model.eval()
+    if example is None:
+        device = next(model.parameters()).device
+        example = torch.zeros(1, 3, 128, 128, device=device)
+
+    try:
+        with torch.inference_mode():
+            reference = model(example)
+        optimized = build(model, mode, example)
+        with torch.inference_mode():
+            # Also warms up script/compile, which specialise on the first calls
+            difference = max_difference(optimized(example), reference)
+    except Exception as e:
+        debug_print(f"Graph optimization ({mode}) failed, using the eager model: {str(e)}")
+        return model
+
+    if difference > PARITY_TOLERANCE:
+        debug_print(f"Graph optimization ({mode}) changed outputs by {difference:.2e}, using the eager model")
+        return model
+    return optimized
+
+# Execution modes on top of the graph build. Both are opt-in because bf16 changes the arithmetic:
+#   UNAI_CHANNELS_LAST=1   NHWC activations end to end, so oneDNN convolutions skip their layout reorders
+#   UNAI_PRECISION=bf16    bfloat16 autocast, only where the device has native bf16 (AVX512-BF16/AMX on CPU)
+# A mode whose output drops below MIN_PSNR_DB against fp32 on the load-time check falls back to fp32
+MIN_PSNR_DB = 35.0
+
+def bf16_supported(device):
+    """Whether bfloat16 runs on native kernels on this device rather than being emulated"""
+    try:
+        if device.type == 'cuda':
+            return torch.cuda.is_bf16_supported()
+        return torch.ops.mkldnn._is_mkldnn_bf16_supported()
+    except Exception:
+        return False
+
+def finite(db):
+    """PSNR for JSON reports: identical outputs (infinite PSNR) become None"""
+    return None if db is None or math.isinf(db) else round(db, 2)
+
+def to_uint8(output):
+    """Tanh output batch [-1, 1] as uint8, the way it ends up in the saved image"""
+    return (torch.clamp((output.float().cpu() + 1) / 2, 0, 1) * 255).to(torch.uint8).numpy()
+
+class ModeRunner(nn.Module):
+    """Runs a generator in an ExecutionMode; callers keep calling model(batch)"""
+
+    def __init__(self, model, mode):
+        super().__init__()
+        self.model = model
+        self.mode = mode
+
+    def forward(self, x):
+        if self.mode.channels_last:
+            # No-op for batches preprocessing already laid out NHWC
+            x = x.contiguous(memory_format=torch.channels_last)
+        with self.mode.autocast():
+            output = self.model(x)
+        return output.float()
+
+class ExecutionMode:
+    """Memory format and autocast dtype a loaded generator runs with"""
+
+    def __init__(self, device, channels_last=None, precision=None):
+        if channels_last is None:
+            channels_last = os.environ.get('UNAI_CHANNELS_LAST', '0') == '1'
+        precision = precision or os.environ.get('UNAI_PRECISION', 'fp32')
+        self.device = device
+        self.channels_last = channels_last
+        self.bf16 = precision == 'bf16'
+        self.psnr = None
+        if self.bf16 and not bf16_supported(device):
+            debug_print(f"No native bfloat16 on {device}, running the generator in fp32")
+            self.bf16 = False
+
+    @property
+    def name(self):
+        parts = (['channels_last'] if self.channels_last else []) + (['bf16'] if self.bf16 else [])
+        return '+'.join(parts) or 'fp32'
+
+    def autocast(self):
+        return torch.autocast(self.device.type, dtype=torch.bfloat16, enabled=self.bf16)
+
+    def prepare(self, model):
+        """Model with its weights in the mode's memory format (before graph optimization)"""
+        if self.channels_last:
+            model = model.to(memory_format=torch.channels_last)
+        return model
+
+    def example(self, size):
+        """Fixed random input batch for load-time checks"""
+        generator = torch.Generator().manual_seed(0)
+        example = torch.randn(1, 3, size[1], size[0], generator=generator).to(self.device)
+        if self.channels_last:
+            example = example.contiguous(memory_format=torch.channels_last)
+        return example
+
+    def wrap(self, model, example):
+        """model itself for plain fp32, else a ModeRunner checked against fp32 on example"""
+        if self.name == 'fp32':
+            return model
+        from quantize_models import psnr
+
+        runner = ModeRunner(model, self)
+        try:
+            with torch.inference_mode():
+                reference = to_uint8(model(example))
+                self.psnr = psnr(reference, to_uint8(runner(example)))
+        except Exception as e:
+            debug_print(f"Execution mode {self.name} failed, running in fp32: {str(e)}")
+            self.bf16 = False
+            return self.wrap(model, example)
+
+        agreement = 'identical to fp32' if math.isinf(self.psnr) else f'PSNR vs fp32 {self.psnr:.1f} dB'
+        debug_print(f"Generator runs {self.name}, {agreement}")
+        if self.psnr < MIN_PSNR_DB:
+            debug_print(f"PSNR below {MIN_PSNR_DB} dB, running the generator in fp32")
+            self.bf16 = False
+            return self.wrap(model, example)
+        return runner
+
+    def describe(self):
+        return {'mode': self.name, 'psnr_db': finite(self.psnr)}
+
+EXECUTION_MODES = {
+    'fp32': (False, 'fp32'),
+    'channels_last': (True, 'fp32'),
+    'bf16': (False, 'bf16'),
+    'channels_last+bf16': (True, 'bf16'),
+}
+
+def compare_execution(model, inputs, graph_mode=None, repeat=10):
+    """Latency and PSNR against fp32 of every execution mode on one input batch"""
+    from quantize_models import psnr
+
+    model.eval()
+    device = next(model.parameters()).device
+    inputs = inputs.to(device)
+    report = {}
+    reference = None
+    for name, (channels_last, precision) in EXECUTION_MODES.items():
+        mode = ExecutionMode(device, channels_last, precision)
+        if mode.name != name:
+            report[name] = {'error': f'Not supported on {device}'}
+            continue
+        example = mode.example(inputs.shape[:1:-1])
+        built = mode.wrap(optimize(mode.prepare(copy.deepcopy(model)), graph_mode, example, mode.bf16), example)
+        with torch.inference_mode():
+            output = to_uint8(built(inputs))
+            samples = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                built(inputs)
+                samples.append((time.perf_counter() - start) * 1000)
+        if reference is None:
+            reference = output
+        samples.sort()
+        report[name] = {
+            'active': mode.name,
+            'batch_ms': round(samples[len(samples) // 2], 3),
+            'psnr_db': finite(psnr(reference, output)),
+        }
+    return report
+
+def compare(model, example, modes=MODES, repeat=10, batch_sizes=(1, 8)):
+    """Build time, parity and latency of every mode against the eager model"""
+    model.eval()
+    report = {}
+    for mode in modes:
+        start = time.perf_counter()
+        try:
+            optimized = build(model, mode, example)
+            with torch.inference_mode():
+                difference = max_difference(optimized(example), model(example))
+        except Exception as e:
+            report[mode] = {'error': str(e)}
+            continue
+        entry = {
+            'build_s': round(time.perf_counter() - start, 3),
+            'max_abs_diff': difference,
+            'parity': difference <= PARITY_TOLERANCE,
+        }
+        for batch_size in batch_sizes:
+            batch = example[:1].repeat(batch_size, 1, 1, 1)
+            with torch.inference_mode():
+                optimized(batch)
+                samples = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    optimized(batch)
+                    samples.append((time.perf_counter() - start) * 1000)
+            samples.sort()
+            entry[f'batch{batch_size}_ms'] = round(samples[len(samples) // 2], 3)
+        report[mode] = entry
+    return report
+
+def stand_in_models():
+    """Both generator architectures with random weights and non-trivial BatchNorm statistics"""
+    import generator_model
+    import regenerator
+
+    models = {
+        'generator': (generator_model.Generator(), torch.randn(1, 3, 128, 128)),
+        'unet': (regenerator.ImageRegenerator(), torch.randn(1, 3, 256, 256)),
+    }
+    for model, example in models.values():
+        # Running stats of a fresh BatchNorm are the identity; a few training-mode
+        # passes give them real values so the parity check means something
+        model.train()
+        with torch.no_grad():
+            for _ in range(3):
+                model(torch.randn(4, *example.shape[1:]))
+        model.eval()
+    return models
+
+def main():
+    parser = argparse.ArgumentParser(description='Parity and latency of the optimized generator builds')
+    parser.add_argument('--generator', help='Generator checkpoint (default: randomly initialised stand-ins)')
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=['eager', 'fold', 'script'],
+                        help='Modes to compare (compile takes a minute or more to build)')
+    parser.add_argument('--execution', action='store_true',
+                        help='Compare the channels_last/bf16 execution modes (PSNR vs fp32) instead')
+    parser.add_argument('--images', nargs='+', help='Inputs for --execution with --generator (default: random)')
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    if args.generator:
+        from detection_pipeline import ImageRegenerator, expand_image_paths
+        regenerator = ImageRegenerator(lazy=False, use_artifacts=False, model_path=args.generator, graph_mode='eager',
+                                       precision='fp32', channels_last=False)
+        if regenerator.model is None:
+            print(json.dumps({'error': f'Could not load {args.generator}'}))
+            sys.exit(1)
+        inputs = torch.randn(4, 3, 128, 128)
+        if args.images:
+            from preprocessing import decode_image, generator_batch
+            inputs = torch.from_numpy(generator_batch([decode_image(p) for p in expand_image_paths(args.images)]))
+        models = {'generator': (regenerator.model.cpu(), inputs)}
+    else:
+        models = stand_in_models()
+        models = {name: (model, torch.randn(4, *example.shape[1:])) for name, (model, example) in models.items()}
+
+    if args.execution:
+        report = {name: compare_execution(model, inputs, repeat=args.repeat) for name, (model, inputs) in models.items()}
+        print(json.dumps(report), flush=True)
+        return
+
+    report = {name: compare(model, inputs[:1], args.modes, args.repeat) for name, (model, inputs) in models.items()}
+    print(json.dumps(report), flush=True)
+    failed = [f'{name}/{mode}' for name, modes in report.items() for mode, r in modes.items() if not r.get('parity', True)]
+    if failed:
+        debug_print(f"Parity check failed: {', '.join(failed)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
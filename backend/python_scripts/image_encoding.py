@@ -0,0 +1,236 @@
+import io
+import os
+import uuid
+import time
+import base64
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Output format -> (PIL format, file extension, content type)
+FORMATS = {
+    'jpeg': ('JPEG', '.jpg', 'image/jpeg'),
+    'webp': ('WEBP', '.webp', 'image/webp'),
+    'png': ('PNG', '.png', 'image/png'),
+}
+DEFAULT_FORMAT = 'jpeg'
+DEFAULT_QUALITY = 95
+
+# How a regenerated image reaches the caller:
+#   file    written to output_path (the uploads folder by default)
+#   base64  encoded bytes in the JSON result as image_base64
+#   shm     written to a file in /dev/shm (RAM, no disk I/O) returned as shm_path; see ShmResults
+DELIVERIES = ('file', 'base64', 'shm')
+SHM_DIR = '/dev/shm'
+SHM_TTL_S = 300
+SHM_MAX_FILES = 256
+
+def env_flag(name):
+    return os.environ.get(name, '0') == '1'
+
+class OutputEncoding:
+    """Format and encoder options for regenerated images
+
+    Unset options come from UNAI_OUTPUT_FORMAT (jpeg, webp or png),
+    UNAI_OUTPUT_QUALITY, UNAI_OUTPUT_OPTIMIZE and UNAI_OUTPUT_PROGRESSIVE.
+    The defaults write the same JPEG q95 files as before.
+    """
+
+    def __init__(self, format=None, quality=None, optimize=None, progressive=None):
+        format = (format or os.environ.get('UNAI_OUTPUT_FORMAT', DEFAULT_FORMAT)).lower()
+        format = 'jpeg' if format == 'jpg' else format
+        if format not in FORMATS:
+            raise ValueError(f"Unknown output format: {format}")
+        self.format = format
+        self.quality = int(quality if quality is not None else os.environ.get('UNAI_OUTPUT_QUALITY', DEFAULT_QUALITY))
+        if not 1 <= self.quality <= 100:
+            raise ValueError(f"Output quality must be between 1 and 100: {self.quality}")
+        self.optimize = env_flag('UNAI_OUTPUT_OPTIMIZE') if optimize is None else bool(optimize)
+        self.progressive = env_flag('UNAI_OUTPUT_PROGRESSIVE') if progressive is None else bool(progressive)
+
+    @property
+    def pil_format(self):
+        return FORMATS[self.format][0]
+
+    @property
+    def extension(self):
+        return FORMATS[self.format][1]
+
+    @property
+    def content_type(self):
+        return FORMATS[self.format][2]
+
+    def options(self):
+        """Keyword arguments for PIL's Image.save"""
+        if self.format == 'jpeg':
+            return {'quality': self.quality, 'optimize': self.optimize, 'progressive': self.progressive}
+        if self.format == 'webp':
+            # method trades encode time for size (0 fastest, 6 smallest)
+            return {'quality': self.quality, 'method': 6 if self.optimize else 4}
+        return {'optimize': self.optimize}
+
+    def variant(self):
+        """Cache key part; empty for the default JPEG q95 so existing entries stay valid"""
+        if (self.format, self.quality, self.optimize, self.progressive) == (DEFAULT_FORMAT, DEFAULT_QUALITY, False, False):
+            return ''
+        flags = ('-opt' if self.optimize else '') + ('-prog' if self.progressive else '')
+        return f"{self.format}-q{self.quality}{flags}"
+
+    def describe(self):
+        return {
+            'format': self.format,
+            'quality': self.quality,
+            'optimize': self.optimize,
+            'progressive': self.progressive,
+            'content_type': self.content_type,
+        }
+
+class EncoderPool:
+    """Threads that encode regenerated images, shared by every caller in the process
+
+    PIL releases the GIL while compressing, so pooled encodes overlap with
+    inference and with each other; the threads live as long as the process
+    instead of being created per batch. In-memory encodes reuse one BytesIO
+    per thread.
+    """
+
+    def __init__(self, workers=None):
+        if workers is None:
+            workers = int(os.environ.get('UNAI_ENCODE_WORKERS', min(4, os.cpu_count() or 1)))
+        self.workers = max(1, workers)
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.executor = None
+
+    def get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix='unai-encode')
+            return self.executor
+
+    def resize(self, workers):
+        """Change the number of encode threads; encodes already queued finish on the old ones"""
+        with self.lock:
+            self.workers = max(1, int(workers))
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def save(self, image, encoding, destination):
+        """Encode image into a path or file object; returns destination"""
+        image.save(destination, encoding.pil_format, **encoding.options())
+        return destination
+
+    def encode(self, image, encoding):
+        """Encoded bytes of image"""
+        buffer = getattr(self.local, 'buffer', None)
+        if buffer is None:
+            buffer = self.local.buffer = io.BytesIO()
+        buffer.seek(0)
+        buffer.truncate()
+        image.save(buffer, encoding.pil_format, **encoding.options())
+        return buffer.getvalue()
+
+    def submit(self, method, *args):
+        """Run save/encode on a pool thread; returns a Future"""
+        return self.get_executor().submit(method, *args)
+
+# Shared by every ImageRegenerator in the process
+ENCODER_POOL = EncoderPool()
+
+class ShmResults:
+    """Regenerated images handed to the caller as files in /dev/shm
+
+    Every process writes into one directory, unai-results. Before each write,
+    files older than the TTL (UNAI_SHM_TTL_S, default 300 s) are removed, and
+    so are the oldest ones beyond UNAI_SHM_MAX_FILES (default 256). A caller
+    that never cleans up cannot fill RAM this way. Callers release a file once
+    they have read it, and a long-running worker removes what it wrote when
+    it exits.
+    """
+
+    def __init__(self, directory=None, ttl=None, max_files=None):
+        if directory is None:
+            base = SHM_DIR if os.path.isdir(SHM_DIR) else tempfile.gettempdir()
+            directory = os.path.join(base, 'unai-results')
+        self.directory = directory
+        self.ttl = float(ttl if ttl is not None else os.environ.get('UNAI_SHM_TTL_S', SHM_TTL_S))
+        self.max_files = max(1, int(max_files if max_files is not None else os.environ.get('UNAI_SHM_MAX_FILES', SHM_MAX_FILES)))
+        self.lock = threading.Lock()
+        self.written = set()
+
+    def write(self, data, extension):
+        """Path of a new file holding data, after reaping expired and excess files"""
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        with self.lock:
+            self.reap(keep=self.max_files - 1)
+            path = os.path.join(self.directory, f"{uuid.uuid4().hex}{extension}")
+            with open(path, 'xb') as f:
+                f.write(data)
+            self.written.add(path)
+        return path
+
+    def reap(self, keep=None):
+        """Remove files older than the TTL, then the oldest beyond keep; returns how many went"""
+        keep = self.max_files if keep is None else keep
+        try:
+            entries = [(entry.stat().st_mtime, entry.path) for entry in os.scandir(self.directory) if entry.is_file()]
+        except FileNotFoundError:
+            return 0
+        entries.sort()
+        cutoff = time.time() - self.ttl
+        expired = [path for mtime, path in entries if mtime < cutoff]
+        live = [path for mtime, path in entries if mtime >= cutoff]
+        expired.extend(live[:max(0, len(live) - keep)])
+        for path in expired:
+            self.remove(path)
+        return len(expired)
+
+    def release(self, path):
+        """Delete a delivered file once the caller has read it; False when it was already gone"""
+        if os.path.dirname(os.path.realpath(path)) != os.path.realpath(self.directory):
+            raise ValueError(f"Not a delivered result: {path}")
+        return self.remove(path)
+
+    def remove(self, path):
+        self.written.discard(path)
+        try:
+            os.unlink(path)
+            return True
+        except FileNotFoundError:
+            # Released by the caller or reaped by another process
+            return False
+
+    def cleanup(self):
+        """Remove every file this process wrote and nobody released"""
+        with self.lock:
+            for path in list(self.written):
+                self.remove(path)
+
+# Shared by every deliver() in the process
+SHM_RESULTS = ShmResults()
+
+def resolve_delivery(delivery=None):
+    delivery = delivery or os.environ.get('UNAI_OUTPUT_DELIVERY', 'file')
+    if delivery not in DELIVERIES:
+        raise ValueError(f"Unknown delivery: {delivery}")
+    return delivery
+
+def deliver(data, encoding, delivery):
+    """Result fields that hand encoded image bytes to the caller without the uploads folder"""
+    if delivery == 'base64':
+        return {'image_base64': base64.b64encode(data).decode('ascii'), 'content_type': encoding.content_type}
+    path = SHM_RESULTS.write(data, encoding.extension)
+    return {'shm_path': path, 'shm_length': len(data), 'content_type': encoding.content_type}
+
+def add_arguments(parser):
+    """The output encoding flags shared by the pipeline CLIs"""
+    parser.add_argument('--output-format', choices=sorted(FORMATS), help='Regenerated image format (default: $UNAI_OUTPUT_FORMAT or jpeg)')
+    parser.add_argument('--output-quality', type=int, help='JPEG/WebP quality 1-100 (default: $UNAI_OUTPUT_QUALITY or 95)')
+    parser.add_argument('--output-optimize', action='store_true', default=None,
+                        help='Smaller files for more encode time (default: $UNAI_OUTPUT_OPTIMIZE)')
+    parser.add_argument('--output-progressive', action='store_true', default=None,
+                        help='Progressive JPEG (default: $UNAI_OUTPUT_PROGRESSIVE)')
+
+def encoding_from_args(args):
+    return OutputEncoding(args.output_format, args.output_quality, args.output_optimize, args.output_progressive)
@@ -0,0 +1,422 @@
+import io
+import json
+import signal
+import base64
+import asyncio
+import hashlib
+import argparse
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ThreadPoolExecutor
+
+from detection_pipeline import Pipeline, debug_print
+from preprocessing import decode_image
+from instrumentation import METRICS, record_timings, stage
+from batching import BatchingDetector
+from result_cache import ResultCache, cache_from_env
+from model_registry import ModelManager
+from near_duplicates import NearDuplicateIndex, near_duplicate_index_from_env
+import parallelism
+import image_encoding
+
+REASONS = {
+    200: 'OK', 202: 'Accepted', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+    411: 'Length Required', 413: 'Payload Too Large', 422: 'Unprocessable Entity', 431: 'Request Header Fields Too Large',
+    500: 'Internal Server Error', 503: 'Service Unavailable', 504: 'Gateway Timeout',
+}
+
+MAX_HEADER_BYTES = 16 * 1024
+
+class HttpError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+class Request:
+    def __init__(self, method, target, headers, body):
+        url = urlsplit(target)
+        self.method = method
+        self.path = url.path
+        self.query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        self.headers = headers
+        self.body = body
+
+    def flag(self, name):
+        return self.query.get(name, '0').lower() in ('1', 'true', 'yes')
+
+    @property
+    def keep_alive(self):
+        return self.headers.get('connection', '').lower() != 'close'
+
+async def read_request(reader, writer, max_body_bytes):
+    """Parse one HTTP/1.1 request, or return None when the client closed the connection"""
+    try:
+        head = await reader.readuntil(b'\r\n\r\n')
+    except asyncio.IncompleteReadError as e:
+        if not e.partial.strip():
+            return None
+        raise HttpError(400, 'Incomplete request')
+    except asyncio.LimitOverrunError:
+        raise HttpError(431, 'Request headers too large')
+
+    lines = head.decode('latin-1').split('\r\n')
+    try:
+        method, target, _ = lines[0].split(' ', 2)
+    except ValueError:
+        raise HttpError(400, 'Malformed request line')
+
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+
+    body = b''
+    if method in ('POST', 'PUT'):
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            raise HttpError(411, 'Chunked uploads are not supported, send Content-Length')
+        try:
+            length = int(headers.get('content-length', ''))
+        except ValueError:
+            raise HttpError(411, 'Content-Length required')
+        if length < 0:
+            raise HttpError(400, 'Invalid Content-Length')
+        if length > max_body_bytes:
+            raise HttpError(413, f'Body larger than {max_body_bytes} bytes')
+        if headers.get('expect', '').lower() == '100-continue':
+            writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+            await writer.drain()
+        body = await reader.readexactly(length)
+
+    return Request(method, target, headers, body)
+
+def write_response(writer, status, body, content_type='application/json', headers=None, keep_alive=True):
+    if isinstance(body, (dict, list)):
+        body = json.dumps(body).encode('utf-8')
+    lines = [
+        f'HTTP/1.1 {status} {REASONS.get(status, "")}',
+        f'Content-Type: {content_type}',
+        f'Content-Length: {len(body)}',
+        f'Connection: {"keep-alive" if keep_alive else "close"}',
+    ]
+    for name, value in (headers or {}).items():
+        lines.append(f'{name}: {value}')
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+
+class InferenceServer:
+    """Asyncio HTTP front end for the pipeline; inference runs on a thread pool
+
+    Uploads are sent as the raw request body, so no shared disk is needed.
+    At most `concurrency` requests run inference and `queue_size` more may
+    wait; anything beyond that gets 503 with Retry-After, so overload shows
+    up at the client instead of as unbounded latency.
+    """
+
+    def __init__(self, pipeline, concurrency=2, queue_size=16, timeout=60.0, max_body_bytes=32 * 1024 * 1024):
+        self.pipeline = pipeline
+        self.concurrency = max(1, int(concurrency))
+        self.queue_size = max(0, int(queue_size))
+        self.timeout = timeout
+        self.max_body_bytes = max_body_bytes
+        self.executor = ThreadPoolExecutor(self.concurrency, thread_name_prefix='inference')
+        self.in_flight = 0
+        self.ready = False
+        # Why the background model load failed, reported by /readyz
+        self.load_error = None
+        self.draining = False
+        self.connections = set()
+        self.idle = None
+        self.models = ModelManager(pipeline)
+
+        self.routes = {
+            ('GET', '/healthz'): self.handle_health,
+            ('GET', '/readyz'): self.handle_ready,
+            ('GET', '/metrics'): self.handle_metrics,
+            ('POST', '/detect'): self.handle_detect,
+            ('POST', '/regenerate'): self.handle_regenerate,
+            ('POST', '/pipeline'): self.handle_pipeline,
+            ('GET', '/models'): self.handle_models,
+            ('POST', '/models'): self.handle_use_model,
+        }
+        if pipeline.skip_regeneration:
+            # --detect-only never loads the generator, so there is nothing to serve this with
+            del self.routes[('POST', '/regenerate')]
+
+    # Inference, run on the executor threads
+
+    def preload(self):
+        try:
+            # Both loaders catch their own errors: the detector falls back to an
+            # untrained mock and the generator to None, so check what came back
+            if self.pipeline.get_detector().variant == 'mock':
+                raise RuntimeError('Deepfake detector could not be loaded')
+            if not self.pipeline.skip_regeneration and self.pipeline.get_regenerator().ensure_loaded() is None:
+                raise RuntimeError('Regenerator model could not be loaded')
+        except Exception as e:
+            # Runs as a background future nobody awaits, so this is the only place it is seen
+            self.load_error = str(e)
+            debug_print(f"❌ Inference server could not load the models: {str(e)}")
+            return
+        self.ready = True
+        debug_print("✅ Inference server models loaded")
+
+    def decode(self, data):
+        # Tiled regeneration needs the full-size pixels, so skip the JPEG draft shortcut
+        try:
+            with stage('decode'):
+                return decode_image(data, draft=False if self.pipeline.tiled else None)
+        except Exception as e:
+            raise HttpError(422, f"Error preprocessing image: {str(e)}")
+
+    def detect(self, data):
+        image = self.decode(data)
+        image_hash = hashlib.sha256(data).hexdigest() if self.pipeline.cache is not None else None
+        return self.pipeline.detect('<upload>', image_hash, image)
+
+    def regenerate(self, data):
+        """Regenerate into memory; returns (result, encoded image bytes)"""
+        image = self.decode(data)
+        image_hash = hashlib.sha256(data).hexdigest() if self.pipeline.cache is not None else None
+        buffer = io.BytesIO()
+        # Through the pipeline, so identical uploads are answered from the result cache
+        result = self.pipeline.regenerate('<upload>', image_hash, image, buffer)
+        if result['status'] != 'success':
+            return result, None
+        return dict(result, output_path=None), buffer.getvalue()
+
+    def run_pipeline(self, data, include_image):
+        output = io.BytesIO()
+        result = self.pipeline.run_data(data, output)
+        regeneration = result.get('regeneration')
+        if regeneration and regeneration['success'] and include_image:
+            regeneration['image_base64'] = base64.b64encode(output.getvalue()).decode('ascii')
+            regeneration['content_type'] = self.pipeline.encoding.content_type
+        return result
+
+    def timed(self, fn, timings, *args):
+        """Run fn with optional per-stage timings attached to a dict result"""
+        with record_timings(timings) as recorder:
+            result = fn(*args)
+        if recorder is not None:
+            if isinstance(result, dict):
+                result['timings'] = recorder.to_dict()
+            else:
+                result[0]['timings'] = recorder.to_dict()
+        return result
+
+    async def infer(self, fn, *args):
+        """Admission control, executor dispatch and timeout for one inference call"""
+        if self.draining:
+            raise HttpError(503, 'Server is shutting down')
+        if self.load_error is not None:
+            raise HttpError(503, f'Models failed to load: {self.load_error}')
+        if not self.ready:
+            raise HttpError(503, 'Models are still loading', {'Retry-After': '5'})
+        if self.in_flight >= self.concurrency + self.queue_size:
+            METRICS.count_request('rejected')
+            raise HttpError(503, 'Server busy', {'Retry-After': '1'})
+
+        self.in_flight += 1
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, fn, *args)
+
+        def release(_):
+            # The slot is only freed when the thread finishes, even after a timeout
+            self.in_flight -= 1
+            if self.in_flight == 0 and self.idle is not None:
+                self.idle.set()
+
+        future.add_done_callback(release)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError:
+            METRICS.count_request('timeout')
+            raise HttpError(504, f'Inference took longer than {self.timeout}s')
+
+    # Route handlers
+
+    async def handle_health(self, request):
+        return 200, {'status': 'ok'}
+
+    async def handle_ready(self, request):
+        if self.ready and not self.draining:
+            return 200, {'status': 'ready', 'in_flight': self.in_flight}
+        if self.load_error is not None:
+            return 503, {'status': 'failed', 'error': self.load_error}
+        return 503, {'status': 'draining' if self.draining else 'loading'}
+
+    async def handle_metrics(self, request):
+        return 200, METRICS.render().encode('utf-8'), 'text/plain; version=0.0.4; charset=utf-8'
+
+    def require_body(self, request):
+        if not request.body:
+            raise HttpError(400, 'Send the image bytes as the request body')
+
+    async def handle_detect(self, request):
+        self.require_body(request)
+        result = await self.infer(self.timed, self.detect, request.flag('timings'), request.body)
+        METRICS.count_request(result['status'])
+        return (200 if result['status'] == 'success' else 422), result
+
+    async def handle_regenerate(self, request):
+        self.require_body(request)
+        result, output = await self.infer(self.timed, self.regenerate, request.flag('timings'), request.body)
+        METRICS.count_request(result['status'])
+        if output is None:
+            return 422, result
+        content_type = self.pipeline.encoding.content_type
+        if request.query.get('format') == 'json':
+            return 200, dict(result, image_base64=base64.b64encode(output).decode('ascii'), content_type=content_type)
+        return 200, output, content_type
+
+    async def handle_pipeline(self, request):
+        self.require_body(request)
+        include_image = request.query.get('image', '1') != '0'
+        result = await self.infer(self.timed, self.run_pipeline, request.flag('timings'), request.body, include_image)
+        METRICS.count_request(result['pipeline_status'])
+        return (200 if result['pipeline_status'] == 'success' else 422), result
+
+    async def handle_models(self, request):
+        return 200, self.models.describe()
+
+    async def handle_use_model(self, request):
+        """Switch to registry versions in the background: {"kind": "generator", "versions": {"v3": 0.1, "v4": 0.9}}"""
+        try:
+            body = json.loads(request.body or b'{}')
+            versions = body.get('versions') or ({body['version']: 1.0} if body.get('version') else None)
+        except (ValueError, AttributeError) as e:
+            raise HttpError(400, f'Invalid JSON body: {str(e)}')
+        if not versions:
+            raise HttpError(400, 'Pass version or versions')
+        try:
+            return 202, self.models.use(body.get('kind', 'generator'), versions)
+        except ValueError as e:
+            raise HttpError(400, str(e))
+
+    # Connection handling
+
+    async def handle_connection(self, reader, writer):
+        task = asyncio.current_task()
+        self.connections.add(task)
+        try:
+            while not self.draining:
+                keep_alive = False
+                try:
+                    request = await asyncio.wait_for(read_request(reader, writer, self.max_body_bytes), self.timeout)
+                    if request is None:
+                        break
+                    keep_alive = request.keep_alive
+                    handler = self.routes.get((request.method, request.path))
+                    if handler is None:
+                        known = any(path == request.path for _, path in self.routes)
+                        raise HttpError(405 if known else 404, f'No route for {request.method} {request.path}')
+                    response = await handler(request)
+                    status, body = response[0], response[1]
+                    content_type = response[2] if len(response) > 2 else 'application/json'
+                    write_response(writer, status, body, content_type, keep_alive=keep_alive and not self.draining)
+                except HttpError as e:
+                    write_response(writer, e.status, {'status': 'error', 'error': str(e)}, headers=e.headers,
+                                   keep_alive=keep_alive and e.status < 500)
+                    keep_alive = keep_alive and e.status < 500
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+                    # Idle keep-alive connection or a client that stopped sending
+                    break
+                except Exception as e:
+                    debug_print(f"❌ Request failed: {str(e)}")
+                    write_response(writer, 500, {'status': 'error', 'error': str(e)}, keep_alive=False)
+                    keep_alive = False
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.connections.discard(task)
+            writer.close()
+
+    async def serve(self, host, port, grace_period=30.0):
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, stop.set)
+
+        server = await asyncio.start_server(self.handle_connection, host, port, limit=MAX_HEADER_BYTES)
+        address = server.sockets[0].getsockname()
+        debug_print(f"Inference server listening on http://{address[0]}:{address[1]}")
+
+        # Health checks answer while the models load; readiness flips once they are in memory
+        loading = loop.run_in_executor(self.executor, self.preload)
+
+        await stop.wait()
+        debug_print("Shutting down: draining in-flight requests")
+        self.draining = True
+        server.close()
+        await server.wait_closed()
+
+        self.idle = asyncio.Event()
+        if self.in_flight == 0:
+            self.idle.set()
+        try:
+            await asyncio.wait_for(self.idle.wait(), grace_period)
+        except asyncio.TimeoutError:
+            debug_print(f"{self.in_flight} requests still running after {grace_period}s, closing anyway")
+
+        # Give handlers a moment to write their last responses, then drop idle keep-alive connections
+        await asyncio.sleep(0.1)
+        for task in list(self.connections):
+            task.cancel()
+        if not loading.done():
+            loading.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        debug_print("Inference server stopped")
+
+def main():
+    parser = argparse.ArgumentParser(description='HTTP inference server for deepfake detection and regeneration')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8500)
+    parser.add_argument('--concurrency', type=int, default=2, help='Inference calls run in parallel')
+    parser.add_argument('--queue-size', type=int, default=16, help='Requests allowed to wait before answering 503')
+    parser.add_argument('--timeout', type=float, default=60, help='Seconds before a request is answered with 504')
+    parser.add_argument('--grace-period', type=float, default=30, help='Seconds to finish in-flight requests on shutdown')
+    parser.add_argument('--max-body-mb', type=float, default=32)
+    parser.add_argument('--max-batch-size', type=int, default=1, help='Batch up to this many detections per forward pass')
+    parser.add_argument('--max-wait-ms', type=float, default=5)
+    parser.add_argument('--backend', choices=['native', 'onnx'])
+    parser.add_argument('--precision', choices=['fp32', 'int8', 'bf16'])
+    parser.add_argument('--cache-dir', help='Reuse detection results for identical uploads (default: $UNAI_CACHE_DIR)')
+    parser.add_argument('--cache-max-mb', type=float, default=512)
+    parser.add_argument('--near-dup-index', help='Reuse cached results for re-encoded or resized copies; index file path (default: $UNAI_NEAR_DUP_INDEX, needs a cache)')
+    parser.add_argument('--near-dup-distance', type=int, default=6, help='Largest pHash Hamming distance counted as a near-duplicate')
+    parser.add_argument('--tiled', action='store_true', help='Regenerate at full resolution (default: $UNAI_TILED)')
+    parser.add_argument('--detect-only', action='store_true', help='Never regenerate in /pipeline')
+    parallelism.add_arguments(parser)
+    image_encoding.add_arguments(parser)
+    args = parser.parse_args()
+
+    debug_print(f"Thread settings: {parallelism.configure_from_args(args)}")
+    METRICS.enabled = True
+
+    if args.cache_dir:
+        cache = ResultCache(args.cache_dir, int(args.cache_max_mb * 1024 * 1024))
+    else:
+        cache = cache_from_env()
+
+    if args.near_dup_index:
+        near_duplicates = NearDuplicateIndex(args.near_dup_index, args.near_dup_distance)
+    else:
+        near_duplicates = near_duplicate_index_from_env()
+    if near_duplicates is not None and cache is None:
+        debug_print("Near-duplicate index ignored: it needs a result cache (--cache-dir)")
+
+    pipeline = Pipeline(cache=cache, backend=args.backend, precision=args.precision,
+                        tiled=args.tiled or None, skip_regeneration=args.detect_only, near_duplicates=near_duplicates,
+                        encoding=image_encoding.encoding_from_args(args))
+    if args.max_batch_size > 1:
+        pipeline.detector = BatchingDetector(pipeline.build_detector(), args.max_batch_size, args.max_wait_ms)
+
+    server = InferenceServer(pipeline, args.concurrency, args.queue_size, args.timeout,
+                             int(args.max_body_mb * 1024 * 1024))
+    asyncio.run(server.serve(args.host, args.port, args.grace_period))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+import os
+import sys
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Stages reported by the pipeline, in the order they normally run
+STAGES = ('model_locate', 'model_load', 'decode', 'near_duplicate', 'preprocess', 'detect', 'regenerate', 'encode_save')
+
+# Histogram buckets for stage latency, in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_timings = contextvars.ContextVar('unai_timings', default=None)
+_stack = contextvars.ContextVar('unai_stage_stack', default=())
+
+def peak_rss_bytes():
+    """High-water mark of this process's resident set size"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def current_rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+class Timings:
+    """Per-request stage timings; each stage's time excludes nested stages"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+
+    def add(self, name, wall, cpu, peak_rss):
+        entry = self.stages.setdefault(name, {'wall_ms': 0.0, 'cpu_ms': 0.0, 'calls': 0, 'peak_rss_mb': None})
+        entry['wall_ms'] += wall * 1000
+        entry['cpu_ms'] += cpu * 1000
+        entry['calls'] += 1
+        if peak_rss is not None:
+            entry['peak_rss_mb'] = round(peak_rss / (1024 * 1024), 1)
+
+    def to_dict(self):
+        stages = {}
+        for name, entry in self.stages.items():
+            stages[name] = dict(entry, wall_ms=round(entry['wall_ms'], 3), cpu_ms=round(entry['cpu_ms'], 3))
+        peak = peak_rss_bytes()
+        return {
+            'total_ms': round((time.perf_counter() - self.started) * 1000, 3),
+            'stages': stages,
+            'peak_rss_mb': round(peak / (1024 * 1024), 1) if peak is not None else None,
+        }
+
+class MetricsRegistry:
+    """Process-wide aggregates, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.stage_counts = {}
+        self.stage_wall = {}
+        self.stage_cpu = {}
+        self.stage_buckets = {}
+        self.requests = {}
+        self.counters = {}
+
+    def observe_stage(self, name, wall, cpu):
+        with self.lock:
+            self.stage_counts[name] = self.stage_counts.get(name, 0) + 1
+            self.stage_wall[name] = self.stage_wall.get(name, 0.0) + wall
+            self.stage_cpu[name] = self.stage_cpu.get(name, 0.0) + cpu
+            buckets = self.stage_buckets.setdefault(name, [0] * len(BUCKETS))
+            for i, bound in enumerate(BUCKETS):
+                if wall <= bound:
+                    buckets[i] += 1
+
+    def count_request(self, status):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.requests[status] = self.requests.get(status, 0) + 1
+
+    def increment(self, name, help_text, amount=1, **labels):
+        """Add to a labelled counter, e.g. increment('unai_cascade_routed_total', '...', stage='fast')"""
+        if not self.enabled:
+            return
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            metric = self.counters.setdefault(name, {'help': help_text, 'values': {}})
+            metric['values'][key] = metric['values'].get(key, 0) + amount
+
+    def render(self):
+        lines = [
+            '# HELP unai_stage_duration_seconds Wall time spent in each pipeline stage',
+            '# TYPE unai_stage_duration_seconds histogram',
+        ]
+        with self.lock:
+            for name in sorted(self.stage_counts):
+                for bound, count in zip(BUCKETS, self.stage_buckets[name]):
+                    lines.append(f'unai_stage_duration_seconds_bucket{{stage="{name}",le="{bound}"}} {count}')
+                lines.append(f'unai_stage_duration_seconds_bucket{{stage="{name}",le="+Inf"}} {self.stage_counts[name]}')
+                lines.append(f'unai_stage_duration_seconds_sum{{stage="{name}"}} {self.stage_wall[name]:.6f}')
+                lines.append(f'unai_stage_duration_seconds_count{{stage="{name}"}} {self.stage_counts[name]}')
+
+            lines.append('# HELP unai_stage_cpu_seconds_total CPU time spent in each pipeline stage')
+            lines.append('# TYPE unai_stage_cpu_seconds_total counter')
+            for name in sorted(self.stage_cpu):
+                lines.append(f'unai_stage_cpu_seconds_total{{stage="{name}"}} {self.stage_cpu[name]:.6f}')
+
+            lines.append('# HELP unai_requests_total Pipeline requests by outcome')
+            lines.append('# TYPE unai_requests_total counter')
+            for status in sorted(self.requests):
+                lines.append(f'unai_requests_total{{status="{status}"}} {self.requests[status]}')
+
+            for name in sorted(self.counters):
+                metric = self.counters[name]
+                lines.append(f'# HELP {name} {metric["help"]}')
+                lines.append(f'# TYPE {name} counter')
+                for key in sorted(metric['values']):
+                    labels = ','.join(f'{k}="{v}"' for k, v in key)
+                    lines.append(f'{name}{{{labels}}} {metric["values"][key]}' if labels else f'{name} {metric["values"][key]}')
+
+        peak = peak_rss_bytes()
+        if peak is not None:
+            lines.append('# HELP unai_process_peak_rss_bytes Peak resident set size')
+            lines.append('# TYPE unai_process_peak_rss_bytes gauge')
+            lines.append(f'unai_process_peak_rss_bytes {peak}')
+        rss = current_rss_bytes()
+        if rss is not None:
+            lines.append('# HELP unai_process_rss_bytes Current resident set size')
+            lines.append('# TYPE unai_process_rss_bytes gauge')
+            lines.append(f'unai_process_rss_bytes {rss}')
+        return '\n'.join(lines) + '\n'
+
+METRICS = MetricsRegistry()
+
+class _Frame:
+    __slots__ = ('child_wall', 'child_cpu')
+
+    def __init__(self):
+        self.child_wall = 0.0
+        self.child_cpu = 0.0
+
+@contextmanager
+def stage(name, metrics=True):
+    """Time a pipeline stage for the active request and the metrics registry (no-op when neither is on)"""
+    timings = _timings.get()
+    metrics = metrics and METRICS.enabled
+    if timings is None and not metrics:
+        yield
+        return
+
+    frame = _Frame()
+    stack = _stack.get()
+    token = _stack.set(stack + (frame,))
+    wall_start = time.perf_counter()
+    # Process CPU time, so threads spawned by TensorFlow/torch are included
+    cpu_start = time.process_time()
+    try:
+        yield
+    finally:
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+        _stack.reset(token)
+        if stack:
+            stack[-1].child_wall += wall
+            stack[-1].child_cpu += cpu
+
+        own_wall = max(0.0, wall - frame.child_wall)
+        own_cpu = max(0.0, cpu - frame.child_cpu)
+        if timings is not None:
+            timings.add(name, own_wall, own_cpu, peak_rss_bytes())
+        if metrics:
+            METRICS.observe_stage(name, own_wall, own_cpu)
+
+@contextmanager
+def record_timings(enabled=True):
+    """Collect stage timings for everything run inside the block on this thread"""
+    if not enabled:
+        yield None
+        return
+    timings = Timings()
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+def timings_enabled():
+    return os.environ.get('UNAI_TIMINGS', '0') == '1'
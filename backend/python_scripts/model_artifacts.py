@@ -0,0 +1,145 @@
+import os
+import sys
+import argparse
+import threading
+
+import numpy as np
+
+from detection_pipeline import DeepfakeDetector, ImageRegenerator, debug_print, timed_import
+
+# Exported artifacts sit next to the source weights:
+#   DeepFake.h5           -> DeepFake.tflite      (flatbuffer, mmapped by the interpreter)
+#   regenerator_model.pth -> regenerator_model.ts  (frozen TorchScript)
+# INT8 builds from quantize_models.py use .int8.tflite / .int8.ts
+DETECTOR_SUFFIX = '.tflite'
+GENERATOR_SUFFIX = '.ts'
+QUANTIZED_DETECTOR_SUFFIX = '.int8.tflite'
+QUANTIZED_GENERATOR_SUFFIX = '.int8.ts'
+
+def resolve_precision(precision=None):
+    """Inference precision: 'fp32' (default), 'int8' or 'bf16' (generator autocast, see graph_optimize.py)"""
+    precision = precision or os.environ.get('UNAI_PRECISION', 'fp32')
+    if precision not in ('fp32', 'int8', 'bf16'):
+        raise ValueError(f"Unknown precision: {precision}")
+    return precision
+
+def artifact_path(model_path, suffix):
+    return os.path.splitext(model_path)[0] + suffix
+
+def find_artifact(model_path, suffix):
+    """Return the exported artifact for model_path if it exists and is not older than the source"""
+    if not model_path or os.environ.get('UNAI_USE_ARTIFACTS', '1') == '0':
+        return None
+    path = artifact_path(model_path, suffix)
+    if not os.path.exists(path):
+        return None
+    if os.path.getmtime(path) < os.path.getmtime(model_path):
+        debug_print(f"Ignoring stale artifact: {path}")
+        return None
+    return path
+
+def load_tflite_interpreter(path, num_threads=None):
+    """Prefer the standalone LiteRT runtime so TensorFlow itself is never imported"""
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+    except ImportError:
+        Interpreter = timed_import('tensorflow').lite.Interpreter
+    return Interpreter(model_path=path, num_threads=num_threads)
+
+class TFLitePredictor:
+    """Wraps a TFLite interpreter behind the subset of the Keras API the detector uses"""
+
+    def __init__(self, path, num_threads=None):
+        self.path = path
+        self.interpreter = load_tflite_interpreter(path, num_threads)
+        self.interpreter.allocate_tensors()
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+        self.batch_size = int(self.input['shape'][0])
+        # The interpreter keeps per-call state, so calls must not overlap
+        self.lock = threading.Lock()
+
+    def predict(self, x, batch_size=None, verbose=0):
+        x = np.asarray(x, dtype=np.float32)
+        with self.lock:
+            if x.shape[0] != self.batch_size:
+                self.interpreter.resize_tensor_input(self.input['index'], list(x.shape))
+                self.interpreter.allocate_tensors()
+                self.batch_size = x.shape[0]
+            self.interpreter.set_tensor(self.input['index'], x)
+            self.interpreter.invoke()
+            return np.array(self.interpreter.get_tensor(self.output['index']))
+
+def load_detector_artifact(path):
+    from parallelism import thread_settings
+    debug_print(f"Loading exported detector from: {path}")
+    return TFLitePredictor(path, thread_settings()['intra_op_threads'])
+
+def load_generator_artifact(path, device):
+    debug_print(f"Loading exported generator from: {path}")
+    torch = timed_import('torch')
+    model = torch.jit.load(path, map_location=device)
+    model.eval()
+    return model
+
+def export_detector(model_path, output_path=None):
+    """Convert the Keras .h5 detector into a TFLite flatbuffer"""
+    tf = timed_import('tensorflow')
+    output_path = output_path or artifact_path(model_path, DETECTOR_SUFFIX)
+
+    model = tf.keras.models.load_model(model_path)
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    with open(output_path, 'wb') as f:
+        f.write(converter.convert())
+
+    debug_print(f"✅ Exported detector to: {output_path}")
+    return output_path
+
+def export_generator(model_path, output_path=None):
+    """Trace and freeze the Generator into a TorchScript file"""
+    torch = timed_import('torch')
+    output_path = output_path or artifact_path(model_path, GENERATOR_SUFFIX)
+
+    regenerator = ImageRegenerator(use_artifacts=False, model_path=model_path, graph_mode='fold', precision='fp32',
+                                   channels_last=False)
+    model = regenerator.ensure_loaded()
+    if model is None:
+        raise Exception(f"Could not load generator from {model_path}")
+
+    model = model.cpu().eval()
+    example = torch.zeros(1, 3, 128, 128)
+    with torch.no_grad():
+        traced = torch.jit.freeze(torch.jit.trace(model, example))
+    traced.save(output_path)
+
+    debug_print(f"✅ Exported generator to: {output_path}")
+    return output_path
+
+def main():
+    parser = argparse.ArgumentParser(description='Export models to fast-loading artifacts')
+    parser.add_argument('--detector', help='Path to DeepFake.h5 (default: auto-detect)')
+    parser.add_argument('--generator', help='Path to regenerator_model.pth (default: auto-detect)')
+    parser.add_argument('--skip-detector', action='store_true')
+    parser.add_argument('--skip-generator', action='store_true')
+    args = parser.parse_args()
+
+    exported = []
+    if not args.skip_detector:
+        detector_path = args.detector or DeepfakeDetector.find_deepfake_model()
+        if not detector_path:
+            debug_print("❌ No DeepFake model found")
+            sys.exit(1)
+        exported.append(export_detector(detector_path))
+
+    if not args.skip_generator:
+        generator_path = args.generator or ImageRegenerator.find_regenerator_model()
+        if not generator_path:
+            debug_print("❌ No regenerator model found")
+            sys.exit(1)
+        exported.append(export_generator(generator_path))
+
+    for path in exported:
+        print(path)
+
+if __name__ == "__main__":
+    main()
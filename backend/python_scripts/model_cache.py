@@ -0,0 +1,106 @@
+import os
+import threading
+from collections import OrderedDict
+
+from console import debug_print
+
+DEFAULT_MAX_MB = 2048
+
+def model_size(model, path=None):
+    """Approximate memory held by a loaded model, in bytes"""
+    parameters = getattr(model, 'parameters', None)
+    if callable(parameters):
+        # torch.nn.Module
+        tensors = list(model.parameters()) + list(model.buffers())
+        return sum(t.numel() * t.element_size() for t in tensors)
+    count_params = getattr(model, 'count_params', None)
+    if callable(count_params):
+        # Keras; weights are float32
+        return count_params() * 4
+    return os.path.getsize(path) if path and os.path.exists(path) else 0
+
+class ModelCache:
+    """Loaded models shared by every caller in the process
+
+    Entries are keyed by (resolved path, file mtime, device), so a model
+    file that is replaced on disk is loaded again on the next call. The
+    first caller for a key loads it while later callers for the same key
+    wait for that load instead of starting their own. Once the estimated
+    size of all entries goes over max_bytes the least recently used ones
+    are dropped (the model being returned always stays).
+    """
+
+    def __init__(self, max_bytes=None):
+        if max_bytes is None:
+            max_bytes = int(float(os.environ.get('UNAI_MODEL_CACHE_MB', DEFAULT_MAX_MB)) * 1024 * 1024)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.loading = {}
+
+    @staticmethod
+    def make_key(path, device=None):
+        real_path = os.path.realpath(path)
+        return (real_path, os.stat(real_path).st_mtime_ns, str(device or 'default'))
+
+    def get(self, path, loader, device=None):
+        """The model at path on device, calling loader(path) only if it is not loaded yet"""
+        key = self.make_key(path, device)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key][0]
+            key_lock = self.loading.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self.lock:
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    return self.entries[key][0]
+            try:
+                model = loader(path)
+                size = model_size(model, path)
+                with self.lock:
+                    # Older versions of the same file are unreachable now
+                    for stale in [k for k in self.entries if k[0] == key[0] and k[2] == key[2]]:
+                        del self.entries[stale]
+                    self.entries[key] = (model, size)
+                    self._evict(keep=key)
+            finally:
+                with self.lock:
+                    self.loading.pop(key, None)
+        return model
+
+    def _evict(self, keep):
+        total = sum(size for _, size in self.entries.values())
+        for key in list(self.entries):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            total -= self.entries.pop(key)[1]
+            debug_print(f"Evicted cached model {key[0]}")
+
+    def evict(self, path=None):
+        """Drop the cached models for one file (every device and mtime), or all of them; returns how many"""
+        with self.lock:
+            if path is None:
+                count = len(self.entries)
+                self.entries.clear()
+                return count
+            real_path = os.path.realpath(path)
+            keys = [k for k in self.entries if k[0] == real_path]
+            for key in keys:
+                del self.entries[key]
+            return len(keys)
+
+    def info(self):
+        with self.lock:
+            return {
+                'max_bytes': self.max_bytes,
+                'bytes': sum(size for _, size in self.entries.values()),
+                'models': [{'path': k[0], 'device': k[2], 'bytes': size} for k, (_, size) in self.entries.items()],
+            }
+
+# Shared by app.py and regenerator.py, so the memory cap covers both
+MODEL_CACHE = ModelCache()
@@ -0,0 +1,437 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+
+from detection_pipeline import debug_print, expand_image_paths, safe_print_json
+from instrumentation import METRICS
+
+# registry.json lives in the models folder; entry paths are relative to it:
+#   {"generator": {"default": "v4", "versions": {"v4": {"path": "regenerator_model.pth",
+#                                                       "sha256": "...", "size": 90506563, ...}}}}
+REGISTRY_FILENAME = 'registry.json'
+KINDS = ('detector', 'generator')
+VERSION_ENV = {'detector': 'UNAI_DETECTOR_VERSION', 'generator': 'UNAI_GENERATOR_VERSION'}
+
+_default_registry = None
+_default_registry_lock = threading.Lock()
+
+# First line of a Git LFS pointer file, which stands in for the real weights until they are pulled
+LFS_POINTER_HEADER = b'version https://git-lfs.github.com/spec/v1'
+
+def registry_candidates():
+    """Where to look for registry.json, most specific first"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    return [
+        os.environ.get('UNAI_MODEL_REGISTRY'),
+        os.path.join('models', REGISTRY_FILENAME),
+        os.path.join(here, '..', '..', 'models', REGISTRY_FILENAME),
+        os.path.join('/home/varun-kasnia/Documents/Programming Files/Projects/UnAI/models', REGISTRY_FILENAME),
+    ]
+
+def lfs_pointer(path):
+    """(sha256, size) of the object a Git LFS pointer file stands for, None for any other file"""
+    if os.path.getsize(path) > 1024:
+        return None
+    with open(path, 'rb') as f:
+        lines = f.read().splitlines()
+    if not lines or lines[0] != LFS_POINTER_HEADER:
+        return None
+    fields = dict(line.decode('ascii').split(' ', 1) for line in lines[1:] if b' ' in line)
+    if not fields.get('oid', '').startswith('sha256:') or 'size' not in fields:
+        return None
+    return fields['oid'][len('sha256:'):], int(fields['size'])
+
+class ModelRegistry:
+    """Versioned model entries with checksums and metadata, read from registry.json"""
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.base_dir = os.path.dirname(self.path)
+        self.lock = threading.Lock()
+        with open(self.path, encoding='utf-8') as f:
+            self.data = json.load(f)
+
+    @classmethod
+    def find(cls):
+        """The first registry.json found, or None"""
+        for path in registry_candidates():
+            if path and os.path.exists(path):
+                return cls(path)
+        return None
+
+    def versions(self, kind):
+        return self.data.get(kind, {}).get('versions', {})
+
+    def default_version(self, kind):
+        return os.environ.get(VERSION_ENV[kind]) or self.data.get(kind, {}).get('default')
+
+    def entry(self, kind, version=None):
+        """Entry of a version (default: the configured one) with an absolute path, or None"""
+        version = version or self.default_version(kind)
+        entry = self.versions(kind).get(version)
+        if entry is None:
+            return None
+        return dict(entry, version=version, kind=kind, path=os.path.join(self.base_dir, entry['path']))
+
+    def resolve(self, kind, version=None):
+        """Path of a version if its file is present and has the registered size"""
+        entry = self.entry(kind, version)
+        if entry is None:
+            debug_print(f"No {kind} version {version or self.default_version(kind)} in {self.path}")
+            return None
+        if not os.path.exists(entry['path']):
+            debug_print(f"Registered {kind} {entry['version']} not found: {entry['path']}")
+            return None
+        if entry.get('size') is not None and os.path.getsize(entry['path']) != entry['size']:
+            # Typically a Git LFS pointer that was never pulled
+            debug_print(f"Registered {kind} {entry['version']} has the wrong size: {entry['path']}")
+            return None
+        return entry['path']
+
+    def verify(self, kind, version):
+        """(ok, message) after comparing a version's file against its registered checksum"""
+        from result_cache import model_fingerprint
+
+        path = self.resolve(kind, version)
+        if path is None:
+            return False, f"{kind} {version} is missing or incomplete"
+        expected = self.versions(kind)[version].get('sha256')
+        if not expected:
+            return True, f"{kind} {version} has no registered checksum"
+        actual = model_fingerprint(path)
+        if actual != expected:
+            return False, f"{kind} {version} checksum mismatch: expected {expected}, got {actual}"
+        return True, f"{kind} {version} ok"
+
+    def version_of(self, kind, path):
+        """Registered version whose file is path, or None"""
+        if not path:
+            return None
+        target = os.path.realpath(path)
+        for version, entry in self.versions(kind).items():
+            if os.path.realpath(os.path.join(self.base_dir, entry['path'])) == target:
+                return version
+        return None
+
+    def register(self, kind, version, path, make_default=False, **metadata):
+        """Add or replace a version, checksumming the file, and rewrite registry.json atomically
+
+        A Git LFS pointer is registered with the checksum and size of the
+        weights it stands for. Re-registering a version keeps the metadata
+        that is not passed again.
+        """
+        from result_cache import file_sha256
+
+        path = os.path.abspath(path)
+        relative = os.path.relpath(path, self.base_dir)
+        sha256, size = lfs_pointer(path) or (file_sha256(path), os.path.getsize(path))
+        metadata = {key: value for key, value in metadata.items() if value is not None}
+        with self.lock:
+            section = self.data.setdefault(kind, {'default': version, 'versions': {}})
+            entry = dict(section['versions'].get(version, {}), **metadata)
+            entry.update(path=relative, sha256=sha256, size=size, added=time.strftime('%Y-%m-%d'))
+            section['versions'][version] = entry
+            if make_default:
+                section['default'] = version
+            temp_path = self.path + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.data, f, indent=2)
+                f.write('\n')
+            os.replace(temp_path, self.path)
+        return entry
+
+def default_registry():
+    """The registry found on disk, loaded once per process (None if there is none)"""
+    global _default_registry
+    with _default_registry_lock:
+        if _default_registry is None:
+            _default_registry = ModelRegistry.find() or False
+    return _default_registry or None
+
+def resolve_model(kind):
+    """Path of the configured version of a model, or None to fall back to probing"""
+    registry = default_registry()
+    if registry is None:
+        return None
+    path = registry.resolve(kind)
+    if path:
+        debug_print(f"Using {kind} {registry.default_version(kind)} from {registry.path}")
+    return path
+
+class VersionRouter:
+    """Routes each request to one of several loaded versions of a model
+
+    The active routes are an immutable tuple that is replaced in one
+    assignment, so a switch-over is atomic: requests that already picked a
+    version finish on it, new ones see the new routes. Routing is keyed on
+    the image hash when there is one, so the same image always goes to the
+    same version and its cache entries stay consistent.
+    """
+
+    def __init__(self, kind, version, model):
+        self.kind = kind
+        self.lock = threading.Lock()
+        self.routes = ((version, model, 1.0),)
+        self.served = {}
+
+    def choose(self, key=None):
+        routes = self.routes
+        if len(routes) == 1:
+            return routes[0][1]
+        point = int(key[:8], 16) / 0x100000000 if key else random.random()
+        for _, model, weight in routes:
+            if point < weight:
+                return model
+            point -= weight
+        return routes[-1][1]
+
+    def activate(self, models, weights):
+        """Switch to new routes; weights are normalised to sum to 1"""
+        total = float(sum(weights.values()))
+        if total <= 0:
+            raise ValueError('Weights must add up to more than 0')
+        self.routes = tuple((version, models[version], weight / total) for version, weight in weights.items())
+
+    def loaded(self):
+        return {version: model for version, model, _ in self.routes}
+
+    def record(self, model, seconds):
+        """Count a request served by one version"""
+        version = getattr(model, 'model_version', None)
+        with self.lock:
+            count, total = self.served.get(version, (0, 0.0))
+            self.served[version] = (count + 1, total + seconds)
+        METRICS.increment('unai_model_requests_total', 'Requests served by each model version', kind=self.kind,
+                          version=str(version))
+
+    def stats(self):
+        with self.lock:
+            served = dict(self.served)
+        versions = {}
+        for version, model, weight in self.routes:
+            count, total = served.get(version, (0, 0.0))
+            versions[version] = {
+                'weight': round(weight, 4),
+                'path': getattr(model, 'model_path', None),
+                'requests': count,
+                'mean_ms': round(1000 * total / count, 3) if count else None,
+            }
+        return versions
+
+    def __getattr__(self, name):
+        # Everything else (detect, regenerate, model_path, ...) goes to a chosen version
+        if name == 'routes':
+            raise AttributeError(name)
+        return getattr(self.choose(), name)
+
+class ModelManager:
+    """Loads registry versions in the background and swaps a pipeline's models over to them"""
+
+    def __init__(self, pipeline, registry=None):
+        self.pipeline = pipeline
+        self.registry = registry or default_registry()
+        self.lock = threading.Lock()
+        self.routers = {}
+        self.status = {}
+
+    def router(self, kind):
+        """Put a router in front of the pipeline's current model of this kind"""
+        with self.lock:
+            if kind in self.routers:
+                return self.routers[kind]
+            if kind == 'detector':
+                current = self.pipeline.get_detector()
+                holder = current if hasattr(current, 'submit') else None
+                model = holder.detector if holder else current
+            else:
+                model = self.pipeline.get_regenerator()
+                holder = None
+            version = self.registry.version_of(kind, getattr(model, 'model_path', None)) if self.registry else None
+            model.model_version = version or 'startup'
+            router = VersionRouter(kind, model.model_version, model)
+            if holder is not None:
+                holder.detector = router
+            elif kind == 'detector':
+                self.pipeline.detector = router
+            else:
+                self.pipeline.regenerator = router
+            self.routers[kind] = router
+            return router
+
+    def build(self, kind, version):
+        """Load one registry version with the pipeline's backend and precision"""
+        from detection_pipeline import DeepfakeDetector, ImageRegenerator
+
+        ok, message = self.registry.verify(kind, version)
+        if not ok:
+            raise ValueError(message)
+        path = self.registry.entry(kind, version)['path']
+        if kind == 'detector':
+            model = DeepfakeDetector(backend=self.pipeline.backend, precision=self.pipeline.precision, model_path=path)
+            if model.variant == 'mock':
+                raise ValueError(f"Could not load detector {version}")
+        else:
+            model = ImageRegenerator(lazy=False, backend=self.pipeline.backend, precision=self.pipeline.precision,
+                                     model_path=path, encoding=self.pipeline.encoding)
+            if model.model is None:
+                raise ValueError(f"Could not load generator {version}")
+        model.model_version = version
+        return model
+
+    def use(self, kind, weights, wait=False):
+        """Serve kind from these versions ({version: weight}); new versions load in the background"""
+        if kind not in KINDS:
+            raise ValueError(f"Unknown model kind: {kind}")
+        if self.registry is None:
+            raise ValueError('No model registry found')
+        unknown = [v for v in weights if v not in self.registry.versions(kind)]
+        if unknown:
+            raise ValueError(f"Unknown {kind} versions: {', '.join(unknown)}")
+        if kind == 'detector' and self.pipeline.cascade:
+            raise ValueError('Detector versions cannot be swapped while the cascade is enabled')
+        if kind == 'detector' and len(weights) > 1 and hasattr(self.pipeline.get_detector(), 'submit'):
+            # A batch runs on one version, but the cache key is picked per request
+            raise ValueError('Detector A/B splits are not supported with --max-batch-size > 1')
+
+        router = self.router(kind)
+
+        def load():
+            try:
+                models = router.loaded()
+                for version in weights:
+                    if version not in models:
+                        debug_print(f"Loading {kind} {version} in the background...")
+                        models[version] = self.build(kind, version)
+                router.activate(models, weights)
+                self.status[kind] = {'state': 'active', 'weights': dict(weights)}
+                debug_print(f"✅ Now serving {kind} {weights}")
+            except Exception as e:
+                debug_print(f"❌ Could not switch {kind} to {weights}: {str(e)}")
+                self.status[kind] = {'state': 'failed', 'weights': dict(weights), 'error': str(e)}
+
+        self.status[kind] = {'state': 'loading', 'weights': dict(weights)}
+        thread = threading.Thread(target=load, name=f'load-{kind}', daemon=True)
+        thread.start()
+        if wait:
+            thread.join()
+        return self.status[kind]
+
+    def describe(self):
+        """Registry contents, active routes and per-version request stats"""
+        response = {'registry': self.registry.path if self.registry else None, 'models': {}}
+        for kind in KINDS:
+            router = self.routers.get(kind)
+            response['models'][kind] = {
+                'available': sorted(self.registry.versions(kind)) if self.registry else [],
+                'default': self.registry.default_version(kind) if self.registry else None,
+                'active': router.stats() if router else None,
+                'switch': self.status.get(kind),
+            }
+        return response
+
+def compare_generators(registry, versions, images, backend=None):
+    """Latency and output agreement of generator versions on the same images"""
+    import io
+    import numpy as np
+    from PIL import Image
+    from detection_pipeline import ImageRegenerator
+    from preprocessing import decode_image
+    from quantize_models import psnr
+
+    decoded = [decode_image(p) for p in images]
+    outputs = {}
+    report = {}
+    for version in versions:
+        path = registry.resolve('generator', version)
+        if path is None:
+            report[version] = {'error': 'missing or incomplete model file'}
+            continue
+        regenerator = ImageRegenerator(lazy=False, backend=backend, model_path=path, use_artifacts=False)
+        if regenerator.model is None:
+            report[version] = {'error': 'could not load'}
+            continue
+        regenerator.regenerate('<warmup>', io.BytesIO(), image=decoded[0])
+        latencies = []
+        outputs[version] = []
+        for image in decoded:
+            buffer = io.BytesIO()
+            start = time.perf_counter()
+            regenerator.regenerate('<compare>', buffer, image=image)
+            latencies.append(time.perf_counter() - start)
+            outputs[version].append(np.asarray(Image.open(io.BytesIO(buffer.getvalue())).convert('RGB')))
+        report[version] = {
+            'ms_per_image': round(1000 * float(np.median(latencies)), 2),
+            'psnr_vs_input_db': round(float(np.mean([
+                psnr(np.asarray(image.image.resize(output.shape[1::-1])), output)
+                for image, output in zip(decoded, outputs[version])
+            ])), 2),
+        }
+
+    reference = versions[-1]
+    for version in outputs:
+        if version != reference and reference in outputs:
+            report[version][f'psnr_vs_{reference}_db'] = round(float(np.mean([
+                psnr(a, b) for a, b in zip(outputs[reference], outputs[version])
+            ])), 2)
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect and maintain the model registry')
+    parser.add_argument('--registry', help='registry.json to use (default: $UNAI_MODEL_REGISTRY or models/registry.json)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    subparsers.add_parser('list', help='Show every registered version and whether its file is present')
+
+    verify = subparsers.add_parser('verify', help='Check model files against their registered checksums')
+    verify.add_argument('--kind', choices=KINDS)
+
+    register = subparsers.add_parser('register', help='Add a model file as a new version')
+    register.add_argument('kind', choices=KINDS)
+    register.add_argument('version')
+    register.add_argument('path')
+    register.add_argument('--description')
+    register.add_argument('--default', action='store_true', help='Also make it the version loaded at startup')
+
+    compare = subparsers.add_parser('compare', help='Latency and PSNR of generator versions on sample images')
+    compare.add_argument('--versions', nargs='+', required=True, help='Versions to compare; the last is the reference')
+    compare.add_argument('--images', nargs='+', required=True)
+    compare.add_argument('--backend', choices=['native', 'onnx'])
+    args = parser.parse_args()
+
+    registry = ModelRegistry(args.registry) if args.registry else ModelRegistry.find()
+    if registry is None:
+        debug_print("❌ No registry.json found")
+        sys.exit(1)
+
+    if args.command == 'list':
+        listing = {}
+        for kind in KINDS:
+            listing[kind] = {
+                'default': registry.default_version(kind),
+                'versions': {
+                    version: dict(entry, present=registry.resolve(kind, version) is not None)
+                    for version, entry in registry.versions(kind).items()
+                },
+            }
+        safe_print_json(listing)
+    elif args.command == 'verify':
+        failed = False
+        for kind in ([args.kind] if args.kind else KINDS):
+            for version in registry.versions(kind):
+                ok, message = registry.verify(kind, version)
+                failed = failed or not ok
+                debug_print(("✅ " if ok else "❌ ") + message)
+        sys.exit(1 if failed else 0)
+    elif args.command == 'register':
+        entry = registry.register(args.kind, args.version, args.path, make_default=args.default,
+                                  description=args.description)
+        safe_print_json(entry)
+    else:
+        safe_print_json(compare_generators(registry, args.versions, expand_image_paths(args.images), args.backend))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,328 @@
+import os
+import sys
+import json
+import time
+import struct
+import argparse
+import threading
+from itertools import combinations
+
+import numpy as np
+from PIL import Image
+
+from detection_pipeline import debug_print, expand_image_paths
+
+# Index file: a 16 byte header, then one 48 byte record per image:
+#   u64 pHash, u64 dHash, 32 byte SHA-256 of the image file (the ResultCache image hash)
+# Records are only ever appended, so a crash can at most leave a torn last record.
+MAGIC = b'UNAIPHSH'
+VERSION = 1
+HEADER = struct.Struct('<8sII')
+RECORD = struct.Struct('<QQ32s')
+RECORD_DTYPE = np.dtype([('phash', '<u8'), ('dhash', '<u8'), ('key', 'u1', (32,))])
+
+DEFAULT_MAX_DISTANCE = 6
+DEFAULT_MAX_DHASH_DISTANCE = 10
+
+_dct_matrices = {}
+
+def _grayscale(image, size):
+    image = getattr(image, 'image', image)
+    return np.asarray(image.convert('L').resize(size, Image.LANCZOS), dtype=np.float32)
+
+def _to_int(bits):
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), 'big')
+
+def dhash(image, size=8):
+    """64-bit difference hash: whether each pixel is brighter than its right neighbour"""
+    pixels = _grayscale(image, (size + 1, size))
+    return _to_int(pixels[:, 1:] > pixels[:, :-1])
+
+def phash(image, size=8, factor=4):
+    """64-bit perceptual hash: low-frequency DCT coefficients compared to their median"""
+    n = size * factor
+    if n not in _dct_matrices:
+        k = np.arange(n)
+        _dct_matrices[n] = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n)).astype(np.float32)
+    dct = _dct_matrices[n]
+    coefficients = (dct @ _grayscale(image, (n, n)) @ dct.T)[:size, :size]
+    # The DC term only reflects overall brightness
+    return _to_int(coefficients > np.median(coefficients.ravel()[1:]))
+
+def perceptual_hashes(image):
+    """(pHash, dHash) of a PIL image or DecodedImage"""
+    return phash(image), dhash(image)
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+if hasattr(np, 'bitwise_count'):
+    def popcount(values):
+        return np.bitwise_count(values)
+else:
+    _BYTE_BITS = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+    def popcount(values):
+        return _BYTE_BITS[values.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+def _flip_masks(bits, radius):
+    """Every mask of at most radius set bits within a chunk"""
+    masks = [0]
+    for r in range(1, radius + 1):
+        masks.extend(sum(1 << b for b in positions) for positions in combinations(range(bits), r))
+    return np.array(masks, dtype=np.uint64)
+
+class NearDuplicateIndex:
+    """Persistent pHash index with Hamming-radius lookup by multi-index hashing
+
+    The 64-bit pHash is split into `chunks` parts. Two hashes within distance
+    d agree to within d // chunks bits on at least one part, so a lookup only
+    probes, per part, the sorted table entries whose part is that close, and
+    then checks the full distance on those candidates. Inserts go to an
+    unsorted tail that is scanned directly and merged into the tables once it
+    grows past merge_threshold. A dHash check on top weeds out pHash
+    collisions between unrelated images.
+    """
+
+    def __init__(self, path, max_distance=DEFAULT_MAX_DISTANCE, max_dhash_distance=DEFAULT_MAX_DHASH_DISTANCE,
+                 chunks=4, merge_threshold=65536):
+        if 64 % chunks:
+            raise ValueError('chunks must divide 64')
+        self.path = os.path.abspath(path)
+        self.max_distance = max_distance
+        self.max_dhash_distance = max_dhash_distance
+        self.chunks = chunks
+        self.bits = 64 // chunks
+        # Narrow table entries keep the binary searches in cache
+        self.chunk_dtype = np.uint16 if self.bits <= 16 else np.uint32 if self.bits <= 32 else np.uint64
+        self.merge_threshold = merge_threshold
+        self.lock = threading.Lock()
+        self.masks = {}
+
+        self.records = np.empty(0, dtype=RECORD_DTYPE)
+        self.count = 0
+        self.tables = []
+        self.sorted = 0
+        self.load()
+        self.file = open(self.path, 'ab')
+
+    def load(self):
+        """Read the records on disk, cutting a torn last record, and build the lookup tables"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            with open(self.path, 'wb') as f:
+                f.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+            self.merge()
+            return
+
+        with open(self.path, 'rb+') as f:
+            magic, version, record_size = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+                raise ValueError(f'{self.path} is not a version {VERSION} near-duplicate index')
+            size = os.path.getsize(self.path) - HEADER.size
+            if size % RECORD.size:
+                # The previous process died mid-append
+                f.truncate(HEADER.size + size - size % RECORD.size)
+
+        records = np.fromfile(self.path, dtype=RECORD_DTYPE, offset=HEADER.size)
+        self.records = records
+        self.count = len(records)
+        self.merge()
+        debug_print(f"Loaded {self.count} near-duplicate index entries")
+
+    def merge(self):
+        """Rebuild the per-chunk sorted tables over every record"""
+        phashes = self.records['phash'][:self.count]
+        mask = np.uint64((1 << self.bits) - 1)
+        tables = []
+        for i in range(self.chunks):
+            values = ((phashes >> np.uint64(i * self.bits)) & mask).astype(self.chunk_dtype)
+            order = np.argsort(values, kind='stable')
+            tables.append((values[order], order))
+        self.tables = tables
+        self.sorted = self.count
+
+    def __len__(self):
+        return self.count
+
+    def add(self, phash_value, dhash_value, image_hash):
+        """Append an entry; image_hash is the hex SHA-256 the verdicts are cached under"""
+        key = bytes.fromhex(image_hash)
+        with self.lock:
+            if self.count == len(self.records):
+                grown = np.empty(max(1024, 2 * len(self.records)), dtype=RECORD_DTYPE)
+                grown[:self.count] = self.records[:self.count]
+                self.records = grown
+            self.records[self.count] = (phash_value, dhash_value, np.frombuffer(key, dtype=np.uint8))
+            self.count += 1
+            self.file.write(RECORD.pack(phash_value, dhash_value, key))
+            self.file.flush()
+            if self.count - self.sorted >= self.merge_threshold:
+                self.merge()
+
+    def probes(self, radius):
+        if radius not in self.masks:
+            self.masks[radius] = _flip_masks(self.bits, radius).astype(self.chunk_dtype)
+        return self.masks[radius]
+
+    def search(self, phash_value, max_distance=None):
+        """(indices, distances) of the entries within max_distance of a pHash"""
+        max_distance = self.max_distance if max_distance is None else max_distance
+        query = np.uint64(phash_value)
+        mask = np.uint64((1 << self.bits) - 1)
+        flips = self.probes(max_distance // self.chunks)
+
+        with self.lock:
+            candidates = []
+            for i, (values, order) in enumerate(self.tables):
+                probes = self.chunk_dtype((query >> np.uint64(i * self.bits)) & mask) ^ flips
+                lo = np.searchsorted(values, probes, 'left')
+                hi = np.searchsorted(values, probes, 'right')
+                lengths = hi - lo
+                total = int(lengths.sum())
+                if total:
+                    # Concatenate the order[lo:hi] ranges without a Python loop
+                    starts = np.repeat(lo - np.cumsum(lengths) + lengths, lengths)
+                    candidates.append(order[starts + np.arange(total)])
+            if self.count > self.sorted:
+                candidates.append(np.arange(self.sorted, self.count))
+            if not candidates:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+            # An entry can turn up under several chunks; duplicates are dropped after the distance check
+            indices = np.concatenate(candidates)
+            distances = popcount(self.records['phash'][indices] ^ query).astype(np.int64)
+        keep = distances <= max_distance
+        indices, first = np.unique(indices[keep], return_index=True)
+        return indices, distances[keep][first]
+
+    def best(self, phash_value, dhash_value):
+        """Closest entry confirmed by both hashes, as a dict, or None"""
+        indices, distances = self.search(phash_value)
+        if not len(indices):
+            return None
+        with self.lock:
+            records = self.records[indices]
+        dhash_distances = popcount(records['dhash'] ^ np.uint64(dhash_value)).astype(np.int64)
+        ok = dhash_distances <= self.max_dhash_distance
+        if not ok.any():
+            return None
+        candidates = np.flatnonzero(ok)
+        best = candidates[np.lexsort((dhash_distances[candidates], distances[candidates]))[0]]
+        return {
+            'image_sha256': records['key'][best].tobytes().hex(),
+            'distance': int(distances[best]),
+            'dhash_distance': int(dhash_distances[best]),
+        }
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+def near_duplicate_index_from_env():
+    """Open the index at UNAI_NEAR_DUP_INDEX (distance from UNAI_NEAR_DUP_DISTANCE), or None"""
+    path = os.environ.get('UNAI_NEAR_DUP_INDEX')
+    if not path:
+        return None
+    return NearDuplicateIndex(path, int(os.environ.get('UNAI_NEAR_DUP_DISTANCE', DEFAULT_MAX_DISTANCE)))
+
+def benchmark(entries, queries, max_distance, seed=0):
+    """Lookup latency on an index of random hashes with near copies of some of them as queries"""
+    import tempfile
+    rng = np.random.default_rng(seed)
+    workdir = tempfile.mkdtemp(prefix='unai-near-dup-')
+    path = os.path.join(workdir, 'index.bin')
+    try:
+        records = np.empty(entries, dtype=RECORD_DTYPE)
+        records['phash'] = rng.integers(0, 2 ** 64, entries, dtype=np.uint64)
+        records['dhash'] = rng.integers(0, 2 ** 64, entries, dtype=np.uint64)
+        records['key'] = rng.integers(0, 256, (entries, 32), dtype=np.uint8)
+        with open(path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+            records.tofile(f)
+
+        start = time.perf_counter()
+        index = NearDuplicateIndex(path, max_distance)
+        load_s = time.perf_counter() - start
+
+        # Half the queries are near copies of indexed hashes, half unrelated
+        targets = rng.integers(0, entries, queries)
+        latencies = []
+        hits = 0
+        for n, target in enumerate(targets):
+            query = int(records['phash'][target])
+            dquery = int(records['dhash'][target])
+            if n % 2:
+                query = int(rng.integers(0, 2 ** 64, dtype=np.uint64))
+            else:
+                for bit in rng.choice(64, max_distance, replace=False):
+                    query ^= 1 << int(bit)
+            start = time.perf_counter()
+            match = index.best(query, dquery)
+            latencies.append(time.perf_counter() - start)
+            hits += match is not None and n % 2 == 0
+        index.close()
+
+        latencies = np.array(latencies) * 1000
+        return {
+            'entries': entries,
+            'max_distance': max_distance,
+            'load_s': round(load_s, 3),
+            'lookup_ms': {
+                'p50': round(float(np.percentile(latencies, 50)), 4),
+                'p99': round(float(np.percentile(latencies, 99)), 4),
+            },
+            'recall': hits / max(1, (queries + 1) // 2),
+        }
+    finally:
+        import shutil
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description='Perceptual-hash index of already analysed images')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    query = subparsers.add_parser('query', help='Look up the closest indexed image for each input')
+    query.add_argument('index')
+    query.add_argument('images', nargs='+')
+    query.add_argument('--max-distance', type=int, default=DEFAULT_MAX_DISTANCE)
+
+    stats = subparsers.add_parser('stats', help='Entries in an index')
+    stats.add_argument('index')
+
+    bench = subparsers.add_parser('bench', help='Lookup latency on a synthetic index')
+    bench.add_argument('--entries', type=int, default=1000000)
+    bench.add_argument('--queries', type=int, default=2000)
+    bench.add_argument('--max-distance', type=int, default=DEFAULT_MAX_DISTANCE)
+    args = parser.parse_args()
+
+    if args.command == 'bench':
+        print(json.dumps(benchmark(args.entries, args.queries, args.max_distance)), flush=True)
+        return
+
+    if not os.path.exists(args.index):
+        debug_print(f"❌ Index not found: {args.index}")
+        sys.exit(1)
+
+    if args.command == 'stats':
+        index = NearDuplicateIndex(args.index)
+        print(json.dumps({'path': index.path, 'entries': len(index)}))
+        index.close()
+        return
+
+    from preprocessing import decode_image
+    index = NearDuplicateIndex(args.index, args.max_distance)
+    for img_path in expand_image_paths(args.images):
+        start = time.perf_counter()
+        match = index.best(*perceptual_hashes(decode_image(img_path)))
+        print(json.dumps({
+            'image_path': img_path,
+            'match': match,
+            'lookup_ms': round((time.perf_counter() - start) * 1000, 3),
+        }), flush=True)
+    index.close()
+
+if __name__ == "__main__":
+    main()
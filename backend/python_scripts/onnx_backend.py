@@ -0,0 +1,192 @@
+import os
+import sys
+import argparse
+
+import numpy as np
+
+from detection_pipeline import DeepfakeDetector, ImageRegenerator, debug_print, timed_import, safe_print_json, expand_image_paths
+from model_artifacts import artifact_path
+from parallelism import thread_settings
+
+# ONNX files sit next to the source weights: DeepFake.onnx, regenerator_model.onnx
+ONNX_SUFFIX = '.onnx'
+# Largest absolute difference from the native model that check accepts
+DEFAULT_TOLERANCE = 1e-4
+
+def find_onnx_model(model_path):
+    """Return the ONNX export for model_path if it exists and is not older than the source"""
+    if not model_path:
+        return None
+    path = artifact_path(model_path, ONNX_SUFFIX)
+    if not os.path.exists(path):
+        return None
+    if os.path.getmtime(path) < os.path.getmtime(model_path):
+        debug_print(f"Ignoring stale ONNX model: {path}")
+        return None
+    return path
+
+def create_session(path, intra_op_threads=None, inter_op_threads=None):
+    ort = timed_import('onnxruntime')
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if intra_op_threads:
+        options.intra_op_num_threads = int(intra_op_threads)
+    if inter_op_threads:
+        options.inter_op_num_threads = int(inter_op_threads)
+
+    available = ort.get_available_providers()
+    providers = [p for p in ('CUDAExecutionProvider', 'CPUExecutionProvider') if p in available]
+    return ort.InferenceSession(path, sess_options=options, providers=providers)
+
+class OnnxModel:
+    """Runs an ONNX graph with one input and one output on NumPy arrays"""
+
+    def __init__(self, path, intra_op_threads=None, inter_op_threads=None):
+        self.path = path
+        self.session = create_session(path, intra_op_threads, inter_op_threads)
+        self.input_name = self.session.get_inputs()[0].name
+        self.output_name = self.session.get_outputs()[0].name
+
+    def run(self, x):
+        x = np.ascontiguousarray(x, dtype=np.float32)
+        return self.session.run([self.output_name], {self.input_name: x})[0]
+
+    def predict(self, x, batch_size=None, verbose=0):
+        """Keras-style entry point so DeepfakeDetector can use it unchanged"""
+        return self.run(x)
+
+def load_detector(model_path):
+    path = find_onnx_model(model_path)
+    if not path:
+        return None
+    debug_print(f"Loading ONNX detector from: {path}")
+    return OnnxModel(path, **thread_settings())
+
+def load_generator(model_path):
+    path = find_onnx_model(model_path)
+    if not path:
+        return None
+    debug_print(f"Loading ONNX generator from: {path}")
+    return OnnxModel(path, **thread_settings())
+
+def export_detector(model_path, output_path=None, opset=17):
+    """Convert the Keras detector to ONNX with a dynamic batch dimension"""
+    tf = timed_import('tensorflow')
+    tf2onnx = timed_import('tf2onnx')
+    output_path = output_path or artifact_path(model_path, ONNX_SUFFIX)
+
+    model = tf.keras.models.load_model(model_path)
+    spec = (tf.TensorSpec((None,) + tuple(model.input_shape[1:]), tf.float32, name='input'),)
+    try:
+        tf2onnx.convert.from_keras(model, input_signature=spec, opset=opset, output_path=output_path)
+    except Exception as e:
+        # Keras 3 models are not always understood by from_keras; tracing the call works
+        debug_print(f"from_keras failed ({str(e)}), converting traced function instead")
+
+        @tf.function
+        def serve(x):
+            return model(x, training=False)
+
+        tf2onnx.convert.from_function(serve, input_signature=spec, opset=opset, output_path=output_path)
+
+    debug_print(f"✅ Exported ONNX detector to: {output_path}")
+    return output_path
+
+def export_generator(model_path, output_path=None, opset=17):
+    """Export the Generator to ONNX with a dynamic batch dimension"""
+    torch = timed_import('torch')
+    output_path = output_path or artifact_path(model_path, ONNX_SUFFIX)
+
+    regenerator = ImageRegenerator(use_artifacts=False, model_path=model_path, graph_mode='fold', precision='fp32',
+                                   channels_last=False)
+    model = regenerator.ensure_loaded()
+    if model is None:
+        raise Exception(f"Could not load generator from {model_path}")
+
+    model = model.cpu().eval()
+    example = torch.zeros(2, 3, 128, 128)
+    with torch.no_grad():
+        torch.onnx.export(
+            model, (example,), output_path,
+            input_names=['input'], output_names=['output'],
+            dynamic_axes={'input': {0: 'batch'}, 'output': {0: 'batch'}},
+            opset_version=opset, dynamo=False
+        )
+
+    debug_print(f"✅ Exported ONNX generator to: {output_path}")
+    return output_path
+
+def check_detector(model_path, image_paths, tolerance):
+    """Compare Keras and ONNX Runtime confidences on the same inputs"""
+    native = DeepfakeDetector(backend='native', use_artifacts=False, model_path=model_path)
+    onnx = load_detector(model_path)
+    if onnx is None:
+        raise Exception('No ONNX detector found, run the export command first')
+
+    if image_paths:
+        batch = np.concatenate([native.preprocess_image(p) for p in image_paths], axis=0)
+    else:
+        batch = np.random.default_rng(0).random((8, 128, 128, 3), dtype=np.float32)
+
+    expected = native.model.predict(batch, verbose=0)
+    actual = onnx.predict(batch)
+    max_diff = float(np.max(np.abs(expected - actual)))
+    return {'samples': int(batch.shape[0]), 'max_abs_diff': max_diff, 'passed': max_diff <= tolerance}
+
+def check_generator(model_path, image_paths, tolerance):
+    """Compare PyTorch and ONNX Runtime generator outputs on the same inputs"""
+    torch = timed_import('torch')
+    native = ImageRegenerator(use_artifacts=False, backend='native', model_path=model_path)
+    if native.ensure_loaded() is None:
+        raise Exception(f"Could not load generator from {model_path}")
+    onnx = load_generator(model_path)
+    if onnx is None:
+        raise Exception('No ONNX generator found, run the export command first')
+
+    if image_paths:
+        batch = torch.stack([native.load_input(p) for p in image_paths])
+    else:
+        batch = torch.from_numpy(np.random.default_rng(0).standard_normal((4, 3, 128, 128), dtype=np.float32))
+
+    with torch.inference_mode():
+        expected = native.model(batch.to(native.device)).cpu().numpy()
+    actual = onnx.run(batch.numpy())
+    max_diff = float(np.max(np.abs(expected - actual)))
+    return {'samples': int(batch.shape[0]), 'max_abs_diff': max_diff, 'passed': max_diff <= tolerance}
+
+def main():
+    parser = argparse.ArgumentParser(description='ONNX Runtime backend tools')
+    parser.add_argument('command', choices=['export', 'check'])
+    parser.add_argument('--detector', help='Path to DeepFake.h5 (default: auto-detect)')
+    parser.add_argument('--generator', help='Path to regenerator_model.pth (default: auto-detect)')
+    parser.add_argument('--images', nargs='*', help='Sample images (files, globs or directories) for check')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help='Largest allowed absolute difference')
+    parser.add_argument('--opset', type=int, default=17)
+    args = parser.parse_args()
+
+    detector_path = args.detector or DeepfakeDetector.find_deepfake_model()
+    generator_path = args.generator or ImageRegenerator.find_regenerator_model()
+
+    if args.command == 'export':
+        result = {}
+        if detector_path:
+            result['detector'] = export_detector(detector_path, opset=args.opset)
+        if generator_path:
+            result['generator'] = export_generator(generator_path, opset=args.opset)
+        safe_print_json(result)
+        return
+
+    # Without sample images the check runs on random inputs
+    image_paths = expand_image_paths(args.images or [])[:8]
+    report = {}
+    if detector_path:
+        report['detector'] = check_detector(detector_path, image_paths, args.tolerance)
+    if generator_path:
+        report['generator'] = check_generator(generator_path, image_paths, args.tolerance)
+    safe_print_json(report)
+
+    if not all(r['passed'] for r in report.values()):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
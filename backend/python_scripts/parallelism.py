@@ -0,0 +1,269 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+
+from console import debug_print
+
+# Thread settings shared by every framework the pipeline loads. Unset values
+# keep each framework's default (one thread per core).
+#   UNAI_INTRA_OP_THREADS  threads used inside a single op (conv, matmul)
+#   UNAI_INTER_OP_THREADS  independent ops run concurrently
+#   UNAI_CPU_AFFINITY      cores this process may use, e.g. "0-3,8"
+#   UNAI_WORKERS           worker processes sharing the machine
+_applied = set()
+
+def parse_cpu_list(spec):
+    """'0-3,8' -> [0, 1, 2, 3, 8]"""
+    cpus = []
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-')
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(part))
+    return sorted(set(cpus))
+
+def allowed_cpus():
+    """IDs of the cores this process may run on; under a cgroup or cpuset they need not start at 0 or be contiguous"""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+def available_cpus():
+    """Number of cores this process is allowed to run on"""
+    return len(allowed_cpus())
+
+def _env_int(name):
+    value = os.environ.get(name)
+    return int(value) if value else None
+
+def thread_settings():
+    """Current intra/inter-op thread counts (None means framework default)"""
+    return {
+        'intra_op_threads': _env_int('UNAI_INTRA_OP_THREADS'),
+        'inter_op_threads': _env_int('UNAI_INTER_OP_THREADS'),
+    }
+
+def configure(intra_op_threads=None, inter_op_threads=None, cpu_affinity=None, workers=None, worker_index=None):
+    """Set this process's thread budget; must run before TensorFlow or torch is imported
+
+    With several workers and no explicit thread count, the allowed cores are
+    split evenly. When an affinity and a worker index are given, each worker
+    is pinned to its own slice of those cores.
+    """
+    if cpu_affinity:
+        cpus = parse_cpu_list(cpu_affinity) if isinstance(cpu_affinity, str) else list(cpu_affinity)
+    else:
+        cpus = allowed_cpus()
+
+    workers = max(1, int(workers or 1))
+    if worker_index is not None and workers > 1 and len(cpus) >= workers:
+        share = len(cpus) // workers
+        cpus = cpus[worker_index * share:(worker_index + 1) * share]
+        cpu_affinity = cpu_affinity or True
+
+    if cpu_affinity and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+
+    if intra_op_threads is None and workers > 1:
+        intra_op_threads = max(1, len(cpus) // (1 if worker_index is not None else workers))
+    if intra_op_threads:
+        os.environ['UNAI_INTRA_OP_THREADS'] = str(intra_op_threads)
+        # Picked up by OpenMP/MKL and TensorFlow when they initialise
+        for name in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'TF_NUM_INTRAOP_THREADS'):
+            os.environ[name] = str(intra_op_threads)
+    if inter_op_threads:
+        os.environ['UNAI_INTER_OP_THREADS'] = str(inter_op_threads)
+        os.environ['TF_NUM_INTEROP_THREADS'] = str(inter_op_threads)
+
+    # A framework the caller already imported is sized now; one imported later
+    # is sized by apply_to_frameworks()/configure_framework() at that point
+    apply_to_frameworks()
+    settings = thread_settings()
+    settings['cpus'] = len(cpus)
+    return settings
+
+def apply_to_frameworks():
+    """Apply the thread settings to whichever of TensorFlow and torch are imported"""
+    for module_name in ('tensorflow', 'torch'):
+        if module_name in sys.modules:
+            configure_framework(module_name, sys.modules[module_name])
+
+def configure_framework(module_name, module):
+    """Apply the thread settings to a framework; call right after importing it, before it runs anything"""
+    if module_name in _applied or module_name not in ('tensorflow', 'torch'):
+        return
+    _applied.add(module_name)
+    settings = thread_settings()
+    intra = settings['intra_op_threads']
+    inter = settings['inter_op_threads']
+
+    try:
+        if module_name == 'tensorflow':
+            if intra:
+                module.config.threading.set_intra_op_parallelism_threads(intra)
+            if inter:
+                module.config.threading.set_inter_op_parallelism_threads(inter)
+        else:
+            if intra:
+                module.set_num_threads(intra)
+            if inter:
+                module.set_num_interop_threads(inter)
+    except RuntimeError as e:
+        # Both refuse once their thread pools exist
+        debug_print(f"Could not set {module_name} threads: {str(e)}")
+
+def add_arguments(parser):
+    """The thread/affinity flags shared by the pipeline CLIs"""
+    parser.add_argument('--intra-op-threads', type=int, help='Threads per op in TensorFlow, torch, TFLite and ONNX Runtime')
+    parser.add_argument('--inter-op-threads', type=int, help='Ops run concurrently by TensorFlow, torch and ONNX Runtime')
+    parser.add_argument('--cpu-affinity', help='Restrict the process to these cores, e.g. 0-3,8')
+
+def configure_from_args(args, workers=None, worker_index=None):
+    return configure(
+        intra_op_threads=args.intra_op_threads or _env_int('UNAI_INTRA_OP_THREADS'),
+        inter_op_threads=args.inter_op_threads or _env_int('UNAI_INTER_OP_THREADS'),
+        cpu_affinity=args.cpu_affinity or os.environ.get('UNAI_CPU_AFFINITY'),
+        workers=workers or _env_int('UNAI_WORKERS'),
+        worker_index=worker_index,
+    )
+
+def measure_config(image_path, iterations):
+    """Per-image latency of detection + regeneration in this process, with the current settings"""
+    from detection_pipeline import DeepfakeDetector, ImageRegenerator
+    from preprocessing import decode_image, detector_batch, generator_batch
+
+    detector = DeepfakeDetector()
+    regenerator = ImageRegenerator()
+    regenerator.ensure_loaded()
+    image = decode_image(image_path)
+    detector_input = detector_batch([image])
+    generator_input = generator_batch([image])
+
+    def run():
+        detector.model.predict(detector_input, verbose=0)
+        if regenerator.model is not None:
+            regenerator.forward(generator_input)
+
+    run()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        run()
+    return (time.perf_counter() - start) / iterations
+
+def autotune(image_path, iterations, worker_options, thread_options, inter_options):
+    """Try each (workers, intra, inter) combination in fresh processes and rank by throughput"""
+    cpu_ids = allowed_cpus()
+    cpus = len(cpu_ids)
+    results = []
+    for workers in worker_options:
+        for intra in thread_options:
+            if workers * intra > cpus:
+                continue
+            for inter in inter_options:
+                env = dict(os.environ, UNAI_INTRA_OP_THREADS=str(intra), UNAI_INTER_OP_THREADS=str(inter))
+                command = [sys.executable, os.path.abspath(__file__), 'measure',
+                           '--image', image_path, '--iterations', str(iterations)]
+                # Workers run side by side, as they would in production
+                processes = []
+                for index in range(workers):
+                    worker_env = dict(env)
+                    if workers > 1:
+                        # Slices of the IDs actually allowed, not 0..cpus-1
+                        share = cpus // workers
+                        worker_env['UNAI_CPU_AFFINITY'] = ','.join(map(str, cpu_ids[index * share:(index + 1) * share]))
+                    processes.append(subprocess.Popen(command, env=worker_env, stdout=subprocess.PIPE,
+                                                      stderr=subprocess.DEVNULL, text=True))
+                latencies = []
+                for process in processes:
+                    output, _ = process.communicate()
+                    if process.returncode == 0:
+                        latencies.append(json.loads(output)['seconds_per_image'])
+
+                entry = {'workers': workers, 'intra_op_threads': intra, 'inter_op_threads': inter}
+                if len(latencies) != workers:
+                    entry['error'] = 'measurement process failed'
+                else:
+                    entry['images_per_s'] = round(sum(1.0 / s for s in latencies), 2)
+                    entry['latency_ms'] = round(1000 * sum(latencies) / len(latencies), 2)
+                debug_print(f"Measured {entry}")
+                results.append(entry)
+
+    ranked = sorted((r for r in results if 'images_per_s' in r), key=lambda r: -r['images_per_s'])
+    best = ranked[0] if ranked else None
+    recommended = None
+    if best:
+        recommended = {
+            'UNAI_WORKERS': str(best['workers']),
+            'UNAI_INTRA_OP_THREADS': str(best['intra_op_threads']),
+            'UNAI_INTER_OP_THREADS': str(best['inter_op_threads']),
+        }
+    return {'cpus': cpus, 'results': results, 'best': best, 'recommended_env': recommended}
+
+def powers_of_two(limit):
+    values = []
+    value = 1
+    while value <= limit:
+        values.append(value)
+        value *= 2
+    if values[-1] != limit:
+        values.append(limit)
+    return values
+
+def main():
+    parser = argparse.ArgumentParser(description='Thread/affinity tuning for the pipeline')
+    parser.add_argument('command', choices=['autotune', 'measure', 'show'])
+    parser.add_argument('--image', help='Sample image (default: a generated 1024x768 JPEG)')
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--workers', type=int, nargs='+', help='Worker counts to try (default: powers of two up to the core count)')
+    parser.add_argument('--threads', type=int, nargs='+', help='Intra-op thread counts to try')
+    parser.add_argument('--inter-op', type=int, nargs='+', default=[1, 2], help='Inter-op thread counts to try')
+    parser.add_argument('--output', help='Also write the autotune report here')
+    args = parser.parse_args()
+
+    if args.command == 'show':
+        print(json.dumps(dict(thread_settings(), cpus=available_cpus())))
+        return
+
+    if args.command == 'measure':
+        configure(_env_int('UNAI_INTRA_OP_THREADS'), _env_int('UNAI_INTER_OP_THREADS'), os.environ.get('UNAI_CPU_AFFINITY'))
+        print(json.dumps({'seconds_per_image': measure_config(args.image, args.iterations)}))
+        return
+
+    image_path = args.image
+    workdir = None
+    if not image_path:
+        import numpy as np
+        from PIL import Image
+        workdir = tempfile.mkdtemp(prefix='unai-autotune-')
+        image_path = os.path.join(workdir, 'sample.jpg')
+        pixels = np.random.default_rng(0).integers(0, 256, (768, 1024, 3), dtype=np.uint8)
+        Image.fromarray(pixels).save(image_path, 'JPEG', quality=90)
+
+    cpus = available_cpus()
+    try:
+        report = autotune(
+            image_path, args.iterations,
+            args.workers or powers_of_two(cpus),
+            args.threads or powers_of_two(cpus),
+            args.inter_op,
+        )
+    finally:
+        if workdir:
+            import shutil
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report), flush=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,365 @@
+import io
+import os
+import sys
+import json
+import argparse
+import threading
+import socketserver
+from concurrent.futures import ThreadPoolExecutor
+
+from detection_pipeline import Pipeline, IMPORT_TIMINGS, debug_print
+from batching import BatchingDetector
+from result_cache import ResultCache, cache_from_env
+from near_duplicates import NearDuplicateIndex, near_duplicate_index_from_env
+from instrumentation import METRICS
+import parallelism
+import image_encoding
+import shm_transport
+from model_registry import ModelManager
+
+class JsonLineChannel:
+    """Reads JSON requests and writes JSON responses, one per line"""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.lock = threading.Lock()
+
+    def __iter__(self):
+        for line in self.reader:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                self.send({'pipeline_status': 'error', 'error': f'Invalid JSON request: {str(e)}'})
+
+    def send(self, data):
+        line = json.dumps(data) + '\n'
+        with self.lock:
+            self.writer.write(line)
+            self.writer.flush()
+
+class PipelineWorker:
+    """Long-lived worker that keeps both models loaded between requests"""
+
+    def __init__(self, pipeline=None, concurrency=1, ring=None):
+        self.pipeline = pipeline or Pipeline()
+        self.concurrency = max(1, int(concurrency))
+        self.ring = ring
+        self.models = ModelManager(self.pipeline)
+        self.running = True
+
+    def preload(self):
+        """Load the detector and regenerator up front so requests only pay for inference"""
+        self.pipeline.get_detector()
+        self.pipeline.get_regenerator().ensure_loaded()
+        debug_print("✅ Worker models loaded")
+
+    def handle(self, request):
+        """Handle one request and return the response dict"""
+        if not isinstance(request, dict):
+            return {'pipeline_status': 'error', 'error': 'Request must be a JSON object'}
+
+        cmd = request.get('cmd', 'process')
+
+        if cmd == 'ping':
+            response = {'status': 'ok', 'import_timings': dict(IMPORT_TIMINGS)}
+            detector = getattr(self.pipeline.detector, 'detector', self.pipeline.detector)
+            if hasattr(detector, 'stats'):
+                response['cascade'] = detector.stats()
+            if self.ring is not None:
+                response['shm_ring'] = self.ring.describe()
+            # channels_last/bf16 and its PSNR against fp32, once the generator has loaded
+            execution = getattr(self.pipeline.regenerator, 'execution', None)
+            if execution is not None:
+                response['generator_execution'] = execution.describe()
+        elif cmd == 'metrics':
+            response = {'status': 'ok', 'metrics': METRICS.render()}
+        elif cmd == 'models':
+            response = dict(self.models.describe(), status='ok')
+        elif cmd == 'use_model':
+            response = self.use_model(request)
+        elif cmd == 'shutdown':
+            self.running = False
+            response = {'status': 'ok'}
+        elif cmd == 'video':
+            response = self.process_video(request)
+        elif cmd == 'release':
+            response = self.release(request)
+        elif cmd == 'process' and 'shm_slot' in request:
+            response = self.process_shared(request)
+        elif cmd == 'process':
+            img_path = request.get('image_path')
+            if not img_path:
+                response = {'pipeline_status': 'error', 'error': 'Missing image_path'}
+            else:
+                try:
+                    response = self.pipeline.process(img_path, timings=request.get('timings'), delivery=request.get('deliver'))
+                except Exception as e:
+                    response = {'pipeline_status': 'error', 'error': str(e)}
+        else:
+            response = {'pipeline_status': 'error', 'error': f'Unknown command: {cmd}'}
+
+        if 'id' in request:
+            response['id'] = request['id']
+        return response
+
+    def respond(self, request):
+        """handle(), turning an unexpected exception into an error response so the client always gets its id back"""
+        try:
+            return self.handle(request)
+        except Exception as e:
+            debug_print(f"❌ Request failed: {str(e)}")
+            response = {'pipeline_status': 'error', 'error': str(e)}
+            if isinstance(request, dict) and 'id' in request:
+                response['id'] = request['id']
+            return response
+
+    def process_video(self, request):
+        """Detect a clip: {"video_path": ..., "every": 15, "max_frames": 64, "keyframes": true, "regenerate": false}"""
+        from video_detection import DEFAULT_MAX_FRAMES, detect_video
+        video_path = request.get('video_path')
+        if not video_path:
+            return {'pipeline_status': 'error', 'error': 'Missing video_path'}
+        regenerate = request.get('regenerate', True) and not self.pipeline.skip_regeneration
+        result = detect_video(
+            video_path, self.pipeline.get_detector(), self.pipeline.get_regenerator() if regenerate else None,
+            every=request.get('every'), max_frames=request.get('max_frames', DEFAULT_MAX_FRAMES),
+            keyframes=bool(request.get('keyframes')),
+        )
+        return {'video': result, 'pipeline_status': result['status']}
+
+    def use_model(self, request):
+        """Switch a model to registry versions: {"kind": "generator", "version": "v3"} or "versions": {"v3": 0.1, "v4": 0.9}"""
+        versions = request.get('versions') or ({request['version']: 1.0} if request.get('version') else None)
+        if not versions:
+            return {'status': 'error', 'error': 'Pass version or versions'}
+        try:
+            switch = self.models.use(request.get('kind', 'generator'), versions, wait=bool(request.get('wait')))
+        except ValueError as e:
+            return {'status': 'error', 'error': str(e)}
+        return dict(switch, status='error' if switch['state'] == 'failed' else 'ok')
+
+    def release(self, request):
+        """Delete a regenerated image delivered through /dev/shm once it has been read: {"shm_path": ...}"""
+        if not request.get('shm_path'):
+            return {'status': 'error', 'error': 'Missing shm_path'}
+        try:
+            released = image_encoding.SHM_RESULTS.release(request['shm_path'])
+        except ValueError as e:
+            return {'status': 'error', 'error': str(e)}
+        return {'status': 'ok', 'released': released}
+
+    def process_shared(self, request):
+        """Process an image held in a shared memory slot and write the regenerated JPEG back into it"""
+        if self.ring is None:
+            return {'pipeline_status': 'error', 'error': 'Shared memory transport not enabled (start with --shm-ring)'}
+
+        try:
+            slot = int(request['shm_slot'])
+            state, _ = self.ring.state(slot)
+            if state != shm_transport.REQUEST:
+                raise ValueError(f'Shared memory slot {slot} holds no request')
+            data = self.ring.read(slot, request.get('length'))
+        except (IndexError, ValueError, TypeError) as e:
+            return {'pipeline_status': 'error', 'error': str(e)}
+
+        output = io.BytesIO()
+        try:
+            response = self.pipeline.process_data(data, output, timings=request.get('timings'))
+        finally:
+            # The slot is about to be overwritten with the response
+            data.release()
+
+        regeneration = response.get('regeneration')
+        if regeneration and regeneration['success']:
+            try:
+                with output.getbuffer() as image:
+                    self.ring.write(slot, image, shm_transport.RESPONSE)
+                    regeneration['shm_length'] = image.nbytes
+                regeneration['shm_slot'] = slot
+                regeneration['content_type'] = self.pipeline.encoding.content_type
+            except ValueError as e:
+                self.ring.set_state(slot, shm_transport.ERROR)
+                regeneration.update(success=False, status='error', error=str(e))
+        else:
+            self.ring.write(slot, b'', shm_transport.RESPONSE)
+        return response
+
+    def serve(self, channel):
+        """Serve requests from a channel until it closes or shutdown is requested"""
+        if self.concurrency == 1:
+            for request in channel:
+                channel.send(self.respond(request))
+                if not self.running:
+                    break
+            return
+
+        # Several requests in flight at once; responses are matched by id
+        # and may come back out of order
+        shutdown_request = None
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for request in channel:
+                if isinstance(request, dict) and request.get('cmd') == 'shutdown':
+                    shutdown_request = request
+                    break
+                future = executor.submit(self.respond, request)
+                future.add_done_callback(lambda f: channel.send(f.result()))
+        # Answer shutdown only after in-flight requests have been sent
+        if shutdown_request is not None:
+            channel.send(self.respond(shutdown_request))
+
+def serve_stdio(worker):
+    """Serve JSON lines over stdin/stdout"""
+    # Keep stdout clean for responses: anything else writing to fd 1
+    # (TensorFlow, torch, stray prints) is sent to stderr instead
+    out = os.fdopen(os.dup(sys.stdout.fileno()), 'w')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    sys.stdout = sys.stderr
+
+    debug_print("Worker listening on stdin")
+    worker.serve(JsonLineChannel(sys.stdin, out))
+
+def serve_socket(worker, socket_path):
+    """Serve JSON lines over a Unix socket, one thread per connection"""
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            channel = JsonLineChannel(
+                (line.decode('utf-8') for line in self.rfile),
+                SocketWriter(self.wfile)
+            )
+            worker.serve(channel)
+            if not worker.running:
+                threading.Thread(target=self.server.shutdown, daemon=True).start()
+
+    class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    with Server(socket_path, Handler) as server:
+        debug_print(f"Worker listening on {socket_path}")
+        try:
+            server.serve_forever()
+        finally:
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+
+def serve_metrics(port, host='127.0.0.1'):
+    """Expose the metrics registry over HTTP for Prometheus to scrape"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = METRICS.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    debug_print(f"Metrics available at http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+class SocketWriter:
+    """Text writer on top of a binary socket file"""
+
+    def __init__(self, wfile):
+        self.wfile = wfile
+
+    def write(self, text):
+        self.wfile.write(text.encode('utf-8'))
+
+    def flush(self):
+        self.wfile.flush()
+
+def main():
+    parser = argparse.ArgumentParser(description='Persistent deepfake detection worker')
+    parser.add_argument('--socket', help='Unix socket path (default: serve on stdin/stdout)')
+    parser.add_argument('--lazy', action='store_true', help='Load models on first request instead of at startup')
+    parser.add_argument('--concurrency', type=int, default=1, help='Requests processed in parallel per connection')
+    parser.add_argument('--max-batch-size', type=int, default=1, help='Batch up to this many detections per forward pass')
+    parser.add_argument('--max-wait-ms', type=float, default=5, help='Longest time a detection waits for its batch to fill')
+    parser.add_argument('--backend', choices=['native', 'onnx'], help='Inference backend (default: $UNAI_BACKEND or native)')
+    parser.add_argument('--precision', choices=['fp32', 'int8', 'bf16'], help='int8: models from quantize_models.py, bf16: generator autocast (default: $UNAI_PRECISION or fp32)')
+    parser.add_argument('--cache-dir', help='Reuse results for identical images (default: $UNAI_CACHE_DIR)')
+    parser.add_argument('--cache-max-mb', type=float, default=512, help='Size limit of the result cache')
+    parser.add_argument('--near-dup-index', help='Reuse cached results for re-encoded or resized copies; index file path (default: $UNAI_NEAR_DUP_INDEX, needs a cache)')
+    parser.add_argument('--near-dup-distance', type=int, default=6, help='Largest pHash Hamming distance counted as a near-duplicate')
+    parser.add_argument('--cascade', action='store_true', help='Let a cheap first-stage detector settle clear cases (default: $UNAI_CASCADE)')
+    parser.add_argument('--cascade-low', type=float, default=0.1, help='First-stage score at or below which an image is authentic')
+    parser.add_argument('--cascade-high', type=float, default=0.9, help='First-stage score at or above which an image is a deepfake')
+    parser.add_argument('--tiled', action='store_true', help='Regenerate at full resolution from overlapping tiles (default: $UNAI_TILED)')
+    parser.add_argument('--timings', action='store_true', help='Attach per-stage timings to every response (default: $UNAI_TIMINGS)')
+    parallelism.add_arguments(parser)
+    image_encoding.add_arguments(parser)
+    parser.add_argument('--deliver', choices=image_encoding.DELIVERIES,
+                        help="How process returns a regenerated image: file, base64 or shm (default: $UNAI_OUTPUT_DELIVERY or file)")
+    parser.add_argument('--metrics-port', type=int, help='Serve Prometheus metrics on this port (also available via the metrics command)')
+    parser.add_argument('--shm-ring', help='Also accept images through a shared memory ring created at this path (e.g. /dev/shm/unai-ring)')
+    parser.add_argument('--shm-slots', type=int, default=shm_transport.DEFAULT_SLOTS, help='Slots in the shared memory ring')
+    parser.add_argument('--shm-slot-mb', type=float, default=shm_transport.DEFAULT_SLOT_MB, help='Largest image (request or response) a slot holds')
+    args = parser.parse_args()
+
+    # Thread pools are sized when TensorFlow/torch first load, so this goes first
+    settings = parallelism.configure_from_args(args)
+    debug_print(f"Thread settings: {settings}")
+
+    # Stage metrics are aggregated for the lifetime of the worker
+    METRICS.enabled = True
+    if args.metrics_port is not None:
+        serve_metrics(args.metrics_port)
+
+    if args.cache_dir:
+        cache = ResultCache(args.cache_dir, int(args.cache_max_mb * 1024 * 1024))
+    else:
+        cache = cache_from_env()
+
+    if args.near_dup_index:
+        near_duplicates = NearDuplicateIndex(args.near_dup_index, args.near_dup_distance)
+    else:
+        near_duplicates = near_duplicate_index_from_env()
+    if near_duplicates is not None and cache is None:
+        debug_print("Near-duplicate index ignored: it needs a result cache (--cache-dir)")
+
+    pipeline = Pipeline(cache=cache, backend=args.backend, precision=args.precision, timings=args.timings or None,
+                        tiled=args.tiled or None, cascade=(args.cascade_low, args.cascade_high) if args.cascade else None,
+                        near_duplicates=near_duplicates, encoding=image_encoding.encoding_from_args(args),
+                        delivery=args.deliver)
+    if args.max_batch_size > 1:
+        pipeline.detector = BatchingDetector(pipeline.build_detector(), args.max_batch_size, args.max_wait_ms)
+
+    ring = None
+    if args.shm_ring:
+        ring = shm_transport.SharedRing.create(args.shm_ring, args.shm_slots, int(args.shm_slot_mb * 1024 * 1024))
+        debug_print(f"Shared memory ring at {args.shm_ring}: {args.shm_slots} x {args.shm_slot_mb} MB")
+
+    worker = PipelineWorker(pipeline, concurrency=args.concurrency, ring=ring)
+    try:
+        if not args.lazy:
+            worker.preload()
+
+        if args.socket:
+            serve_socket(worker, args.socket)
+        else:
+            serve_stdio(worker)
+    finally:
+        if ring is not None:
+            ring.close()
+        # shm deliveries the client never released
+        image_encoding.SHM_RESULTS.cleanup()
+
+if __name__ == "__main__":
+    main()
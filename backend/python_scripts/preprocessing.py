@@ -0,0 +1,132 @@
+import io
+import os
+import threading
+
+import numpy as np
+from PIL import Image
+
+# Both models take 128x128 RGB input
+MODEL_SIZE = (128, 128)
+
+# The detector was fed PIL's default resize filter and the regenerator
+# torchvision's Resize; keep both so results stay the same as before
+DETECTOR_RESAMPLE = Image.BICUBIC
+GENERATOR_RESAMPLE = Image.BILINEAR
+
+IMAGENET_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32).reshape(3, 1, 1)
+IMAGENET_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32).reshape(3, 1, 1)
+
+# JPEGs at least this many times larger than the model input are decoded
+# at a reduced DCT scale instead of at full resolution
+DRAFT_FACTOR = 4
+
+class DecodedImage:
+    """An upload decoded once, with its model-sized uint8 buffers cached"""
+
+    def __init__(self, image, source=None):
+        self.image = image
+        self.source = source
+        self.resized = {}
+
+    @property
+    def size(self):
+        return self.image.size
+
+    def pixels(self, size, resample):
+        """Resized HWC uint8 buffer, computed once per (size, filter)"""
+        key = (size, resample)
+        if key not in self.resized:
+            self.resized[key] = np.asarray(self.image.resize(size, resample), dtype=np.uint8)
+        return self.resized[key]
+
+    def detector_pixels(self):
+        return self.pixels(MODEL_SIZE, DETECTOR_RESAMPLE)
+
+    def generator_pixels(self):
+        return self.pixels(MODEL_SIZE, GENERATOR_RESAMPLE)
+
+def decode_image(source, draft=None):
+    """Decode a path, bytes or file object into an RGB DecodedImage (no-op if already decoded)"""
+    if isinstance(source, DecodedImage):
+        return source
+    if draft is None:
+        draft = os.environ.get('UNAI_JPEG_DRAFT', '1') != '0'
+
+    fp = io.BytesIO(source) if isinstance(source, (bytes, bytearray, memoryview)) else source
+    image = Image.open(fp)
+
+    if draft and image.format == 'JPEG':
+        width, height = image.size
+        if width >= MODEL_SIZE[0] * DRAFT_FACTOR and height >= MODEL_SIZE[1] * DRAFT_FACTOR:
+            # Let libjpeg scale down while decoding, keeping 2x headroom for the resize
+            image.draft('RGB', (MODEL_SIZE[0] * 2, MODEL_SIZE[1] * 2))
+
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    else:
+        image.load()
+    return DecodedImage(image, source if isinstance(source, str) else None)
+
+_buffers = threading.local()
+
+def batch_buffer(name, shape):
+    """Per-thread preallocated float32 array, grown when a bigger batch arrives
+
+    The returned view is overwritten by the next call on the same thread, so
+    it must be consumed (e.g. by a forward pass) before preparing another batch.
+    """
+    buffers = getattr(_buffers, 'arrays', None)
+    if buffers is None:
+        buffers = _buffers.arrays = {}
+    array = buffers.get(name)
+    if array is None or array.shape[0] < shape[0] or array.shape[1:] != tuple(shape[1:]):
+        array = buffers[name] = np.empty(shape, dtype=np.float32)
+    return array[:shape[0]]
+
+def detector_shape(count):
+    return (count, MODEL_SIZE[1], MODEL_SIZE[0], 3)
+
+def generator_shape(count):
+    return (count, 3, MODEL_SIZE[1], MODEL_SIZE[0])
+
+def channels_last_view(array):
+    """NCHW view of an NHWC array, which torch.from_numpy turns into a channels_last tensor"""
+    return array.transpose(0, 3, 1, 2)
+
+def generator_buffer(name, shape, channels_last=False):
+    """batch_buffer for an NCHW generator batch, laid out NHWC in memory when channels_last"""
+    if not channels_last:
+        return batch_buffer(name, shape)
+    count, channels, height, width = shape
+    return channels_last_view(batch_buffer(f'{name}_nhwc', (count, height, width, channels)))
+
+def detector_batch(images, out=None):
+    """NHWC float32 detector input in [0, 1] for a list of DecodedImages"""
+    if out is None:
+        out = np.empty(detector_shape(len(images)), dtype=np.float32)
+    for i, image in enumerate(images):
+        np.divide(image.detector_pixels(), np.float32(255.0), out=out[i])
+    return out
+
+def generator_input(pixels, out):
+    """Normalize one HWC uint8 array into a CHW float32 slot of a generator batch"""
+    np.divide(pixels.transpose(2, 0, 1), np.float32(255.0), out=out)
+    out -= IMAGENET_MEAN
+    out /= IMAGENET_STD
+    return out
+
+def generator_batch(images, out=None, channels_last=False):
+    """NCHW float32 generator input with ImageNet normalization for a list of DecodedImages
+
+    channels_last: write the batch NHWC in memory (still indexed NCHW), so a
+    channels_last model gets it without another copy
+    """
+    if out is None:
+        count, channels, height, width = generator_shape(len(images))
+        if channels_last:
+            out = channels_last_view(np.empty((count, height, width, channels), dtype=np.float32))
+        else:
+            out = np.empty((count, channels, height, width), dtype=np.float32)
+    for i, image in enumerate(images):
+        generator_input(image.generator_pixels(), out[i])
+    return out
@@ -0,0 +1,177 @@
+import os
+import sys
+import json
+import time
+import argparse
+import warnings
+
+import numpy as np
+
+from detection_pipeline import (
+    DeepfakeDetector, ImageRegenerator, debug_print, timed_import, safe_print_json, expand_image_paths
+)
+from model_artifacts import artifact_path, QUANTIZED_DETECTOR_SUFFIX, QUANTIZED_GENERATOR_SUFFIX, TFLitePredictor
+
+def psnr(reference, test):
+    """Peak signal-to-noise ratio between two uint8 images, in dB"""
+    reference = np.asarray(reference, dtype=np.float64)
+    test = np.asarray(test, dtype=np.float64)
+    mse = np.mean((reference - test) ** 2)
+    if mse == 0:
+        return float('inf')
+    return float(10 * np.log10(255.0 ** 2 / mse))
+
+def quantize_detector(detector, calibration_arrays, output_path):
+    """Post-training INT8 quantization of the Keras detector via the TFLite converter"""
+    tf = timed_import('tensorflow')
+
+    def representative_dataset():
+        for array in calibration_arrays:
+            yield [array.astype(np.float32)]
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(detector.model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = representative_dataset
+    # INT8 kernels inside, float input/output so it is a drop-in replacement
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8, tf.lite.OpsSet.TFLITE_BUILTINS]
+    with open(output_path, 'wb') as f:
+        f.write(converter.convert())
+
+    debug_print(f"✅ Wrote INT8 detector to: {output_path}")
+    return output_path
+
+def quantize_generator(regenerator, calibration_tensors, output_path, batch_size=4):
+    """Static INT8 quantization of the Generator (FX graph mode), saved as TorchScript"""
+    torch = timed_import('torch')
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    # The Generator has no Linear layers, so dynamic quantization would leave it untouched;
+    # the convolutions need static quantization with calibrated activation ranges
+    engine = 'x86' if 'x86' in torch.backends.quantized.supported_engines else 'qnnpack'
+    torch.backends.quantized.engine = engine
+
+    model = regenerator.model.cpu().eval()
+    example = torch.stack(calibration_tensors[:1])
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        prepared = prepare_fx(model, get_default_qconfig_mapping(engine), (example,))
+        with torch.inference_mode():
+            for start in range(0, len(calibration_tensors), batch_size):
+                prepared(torch.stack(calibration_tensors[start:start + batch_size]))
+        quantized = convert_fx(prepared)
+        with torch.no_grad():
+            traced = torch.jit.freeze(torch.jit.trace(quantized, example))
+    traced.save(output_path)
+
+    debug_print(f"✅ Wrote INT8 generator to: {output_path} (engine: {engine})")
+    return output_path
+
+def report_detector(detector, int8_path, arrays):
+    """Compare FP32 and INT8 detector confidences on the evaluation images"""
+    int8 = TFLitePredictor(int8_path)
+    batch = np.concatenate(arrays, axis=0)
+
+    start = time.perf_counter()
+    fp32_scores = detector.model.predict(batch, verbose=0)[:, -1]
+    fp32_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    int8_scores = int8.predict(batch)[:, -1]
+    int8_ms = (time.perf_counter() - start) * 1000
+
+    diff = np.abs(fp32_scores - int8_scores)
+    return {
+        'images': int(batch.shape[0]),
+        'mean_abs_confidence_diff': float(diff.mean()),
+        'max_abs_confidence_diff': float(diff.max()),
+        'label_agreement': float(np.mean((fp32_scores > 0.5) == (int8_scores > 0.5))),
+        'fp32_ms': round(fp32_ms, 2),
+        'int8_ms': round(int8_ms, 2),
+    }
+
+def report_generator(regenerator, int8_path, tensors, batch_size=4):
+    """Compare FP32 and INT8 generator outputs by PSNR of the final uint8 images"""
+    torch = timed_import('torch')
+    int8 = torch.jit.load(int8_path, map_location='cpu')
+
+    values = []
+    fp32_ms = 0.0
+    int8_ms = 0.0
+    with torch.inference_mode():
+        for start in range(0, len(tensors), batch_size):
+            batch = torch.stack(tensors[start:start + batch_size])
+
+            t = time.perf_counter()
+            fp32_out = regenerator.model(batch)
+            fp32_ms += (time.perf_counter() - t) * 1000
+            t = time.perf_counter()
+            int8_out = int8(batch)
+            int8_ms += (time.perf_counter() - t) * 1000
+
+            for reference, test in zip(regenerator.to_images(fp32_out), regenerator.to_images(int8_out)):
+                values.append(psnr(reference, test))
+
+    finite = [v for v in values if np.isfinite(v)] or [float('inf')]
+    return {
+        'images': len(values),
+        'mean_psnr_db': float(np.mean(finite)),
+        'min_psnr_db': float(np.min(finite)),
+        'fp32_ms': round(fp32_ms, 2),
+        'int8_ms': round(int8_ms, 2),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='INT8 quantization with calibration and accuracy report')
+    parser.add_argument('command', choices=['calibrate', 'report'])
+    parser.add_argument('--images', nargs='+', required=True, help='Calibration images (files, globs or directories)')
+    parser.add_argument('--eval-images', nargs='+', help='Images for the report (default: the calibration images)')
+    parser.add_argument('--max-images', type=int, default=200)
+    parser.add_argument('--report', help='Where to write the JSON report (default: next to the models)')
+    parser.add_argument('--skip-detector', action='store_true')
+    parser.add_argument('--skip-generator', action='store_true')
+    args = parser.parse_args()
+
+    calibration_paths = expand_image_paths(args.images)[:args.max_images]
+    eval_paths = expand_image_paths(args.eval_images)[:args.max_images] if args.eval_images else calibration_paths
+    if not calibration_paths:
+        debug_print("❌ No calibration images found")
+        sys.exit(1)
+    debug_print(f"Calibrating on {len(calibration_paths)} images, evaluating on {len(eval_paths)}")
+
+    report = {'calibration_images': len(calibration_paths)}
+
+    if not args.skip_detector:
+        detector = DeepfakeDetector(backend='native', use_artifacts=False)
+        if not detector.model_path:
+            debug_print("❌ No DeepFake model found")
+            sys.exit(1)
+        int8_path = artifact_path(detector.model_path, QUANTIZED_DETECTOR_SUFFIX)
+        if args.command == 'calibrate':
+            quantize_detector(detector, [detector.preprocess_image(p) for p in calibration_paths], int8_path)
+        report['detector'] = report_detector(detector, int8_path, [detector.preprocess_image(p) for p in eval_paths])
+
+    if not args.skip_generator:
+        regenerator = ImageRegenerator(use_artifacts=False, backend='native', graph_mode='fold', precision='fp32',
+                                       channels_last=False)
+        if regenerator.ensure_loaded() is None:
+            debug_print("❌ No regenerator model found")
+            sys.exit(1)
+        int8_path = artifact_path(regenerator.model_path, QUANTIZED_GENERATOR_SUFFIX)
+        regenerator.model.cpu()
+        if args.command == 'calibrate':
+            quantize_generator(regenerator, [regenerator.load_input(p) for p in calibration_paths], int8_path)
+        report['generator'] = report_generator(regenerator, int8_path, [regenerator.load_input(p) for p in eval_paths])
+
+    report_path = args.report
+    if not report_path:
+        model_dir = os.path.dirname(os.path.abspath(DeepfakeDetector.find_deepfake_model() or ImageRegenerator.find_regenerator_model() or '.'))
+        report_path = os.path.join(model_dir, 'quantization_report.json')
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    debug_print(f"Report written to: {report_path}")
+
+    safe_print_json(report)
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,15 @@ import torchvision.transforms as transforms
 from PIL import Image
 import numpy as np
 import os
+from model_cache import MODEL_CACHE
+from graph_optimize import ExecutionMode, optimize, resolve_mode
+from image_encoding import ENCODER_POOL, OutputEncoding, deliver, resolve_delivery
+import parallelism
+
+# UNAI_INTRA_OP_THREADS / UNAI_INTER_OP_THREADS, applied before torch runs anything
+parallelism.configure_framework('torch', torch)
+
+DEFAULT_MODEL_PATH = '/home/varun-kasnia/Documents/Programming Files/Projects/UnAI/models/regenerator_model.pth'
 
 class ImageRegenerator(nn.Module):
     """Enhanced image regenerator model"""
@@ -69,7 +78,7 @@ class ImageRegenerator(nn.Module):
         
         return output
 
-def load_regenerator_model(model_path='/home/varun-kasnia/Documents/Programming Files/Projects/UnAI/models/regenerator_model.pth'):
+def load_regenerator_model(model_path=DEFAULT_MODEL_PATH):
     """Load the trained regenerator model"""
     try:
         if not os.path.exists(model_path):
@@ -96,6 +105,35 @@ def load_regenerator_model(model_path='/home/varun-kasnia/Documents/Programming
     except Exception as e:
         raise Exception(f"Error loading regenerator model: {str(e)}")
 
+def get_regenerator_model(model_path=DEFAULT_MODEL_PATH):
+    """Loaded regenerator model and its device, shared across calls (see model_cache.py)"""
+    if not os.path.exists(model_path):
+        raise Exception(f"Error loading regenerator model: Regenerator model not found: {model_path}")
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    mode = resolve_mode()
+    # channels_last / bf16 from UNAI_CHANNELS_LAST and UNAI_PRECISION
+    execution = ExecutionMode(device)
+
+    def load(path):
+        model = execution.prepare(load_regenerator_model(path)[0])
+        example = execution.example((256, 256))
+        return execution.wrap(optimize(model, mode, example, execution.bf16), example)
+
+    # The modes are part of the key so switching them never serves a stale build
+    model = MODEL_CACHE.get(model_path, load, device=f'{device}:{mode}:{execution.name}')
+    return model, device
+
+def warmup(model_path=DEFAULT_MODEL_PATH):
+    """Load the model and run one forward pass so the first real call only pays for inference"""
+    model, device = get_regenerator_model(model_path)
+    with torch.no_grad():
+        model(torch.zeros(1, 3, 256, 256, device=device))
+    return model
+
+def evict(model_path=None):
+    """Drop the cached model (all cached models when model_path is None)"""
+    return MODEL_CACHE.evict(model_path)
+
 def preprocess_for_regeneration(image_path, target_size=(256, 256)):
     """Preprocess image for regeneration"""
     try:
@@ -135,11 +173,17 @@ def postprocess_regenerated(output_tensor):
     except Exception as e:
         raise Exception(f"Error postprocessing regenerated image: {str(e)}")
 
-def regenerate_image(image_path, model_path='/home/varun-kasnia/Documents/Programming Files/Projects/UnAI/models/regenerator_model.pth'):
-    """Regenerate authentic image from deepfake"""
+def regenerate_image(image_path, model_path=DEFAULT_MODEL_PATH, encoding=None, delivery=None):
+    """Regenerate authentic image from deepfake
+    
+    encoding: OutputEncoding (default from UNAI_OUTPUT_*); delivery: 'file', 'base64' or 'shm'
+    """
     try:
-        # Load model
-        model, device = load_regenerator_model(model_path)
+        encoding = encoding or OutputEncoding()
+        delivery = resolve_delivery(delivery)
+        
+        # Load model (only on the first call)
+        model, device = get_regenerator_model(model_path)
         
         # Preprocess input image
         input_tensor = preprocess_for_regeneration(image_path)
@@ -152,16 +196,22 @@ def regenerate_image(image_path, model_path='/home/varun-kasnia/Documents/Progra
         # Postprocess output
         regenerated_image = postprocess_regenerated(output_tensor.cpu())
         
+        if delivery != 'file':
+            # Handed back in memory, the uploads folder is not touched
+            result = {'success': True, 'regenerated_path': None, 'message': 'Image regenerated successfully'}
+            result.update(deliver(ENCODER_POOL.encode(regenerated_image, encoding), encoding, delivery))
+            return result
+        
         # Save regenerated image
         output_dir = 'uploads/regenerated'
         os.makedirs(output_dir, exist_ok=True)
         
         # Generate output filename
         base_name = os.path.splitext(os.path.basename(image_path))[0]
-        output_path = os.path.join(output_dir, f"{base_name}_regenerated.jpg")
+        output_path = os.path.join(output_dir, f"{base_name}_regenerated{encoding.extension}")
         
         # Save image
-        regenerated_image.save(output_path, 'JPEG', quality=95)
+        ENCODER_POOL.save(regenerated_image, encoding, output_path)
         
         return {
             'success': True,
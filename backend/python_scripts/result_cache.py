@@ -0,0 +1,156 @@
+import os
+import json
+import time
+import shutil
+import sqlite3
+import hashlib
+import threading
+
+from detection_pipeline import debug_print
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """SHA-256 of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+_fingerprints = {}
+_fingerprints_lock = threading.Lock()
+
+def model_fingerprint(model_path):
+    """Content hash of a model file, recomputed only when the file changes on disk"""
+    if not model_path:
+        return None
+
+    stat = os.stat(model_path)
+    key = (os.path.realpath(model_path), stat.st_size, stat.st_mtime_ns)
+
+    with _fingerprints_lock:
+        fingerprint = _fingerprints.get(key)
+    if fingerprint is None:
+        fingerprint = file_sha256(model_path)
+        with _fingerprints_lock:
+            _fingerprints[key] = fingerprint
+    return fingerprint
+
+class ResultCache:
+    """On-disk cache of detection/regeneration results keyed by image and model content
+
+    Entries live in a small SQLite index next to the regenerated image blobs.
+    When the total size goes over max_bytes the least recently used entries
+    are evicted. Keys include the model fingerprint, so replacing a model
+    file makes its old entries unreachable and they age out.
+    """
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.blob_dir = os.path.join(self.cache_dir, 'blobs')
+        self.max_bytes = int(max_bytes)
+        os.makedirs(self.blob_dir, exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(self.cache_dir, 'index.sqlite3'), check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                result TEXT NOT NULL,
+                blob TEXT,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+        ''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)')
+        self.db.commit()
+
+    @staticmethod
+    def make_key(kind, image_hash, model_path, variant=None):
+        """Cache key for one stage, or None if the model cannot be fingerprinted (e.g. the mock model)"""
+        fingerprint = model_fingerprint(model_path)
+        if fingerprint is None:
+            return None
+        if variant:
+            # Different precisions of the same weights give different results
+            fingerprint = f"{fingerprint}:{variant}"
+        return f"{kind}:{image_hash}:{fingerprint}"
+
+    def get(self, key):
+        """Return (result, blob_path) for a key, or (None, None) on a miss"""
+        if key is None:
+            return None, None
+
+        with self.lock:
+            row = self.db.execute('SELECT result, blob FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None, None
+
+            result, blob = row
+            if blob and not os.path.exists(blob):
+                # Blob was removed behind our back, drop the stale entry
+                self.db.execute('DELETE FROM entries WHERE key = ?', (key,))
+                self.db.commit()
+                return None, None
+
+            self.db.execute('UPDATE entries SET last_access = ? WHERE key = ?', (time.time(), key))
+            self.db.commit()
+            return json.loads(result), blob
+
+    def put(self, key, result, blob_source=None, blob_bytes=None):
+        """Store a result, copying blob_source (e.g. a regenerated image) or blob_bytes into the cache"""
+        if key is None:
+            return
+
+        blob = None
+        size = len(json.dumps(result))
+        if blob_source or blob_bytes is not None:
+            blob = os.path.join(self.blob_dir, hashlib.sha256(key.encode('utf-8')).hexdigest())
+            if blob_source:
+                shutil.copyfile(blob_source, blob)
+            else:
+                with open(blob, 'wb') as f:
+                    f.write(blob_bytes)
+            size += os.path.getsize(blob)
+
+        with self.lock:
+            self.db.execute(
+                'INSERT OR REPLACE INTO entries (key, result, blob, size, last_access) VALUES (?, ?, ?, ?, ?)',
+                (key, json.dumps(result), blob, size, time.time())
+            )
+            self.db.commit()
+            self._evict()
+
+    def _evict(self):
+        """Drop least recently used entries until the cache fits in max_bytes"""
+        total = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        rows = self.db.execute('SELECT key, blob, size FROM entries ORDER BY last_access ASC').fetchall()
+        evicted = 0
+        for key, blob, size in rows:
+            if total <= self.max_bytes:
+                break
+            self.db.execute('DELETE FROM entries WHERE key = ?', (key,))
+            if blob and os.path.exists(blob):
+                os.remove(blob)
+            total -= size
+            evicted += 1
+        self.db.commit()
+        debug_print(f"Evicted {evicted} cache entries")
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+def cache_from_env():
+    """Build a ResultCache from UNAI_CACHE_DIR / UNAI_CACHE_MAX_MB, or None if not configured"""
+    cache_dir = os.environ.get('UNAI_CACHE_DIR')
+    if not cache_dir:
+        return None
+    max_mb = os.environ.get('UNAI_CACHE_MAX_MB')
+    max_bytes = int(float(max_mb) * 1024 * 1024) if max_mb else DEFAULT_MAX_BYTES
+    return ResultCache(cache_dir, max_bytes)
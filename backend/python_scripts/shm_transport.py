@@ -0,0 +1,227 @@
+import os
+import sys
+import json
+import mmap
+import time
+import struct
+import argparse
+import tempfile
+import threading
+import subprocess
+
+from image_encoding import FORMATS
+
+# A ring of fixed-size slots in one memory-mapped file (on /dev/shm, so it
+# never touches disk). The client copies image bytes into a free slot and
+# sends {"cmd": "process", "shm_slot": k, "length": n} on the worker's
+# normal JSON channel; the worker decodes straight from the mapping and
+# writes the regenerated image back into the same slot.
+#
+# Layout (little endian):
+#   0   header     8s magic "UNAIRING", u32 version, u32 slots, u64 slot_size, zero padded to 64 bytes
+#   64  slot 0     u32 state, u32 length, 8 bytes padding, then slot_size data bytes
+#   ... slot k at 64 + k * (16 + slot_size)
+MAGIC = b'UNAIRING'
+VERSION = 1
+HEADER = struct.Struct('<8sIIQ')
+HEADER_SIZE = 64
+SLOT_HEADER = struct.Struct('<II')
+SLOT_HEADER_SIZE = 16
+
+# Content type of a regenerated image -> file extension
+EXTENSIONS = {content_type: extension for _, extension, content_type in FORMATS.values()}
+
+# Slot states
+FREE = 0
+REQUEST = 1
+RESPONSE = 2
+ERROR = 3
+
+DEFAULT_SLOTS = 8
+DEFAULT_SLOT_MB = 16
+
+def default_ring_path():
+    base = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(base, f'unai-ring-{os.getpid()}')
+
+class SharedRing:
+    """Slots of a memory-mapped ring file shared between a client and a worker"""
+
+    def __init__(self, path, mapping, slots, slot_size, owner=False):
+        self.path = path
+        self.mapping = mapping
+        self.slots = slots
+        self.slot_size = slot_size
+        self.owner = owner
+        self.lock = threading.Lock()
+        self.free = list(range(slots))
+
+    @classmethod
+    def create(cls, path, slots=DEFAULT_SLOTS, slot_size=DEFAULT_SLOT_MB * 1024 * 1024):
+        """Create (or replace) the ring file; the creator unlinks it on close"""
+        size = HEADER_SIZE + slots * (SLOT_HEADER_SIZE + slot_size)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            os.ftruncate(fd, size)
+            mapping = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        HEADER.pack_into(mapping, 0, MAGIC, VERSION, slots, slot_size)
+        return cls(path, mapping, slots, slot_size, owner=True)
+
+    @classmethod
+    def attach(cls, path):
+        """Map a ring created by another process"""
+        fd = os.open(path, os.O_RDWR)
+        try:
+            mapping = mmap.mmap(fd, 0)
+        finally:
+            os.close(fd)
+        magic, version, slots, slot_size = HEADER.unpack_from(mapping, 0)
+        if magic != MAGIC or version != VERSION:
+            mapping.close()
+            raise ValueError(f'{path} is not a version {VERSION} shared memory ring')
+        return cls(path, mapping, slots, slot_size)
+
+    def describe(self):
+        return {'path': self.path, 'slots': self.slots, 'slot_size': self.slot_size}
+
+    def offset(self, slot):
+        if not 0 <= slot < self.slots:
+            raise IndexError(f'Shared memory slot {slot} out of range (0-{self.slots - 1})')
+        return HEADER_SIZE + slot * (SLOT_HEADER_SIZE + self.slot_size)
+
+    def state(self, slot):
+        return SLOT_HEADER.unpack_from(self.mapping, self.offset(slot))
+
+    def set_state(self, slot, state):
+        struct.pack_into('<I', self.mapping, self.offset(slot), state)
+
+    def read(self, slot, length=None):
+        """Zero-copy view of a slot's payload; release() it before the slot is reused"""
+        offset = self.offset(slot)
+        _, stored = SLOT_HEADER.unpack_from(self.mapping, offset)
+        length = stored if length is None else int(length)
+        if not 0 <= length <= self.slot_size:
+            raise ValueError(f'Invalid length {length} for a {self.slot_size} byte slot')
+        start = offset + SLOT_HEADER_SIZE
+        return memoryview(self.mapping)[start:start + length]
+
+    def write(self, slot, data, state):
+        """Copy data into a slot, publishing the state only once the bytes are in place"""
+        offset = self.offset(slot)
+        length = len(data)
+        if length > self.slot_size:
+            raise ValueError(f'{length} bytes do not fit in a {self.slot_size} byte shared memory slot')
+        start = offset + SLOT_HEADER_SIZE
+        self.mapping[start:start + length] = data
+        SLOT_HEADER.pack_into(self.mapping, offset, state, length)
+
+    def acquire(self):
+        """Reserve a free slot (client side)"""
+        with self.lock:
+            if not self.free:
+                raise RuntimeError('All shared memory slots are in use')
+            return self.free.pop()
+
+    def release(self, slot):
+        self.set_state(slot, FREE)
+        with self.lock:
+            self.free.append(slot)
+
+    def close(self):
+        try:
+            self.mapping.close()
+        except BufferError:
+            # A view is still alive somewhere; the mapping goes with the process
+            pass
+        if self.owner and os.path.exists(self.path):
+            os.unlink(self.path)
+
+class SharedRingClient:
+    """Drive a pipeline_worker over stdio, passing images through its shared memory ring
+
+    Reference client for the protocol; the Node server does the same with
+    positional reads and writes on the ring file.
+    """
+
+    def __init__(self, ring_path=None, slots=DEFAULT_SLOTS, slot_mb=DEFAULT_SLOT_MB, worker_args=()):
+        self.ring_path = ring_path or default_ring_path()
+        worker = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pipeline_worker.py')
+        command = [sys.executable, worker, '--shm-ring', self.ring_path,
+                   '--shm-slots', str(slots), '--shm-slot-mb', str(slot_mb)] + list(worker_args)
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        self.lock = threading.Lock()
+        self.next_id = 0
+        # The worker creates the ring before it answers anything
+        self.ring = SharedRing.attach(self.call({'cmd': 'ping'})['shm_ring']['path'])
+
+    def call(self, request):
+        with self.lock:
+            self.process.stdin.write(json.dumps(request) + '\n')
+            self.process.stdin.flush()
+            line = self.process.stdout.readline()
+        if not line:
+            raise RuntimeError('Worker exited')
+        return json.loads(line)
+
+    def process_bytes(self, data, timings=False):
+        """(response, regenerated image bytes or None) for one encoded image"""
+        slot = self.ring.acquire()
+        try:
+            self.ring.write(slot, data, REQUEST)
+            self.next_id += 1
+            request = {'cmd': 'process', 'shm_slot': slot, 'length': len(data), 'id': self.next_id}
+            if timings:
+                request['timings'] = True
+            response = self.call(request)
+            output = None
+            regeneration = response.get('regeneration')
+            if regeneration and regeneration.get('shm_length') is not None:
+                with self.ring.read(slot, regeneration['shm_length']) as view:
+                    output = bytes(view)
+            return response, output
+        finally:
+            self.ring.release(slot)
+
+    def close(self):
+        try:
+            self.call({'cmd': 'shutdown'})
+        except (RuntimeError, OSError, ValueError):
+            pass
+        self.process.wait()
+        self.ring.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Run images through a worker using the shared memory transport')
+    parser.add_argument('images', nargs='+')
+    parser.add_argument('--output-dir', help='Write regenerated images here')
+    parser.add_argument('--ring', help='Ring file (default: /dev/shm/unai-ring-<pid>)')
+    parser.add_argument('--slots', type=int, default=DEFAULT_SLOTS)
+    parser.add_argument('--slot-mb', type=float, default=DEFAULT_SLOT_MB)
+    parser.add_argument('--timings', action='store_true')
+    args, worker_args = parser.parse_known_args()
+
+    client = SharedRingClient(args.ring, args.slots, args.slot_mb, worker_args)
+    try:
+        for img_path in args.images:
+            with open(img_path, 'rb') as f:
+                data = f.read()
+            start = time.perf_counter()
+            response, output = client.process_bytes(data, timings=args.timings)
+            response['image_path'] = img_path
+            response['roundtrip_ms'] = round((time.perf_counter() - start) * 1000, 2)
+            if output is not None and args.output_dir:
+                os.makedirs(args.output_dir, exist_ok=True)
+                # The worker's --output-format decides the file type
+                extension = EXTENSIONS.get(response['regeneration'].get('content_type'), '.jpg')
+                name = os.path.splitext(os.path.basename(img_path))[0] + '_regenerated' + extension
+                with open(os.path.join(args.output_dir, name), 'wb') as f:
+                    f.write(output)
+                response['regeneration']['output_path'] = os.path.join(args.output_dir, name)
+            print(json.dumps(response), flush=True)
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    main()
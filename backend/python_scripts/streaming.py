@@ -0,0 +1,213 @@
+import os
+import sys
+import time
+import queue
+import argparse
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from detection_pipeline import ImageRegenerator, debug_print, expand_image_paths, safe_print_json
+from preprocessing import decode_image, generator_batch, generator_shape, generator_buffer
+import image_encoding
+from image_encoding import ENCODER_POOL
+
+_END = object()
+
+def _decode(source):
+    """Decode stage: read the file and resize it to the generator input size"""
+    image = decode_image(source)
+    image.generator_pixels()
+    return image
+
+def _done(value):
+    future = Future()
+    future.set_result(value)
+    return future
+
+class StreamingRegenerator:
+    """Regenerates a stream of images with decode, inference and encode overlapped
+
+    Decoding and encoding run on thread pools while a single thread feeds
+    the model, so while batch N is in the forward pass, batch N+1 is being
+    decoded and batch N-1 written out. Stages are joined by bounded queues: a
+    slow stage stalls the ones before it instead of letting work pile up in
+    memory. Results come back in input order. Encodes go to the process-wide
+    ENCODER_POOL (image_encoding.py), shared with every other regeneration.
+    """
+
+    def __init__(self, regenerator, batch_size=8, decode_workers=4, queue_size=None):
+        self.regenerator = regenerator
+        self.batch_size = max(1, int(batch_size))
+        self.decode_workers = max(1, int(decode_workers))
+        # Enough read-ahead to have the next batch decoded while the current one runs
+        self.queue_size = queue_size or self.batch_size * 2
+
+    def error_result(self, img_path, e):
+        return {
+            'image_path': img_path,
+            'success': False,
+            'output_path': None,
+            'status': 'error',
+            'error': str(e)
+        }
+
+    def run(self, img_paths, output_paths=None):
+        """Yield one regeneration result per input, in order, as they complete"""
+        img_paths = list(img_paths)
+        if output_paths is None:
+            output_paths = [None] * len(img_paths)
+        if len(output_paths) != len(img_paths):
+            raise ValueError('output_paths must have the same length as img_paths')
+
+        if self.regenerator.ensure_loaded() is None:
+            for img_path in img_paths:
+                yield self.error_result(img_path, 'Regenerator model not available')
+            return
+
+        decoded = queue.Queue(maxsize=self.queue_size)
+        encoded = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+
+        def put(q, item):
+            # Give up instead of blocking forever once the consumer has gone away
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def get(q):
+            while not stop.is_set():
+                try:
+                    return q.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+            return _END
+
+        def feed(decode_pool):
+            try:
+                for i, img_path in enumerate(img_paths):
+                    if not put(decoded, (i, decode_pool.submit(_decode, img_path))):
+                        return
+            finally:
+                put(decoded, _END)
+
+        def infer():
+            try:
+                finished = False
+                while not finished and not stop.is_set():
+                    batch = []
+                    while len(batch) < self.batch_size:
+                        item = get(decoded)
+                        if item is _END:
+                            finished = True
+                            break
+                        i, future = item
+                        try:
+                            batch.append((i, future.result()))
+                        except Exception as e:
+                            # Keep the slot so results stay in input order
+                            batch.append((i, e))
+                    if batch:
+                        self.run_batch(batch, put, encoded, img_paths, output_paths)
+            finally:
+                put(encoded, _END)
+
+        with ThreadPoolExecutor(self.decode_workers, thread_name_prefix='stream-decode') as decode_pool:
+            threads = [
+                threading.Thread(target=feed, args=(decode_pool,), name='stream-feed', daemon=True),
+                threading.Thread(target=infer, name='stream-infer', daemon=True),
+            ]
+            for thread in threads:
+                thread.start()
+            try:
+                while True:
+                    item = encoded.get()
+                    if item is _END:
+                        break
+                    yield item[1].result()
+            finally:
+                stop.set()
+                for thread in threads:
+                    thread.join()
+
+    def run_batch(self, batch, put, encoded, img_paths, output_paths):
+        """Inference stage for one batch; the encodes are handed to the shared encoder pool"""
+        regenerator = self.regenerator
+        images = [image for _, image in batch if not isinstance(image, Exception)]
+        outputs = {}
+        failure = None
+        if images:
+            try:
+                shape = generator_shape(len(images))
+                inputs = generator_batch(images, out=generator_buffer('generator', shape, regenerator.channels_last))
+                output_images = iter(regenerator.to_images(regenerator.forward(inputs)))
+                outputs = {i: next(output_images) for i, image in batch if not isinstance(image, Exception)}
+            except Exception as e:
+                debug_print(f"❌ Error during streaming regeneration: {str(e)}")
+                failure = e
+
+        for i, image in batch:
+            if isinstance(image, Exception) or failure is not None:
+                put(encoded, (i, _done(self.error_result(img_paths[i], image if isinstance(image, Exception) else failure))))
+                continue
+            output_path = output_paths[i] or regenerator.default_output_path(img_paths[i])
+            put(encoded, (i, ENCODER_POOL.submit(self.encode, img_paths[i], outputs[i], output_path)))
+
+    def encode(self, img_path, output_image, output_path):
+        try:
+            self.regenerator.save_image(output_image, output_path)
+        except Exception as e:
+            debug_print(f"❌ Error saving {img_path}: {str(e)}")
+            return self.error_result(img_path, e)
+        return {
+            'image_path': img_path,
+            'success': True,
+            'output_path': output_path,
+            'status': 'success'
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description='Regenerate many images with overlapped decode, inference and encode')
+    parser.add_argument('inputs', nargs='+', help='Image files, globs or directories')
+    parser.add_argument('--output-dir', help='Where to write regenerated images (default: the uploads/regenerated folder)')
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--decode-workers', type=int, default=4)
+    parser.add_argument('--encode-workers', type=int,
+                        help='Threads of the shared encoder pool (default: $UNAI_ENCODE_WORKERS or up to 4)')
+    parser.add_argument('--backend', choices=['native', 'onnx'])
+    parser.add_argument('--precision', choices=['fp32', 'int8', 'bf16'])
+    image_encoding.add_arguments(parser)
+    args = parser.parse_args()
+
+    img_paths = expand_image_paths(args.inputs)
+    encoding = image_encoding.encoding_from_args(args)
+    output_paths = None
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+        output_paths = [
+            os.path.join(args.output_dir, f"{os.path.splitext(os.path.basename(p))[0]}_regenerated{encoding.extension}")
+            for p in img_paths
+        ]
+
+    if args.encode_workers:
+        ENCODER_POOL.resize(args.encode_workers)
+    regenerator = ImageRegenerator(backend=args.backend, precision=args.precision, encoding=encoding)
+    stream = StreamingRegenerator(regenerator, args.batch_size, args.decode_workers)
+
+    start = time.perf_counter()
+    failed = 0
+    for result in stream.run(img_paths, output_paths):
+        failed += result['status'] == 'error'
+        safe_print_json(result)
+    elapsed = time.perf_counter() - start
+    debug_print(f"Regenerated {len(img_paths) - failed}/{len(img_paths)} images in {elapsed:.2f}s "
+                f"({len(img_paths) / max(elapsed, 1e-9):.1f} images/s)")
+
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
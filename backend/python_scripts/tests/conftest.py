@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The scripts are plain modules in the parent folder, imported the way they import each other
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
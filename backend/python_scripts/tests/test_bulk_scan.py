@@ -0,0 +1,89 @@
+import json
+import argparse
+
+import pytest
+
+import bulk_scan
+
+def write_results(path, records, tail=b''):
+    with open(path, 'wb') as f:
+        for record in records:
+            f.write(json.dumps(record).encode('utf-8') + b'\n')
+        f.write(tail)
+
+def success(path):
+    return {'image_path': path, 'pipeline_status': 'success'}
+
+def failure(path):
+    return {'image_path': path, 'pipeline_status': 'error', 'error': 'boom'}
+
+@pytest.mark.parametrize('chunk_size', [3, 64 * 1024])
+def test_drop_torn_line_cuts_only_the_partial_record(tmp_path, chunk_size):
+    output = tmp_path / 'scan.jsonl'
+    write_results(output, [success('/a.jpg'), success('/b.jpg')], tail=b'{"image_path": "/c.j')
+    complete = output.read_bytes()[:-len(b'{"image_path": "/c.j')]
+
+    bulk_scan.drop_torn_line(str(output), chunk_size)
+    assert output.read_bytes() == complete
+
+    # A file that ends on a newline is left alone
+    bulk_scan.drop_torn_line(str(output), chunk_size)
+    assert output.read_bytes() == complete
+
+def test_drop_torn_line_without_any_newline(tmp_path):
+    output = tmp_path / 'scan.jsonl'
+    output.write_bytes(b'{"image_path": "/a')
+    bulk_scan.drop_torn_line(str(output), chunk_size=4)
+    assert output.read_bytes() == b''
+
+def test_checkpoint_round_trip_skips_only_successes(tmp_path):
+    output = str(tmp_path / 'scan.jsonl')
+    write_results(output, [success('/a.jpg'), failure('/b.jpg'), success('/c.jpg')])
+    with open(bulk_scan.checkpoint_path(output), 'wb') as f:
+        f.write(bulk_scan.path_digest('/a.jpg') + bulk_scan.path_digest('/c.jpg'))
+
+    done = bulk_scan.load_checkpoint(output)
+    assert len(done) == 2
+    assert bulk_scan.remaining(['/a.jpg', '/b.jpg', '/c.jpg', '/d.jpg'], done) == ['/b.jpg', '/d.jpg']
+
+def test_load_checkpoint_truncates_a_partial_digest(tmp_path):
+    output = str(tmp_path / 'scan.jsonl')
+    write_results(output, [success('/a.jpg')])
+    sidecar = bulk_scan.checkpoint_path(output)
+    with open(sidecar, 'wb') as f:
+        f.write(bulk_scan.path_digest('/a.jpg') + b'\x01\x02\x03')
+
+    done = bulk_scan.load_checkpoint(output)
+    assert bulk_scan.remaining(['/a.jpg', '/b.jpg'], done) == ['/b.jpg']
+    assert len(open(sidecar, 'rb').read()) == bulk_scan.CHECKPOINT_RECORD
+
+def test_load_checkpoint_rebuilds_from_an_older_output(tmp_path):
+    output = str(tmp_path / 'scan.jsonl')
+    write_results(output, [success('/a.jpg'), failure('/b.jpg')], tail=b'{"image_path": "/c.jpg", "pipeline_st')
+
+    done = bulk_scan.load_checkpoint(output)
+    assert bulk_scan.remaining(['/a.jpg', '/b.jpg', '/c.jpg'], done) == ['/b.jpg', '/c.jpg']
+    assert open(output, 'rb').read().endswith(b'\n')
+    assert len(open(bulk_scan.checkpoint_path(output), 'rb').read()) == bulk_scan.CHECKPOINT_RECORD
+
+def test_load_checkpoint_ignores_a_stale_sidecar(tmp_path):
+    output = str(tmp_path / 'scan.jsonl')
+    sidecar = bulk_scan.checkpoint_path(output)
+    with open(sidecar, 'wb') as f:
+        f.write(bulk_scan.path_digest('/a.jpg'))
+
+    done = bulk_scan.load_checkpoint(output)
+    assert len(done) == 0
+    assert not (tmp_path / 'scan.jsonl.done').exists()
+
+def test_remaining_without_checkpoint_keeps_every_path():
+    assert bulk_scan.remaining(['/a.jpg', '/b.jpg'], bulk_scan.load_checkpoint('/nonexistent/scan.jsonl')) == ['/a.jpg', '/b.jpg']
+
+@pytest.mark.parametrize('spec, expected', [('0/4', (0, 4)), ('3/4', (3, 4)), ('0/1', (0, 1))])
+def test_parse_shard(spec, expected):
+    assert bulk_scan.parse_shard(argparse.ArgumentParser(), spec) == expected
+
+@pytest.mark.parametrize('spec', ['0/0', '4/4', '5/4', '-1/4', 'x', '1/2/3', '1/'])
+def test_parse_shard_rejects_bad_values(spec):
+    with pytest.raises(SystemExit):
+        bulk_scan.parse_shard(argparse.ArgumentParser(), spec)
@@ -0,0 +1,37 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+
+import graph_optimize
+
+@pytest.fixture(scope='module')
+def stand_ins():
+    torch.manual_seed(0)
+    return graph_optimize.stand_in_models()
+
+@pytest.mark.parametrize('name', ['generator', 'unet'])
+def test_fold_removes_every_batchnorm(stand_ins, name):
+    model, _ = stand_ins[name]
+    folded, count = graph_optimize.fold_batchnorm(model)
+    assert count == sum(isinstance(m, torch.nn.BatchNorm2d) for m in model.modules())
+    assert not any(isinstance(m, torch.nn.BatchNorm2d) for m in folded.modules())
+
+@pytest.mark.parametrize('name', ['generator', 'unet'])
+@pytest.mark.parametrize('mode', ['fold', 'script'])
+def test_parity_with_eager(stand_ins, name, mode):
+    model, example = stand_ins[name]
+    report = graph_optimize.compare(model, example, modes=[mode], repeat=1, batch_sizes=(2,))[mode]
+    assert 'error' not in report
+    assert report['max_abs_diff'] <= graph_optimize.PARITY_TOLERANCE
+
+    # A batch the build was not traced with still matches
+    batch = torch.randn(2, *example.shape[1:])
+    optimized = graph_optimize.build(model, mode, example)
+    with torch.inference_mode():
+        assert graph_optimize.max_difference(optimized(batch), model(batch)) <= graph_optimize.PARITY_TOLERANCE
+
+@pytest.mark.parametrize('name', ['generator', 'unet'])
+def test_optimize_keeps_the_folded_build(stand_ins, name):
+    model, example = stand_ins[name]
+    assert graph_optimize.optimize(model, 'fold', example) is not model
+    assert graph_optimize.optimize(model, 'eager', example) is model
@@ -0,0 +1,57 @@
+import os
+import time
+
+import pytest
+
+import image_encoding
+
+@pytest.fixture
+def results(tmp_path):
+    return image_encoding.ShmResults(str(tmp_path / 'results'), ttl=60, max_files=3)
+
+def age(path, seconds):
+    mtime = time.time() - seconds
+    os.utime(path, (mtime, mtime))
+
+def test_write_keeps_at_most_max_files(results):
+    paths = []
+    for index in range(5):
+        paths.append(results.write(b'image %d' % index, '.jpg'))
+        age(paths[-1], 10 - index)
+    assert sorted(os.listdir(results.directory)) == sorted(os.path.basename(p) for p in paths[2:])
+
+def test_reap_removes_expired_files(results):
+    fresh = results.write(b'fresh', '.jpg')
+    stale = results.write(b'stale', '.jpg')
+    age(stale, 120)
+    assert results.reap() == 1
+    assert os.path.exists(fresh) and not os.path.exists(stale)
+
+def test_release(results, tmp_path):
+    path = results.write(b'image', '.webp')
+    assert open(path, 'rb').read() == b'image'
+    assert results.release(path)
+    assert not results.release(path)
+
+    outside = tmp_path / 'photo.jpg'
+    outside.write_bytes(b'keep')
+    for path in (str(outside), os.path.join(results.directory, '..', 'photo.jpg')):
+        with pytest.raises(ValueError):
+            results.release(path)
+    assert outside.exists()
+
+def test_cleanup_removes_only_unreleased_files_of_this_process(results):
+    other = image_encoding.ShmResults(results.directory)
+    kept = other.write(b'other process', '.jpg')
+    results.write(b'a', '.jpg')
+    results.write(b'b', '.jpg')
+    results.cleanup()
+    assert os.listdir(results.directory) == [os.path.basename(kept)]
+
+def test_shm_delivery(monkeypatch, results):
+    monkeypatch.setattr(image_encoding, 'SHM_RESULTS', results)
+    encoding = image_encoding.OutputEncoding('png')
+    delivered = image_encoding.deliver(b'png bytes', encoding, 'shm')
+    assert delivered['shm_length'] == 9 and delivered['content_type'] == 'image/png'
+    assert os.path.dirname(delivered['shm_path']) == results.directory
+    assert delivered['shm_path'].endswith('.png')
@@ -0,0 +1,42 @@
+import pytest
+
+pytest.importorskip('onnxruntime')
+torch = pytest.importorskip('torch')
+
+import onnx_backend
+
+def test_detector_matches_keras(tmp_path):
+    pytest.importorskip('tf2onnx')
+    tf = pytest.importorskip('tensorflow')
+    tf.keras.utils.set_random_seed(0)
+    model = tf.keras.Sequential([
+        tf.keras.Input((128, 128, 3)),
+        tf.keras.layers.Conv2D(8, 3, strides=2, activation='relu'),
+        tf.keras.layers.BatchNormalization(),
+        tf.keras.layers.GlobalAveragePooling2D(),
+        tf.keras.layers.Dense(1, activation='sigmoid'),
+    ])
+    model_path = str(tmp_path / 'DeepFake.h5')
+    model.save(model_path)
+
+    onnx_backend.export_detector(model_path)
+    report = onnx_backend.check_detector(model_path, [], onnx_backend.DEFAULT_TOLERANCE)
+    assert report['samples'] == 8
+    assert report['max_abs_diff'] <= onnx_backend.DEFAULT_TOLERANCE
+
+def test_generator_matches_torch(tmp_path):
+    import generator_model
+
+    torch.manual_seed(0)
+    model = generator_model.Generator()
+    # Non-trivial BatchNorm statistics, so the folded export is actually exercised
+    model.train()
+    with torch.no_grad():
+        model(torch.randn(4, 3, 128, 128))
+    model_path = str(tmp_path / 'regenerator_model.pth')
+    torch.save(model.state_dict(), model_path)
+
+    onnx_backend.export_generator(model_path)
+    report = onnx_backend.check_generator(model_path, [], onnx_backend.DEFAULT_TOLERANCE)
+    assert report['samples'] == 4
+    assert report['max_abs_diff'] <= onnx_backend.DEFAULT_TOLERANCE
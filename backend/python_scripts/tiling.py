@@ -0,0 +1,87 @@
+import numpy as np
+
+from preprocessing import MODEL_SIZE, generator_buffer, generator_input
+
+TILE_SIZE = MODEL_SIZE[0]
+DEFAULT_OVERLAP = 32
+DEFAULT_TILE_BATCH = 8
+
+def tile_starts(length, tile, stride):
+    """Tile offsets along one axis; the last tile is flush with the end"""
+    if length <= tile:
+        return [0]
+    starts = list(range(0, length - tile, stride))
+    starts.append(length - tile)
+    return starts
+
+def blend_weights(tile, overlap):
+    """2D weights that ramp down linearly across the overlap so seams cross-fade"""
+    ramp = np.ones(tile, dtype=np.float32)
+    if overlap > 0:
+        edge = np.arange(1, overlap + 1, dtype=np.float32) / (overlap + 1)
+        ramp[:overlap] = edge
+        ramp[-overlap:] = edge[::-1]
+    return np.outer(ramp, ramp)
+
+def regenerate_tiled(regenerator, pixels, overlap=DEFAULT_OVERLAP, batch_size=DEFAULT_TILE_BATCH, tile=TILE_SIZE):
+    """Run the generator over overlapping tiles of an HWC uint8 image and blend a full-size result
+
+    Tiles are processed one row at a time, so besides the input and output
+    images only a single row of tiles is held as float accumulators: memory
+    grows with width, not with width x height.
+    """
+    if not 0 <= overlap < tile:
+        raise ValueError(f"overlap must be between 0 and {tile - 1}")
+
+    height, width = pixels.shape[:2]
+    # Images smaller than one tile are padded up to it and cropped afterwards
+    pad_h = max(0, tile - height)
+    pad_w = max(0, tile - width)
+    if pad_h or pad_w:
+        pixels = np.pad(pixels, ((0, pad_h), (0, pad_w), (0, 0)), mode='edge')
+    padded_h, padded_w = pixels.shape[:2]
+
+    stride = tile - overlap
+    rows = tile_starts(padded_h, tile, stride)
+    cols = tile_starts(padded_w, tile, stride)
+    weights = blend_weights(tile, overlap)
+
+    output = np.empty((padded_h, padded_w, 3), dtype=np.uint8)
+    # Accumulators for the band of rows the current row of tiles can touch
+    band = np.zeros((tile, padded_w, 3), dtype=np.float32)
+    band_weight = np.zeros((tile, padded_w), dtype=np.float32)
+    top = 0
+
+    def flush(count):
+        """Write the first count rows of the band to the output and shift the band up"""
+        done = band[:count] / band_weight[:count, :, None]
+        output[top:top + count] = (np.clip(done, 0, 1) * 255).astype(np.uint8)
+        band[:tile - count] = band[count:]
+        band[tile - count:] = 0
+        band_weight[:tile - count] = band_weight[count:]
+        band_weight[tile - count:] = 0
+
+    for y in rows:
+        if y > top:
+            # Rows above y are not covered by any later tile
+            flush(y - top)
+            top = y
+
+        for start in range(0, len(cols), batch_size):
+            xs = cols[start:start + batch_size]
+            inputs = generator_buffer('tiles', (len(xs), 3, tile, tile), regenerator.channels_last)
+            for i, x in enumerate(xs):
+                generator_input(pixels[y:y + tile, x:x + tile], inputs[i])
+
+            outputs = regenerator.forward(inputs)
+            if not isinstance(outputs, np.ndarray):
+                outputs = outputs.detach().cpu().numpy()
+            # Tanh output [-1, 1] → [0, 1], HWC
+            outputs = ((outputs + 1) / 2).transpose(0, 2, 3, 1)
+
+            for x, tile_output in zip(xs, outputs):
+                band[:, x:x + tile] += tile_output * weights[:, :, None]
+                band_weight[:, x:x + tile] += weights
+
+    flush(padded_h - top)
+    return output[:height, :width]
@@ -0,0 +1,264 @@
+import os
+import sys
+import math
+import argparse
+
+import numpy as np
+from PIL import Image
+
+from detection_pipeline import (
+    IMAGE_EXTENSIONS, DeepfakeDetector, ImageRegenerator, debug_print, expand_image_paths, safe_print_json
+)
+import image_encoding
+from instrumentation import stage
+from preprocessing import DecodedImage, decode_image
+
+# Frames per second analysed when no stride is given (UNAI_VIDEO_FPS)
+DEFAULT_SAMPLE_FPS = 2.0
+DEFAULT_MAX_FRAMES = 64
+DEFAULT_BATCH_SIZE = 16
+# Stop once at least MIN_FRAMES are scored and the mean score, less two standard
+# errors, is MARGIN or more away from the 0.5 decision boundary
+DEFAULT_MIN_FRAMES = 8
+DEFAULT_MARGIN = 0.25
+DEFAULT_MAX_REGENERATE = 8
+# Seeking decodes from the codec keyframe before the target, so over short gaps reading forward is cheaper
+SEEK_GAP = 30
+# With keyframes=True a sampled frame is skipped when its grayscale thumbnail is within
+# this mean absolute difference (0-255) of a frame that was already scored
+KEYFRAME_THRESHOLD = 6.0
+THUMBNAIL_SIZE = (16, 16)
+
+class VideoFrames:
+    """Frames of a video file, read forward over small gaps and seeked to over large ones"""
+
+    def __init__(self, path):
+        import cv2
+        self.cv2 = cv2
+        self.capture = cv2.VideoCapture(path)
+        if not self.capture.isOpened():
+            raise Exception(f"Could not open video: {path}")
+        self.fps = self.capture.get(cv2.CAP_PROP_FPS) or None
+        self.frame_count = int(self.capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        if self.frame_count <= 0:
+            # Some containers do not store it; count by demuxing once
+            self.frame_count = 0
+            while self.capture.grab():
+                self.frame_count += 1
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        self.position = 0
+
+    def read(self, index):
+        """The frame at index as a DecodedImage, None past the end of the stream"""
+        if not 0 <= index - self.position < SEEK_GAP:
+            self.capture.set(self.cv2.CAP_PROP_POS_FRAMES, index)
+            self.position = index
+        # grab() decodes without the colour conversion and copy that read() does
+        while self.position < index:
+            if not self.capture.grab():
+                return None
+            self.position += 1
+        ok, frame = self.capture.read()
+        if not ok:
+            return None
+        self.position += 1
+        return DecodedImage(Image.fromarray(self.cv2.cvtColor(frame, self.cv2.COLOR_BGR2RGB)))
+
+    def close(self):
+        self.capture.release()
+
+class ImageSequence:
+    """A clip already split into image files, in file name order"""
+
+    def __init__(self, paths, fps=None):
+        self.paths = paths
+        self.fps = fps
+        self.frame_count = len(paths)
+
+    def read(self, index):
+        return decode_image(self.paths[index])
+
+    def close(self):
+        pass
+
+def open_frames(source, fps=None):
+    """VideoFrames for a video file, ImageSequence for a directory, glob or list of images"""
+    if isinstance(source, str) and os.path.isfile(source) and not source.lower().endswith(IMAGE_EXTENSIONS):
+        return VideoFrames(source)
+    paths = expand_image_paths(source if isinstance(source, (list, tuple)) else [source])
+    if not paths:
+        raise Exception(f"No video or frame images found at {source}")
+    return ImageSequence(paths, fps)
+
+def sample_indices(frame_count, fps, every=None, max_frames=DEFAULT_MAX_FRAMES):
+    """Frame indices to analyse: every Nth frame, thinned out evenly to at most max_frames"""
+    if every is None:
+        sample_fps = float(os.environ.get('UNAI_VIDEO_FPS', DEFAULT_SAMPLE_FPS))
+        every = max(1, int(round(fps / sample_fps))) if fps else 1
+    indices = list(range(0, frame_count, every))
+    if max_frames and len(indices) > max_frames:
+        picks = np.linspace(0, len(indices) - 1, max_frames).round().astype(int)
+        indices = [indices[i] for i in picks]
+    return indices
+
+def coarse_to_fine(indices):
+    """indices reordered so that every prefix is spread over the whole clip
+
+    Early termination only ever sees a prefix; in temporal order that would be
+    the opening seconds, in this order it is a progressively denser sample of
+    all of it (first, middle, quarters, eighths, ...).
+    """
+    order = []
+    seen = set()
+    step = 1 << max(0, len(indices) - 1).bit_length()
+    while step:
+        for i in range(0, len(indices), step):
+            if i not in seen:
+                seen.add(i)
+                order.append(indices[i])
+        step //= 2
+    return order
+
+def thumbnail(image):
+    return np.asarray(image.image.resize(THUMBNAIL_SIZE, Image.BILINEAR).convert('L'), dtype=np.float32)
+
+def is_decisive(scores, min_frames=DEFAULT_MIN_FRAMES, margin=DEFAULT_MARGIN):
+    """Whether the frame scores so far settle the clip either way"""
+    if len(scores) < max(2, min_frames):
+        return False
+    mean = float(np.mean(scores))
+    standard_error = float(np.std(scores, ddof=1)) / math.sqrt(len(scores))
+    return abs(mean - 0.5) - 2 * standard_error >= margin
+
+def detect_video(source, detector=None, regenerator=None, every=None, max_frames=DEFAULT_MAX_FRAMES,
+                 keyframes=False, batch_size=DEFAULT_BATCH_SIZE, min_frames=DEFAULT_MIN_FRAMES, margin=DEFAULT_MARGIN,
+                 max_regenerate=DEFAULT_MAX_REGENERATE, output_dir=None, fps=None):
+    """Detect deepfakes in a video file or frame sequence (directory, glob or list of images)
+
+    Sampled frames are scored in batches, coarse to fine over the clip, until
+    the aggregate is decisive. The clip is a deepfake when the mean frame
+    confidence is above 0.5. Only flagged frames are regenerated (the
+    max_regenerate most confident ones); pass regenerator=None to skip that.
+    """
+    try:
+        with stage('decode'):
+            frames = open_frames(source, fps)
+    except Exception as e:
+        return {'is_deepfake': False, 'confidence': 0.0, 'status': 'error', 'error': str(e)}
+
+    detector = detector or DeepfakeDetector()
+    try:
+        indices = sample_indices(frames.frame_count, frames.fps, every, max_frames)
+        order = coarse_to_fine(indices)
+        scores = {}
+        flagged = {}
+        thumbnails = []
+        skipped = 0
+        errors = 0
+        early_stop = False
+
+        for start in range(0, len(order), batch_size):
+            batch = []
+            # Sorted, so the reader mostly moves forward within a batch
+            for index in sorted(order[start:start + batch_size]):
+                with stage('decode'):
+                    image = frames.read(index)
+                if image is None:
+                    errors += 1
+                    continue
+                if keyframes:
+                    thumb = thumbnail(image)
+                    if thumbnails and np.abs(np.stack(thumbnails) - thumb).mean(axis=(1, 2)).min() < KEYFRAME_THRESHOLD:
+                        skipped += 1
+                        continue
+                    thumbnails.append(thumb)
+                batch.append((index, image))
+
+            if batch:
+                results = detector.detect_batch([image for _, image in batch])
+                for (index, image), result in zip(batch, results):
+                    if result['status'] != 'success':
+                        errors += 1
+                        continue
+                    scores[index] = result['confidence']
+                    if result['is_deepfake']:
+                        flagged[index] = image
+                # Full-size frames are held only for the frames that may be regenerated
+                for index in sorted(flagged, key=scores.get)[:-max_regenerate or None]:
+                    del flagged[index]
+
+            if is_decisive(list(scores.values()), min_frames, margin):
+                early_stop = start + batch_size < len(order)
+                break
+    finally:
+        frames.close()
+
+    if not scores:
+        return {'is_deepfake': False, 'confidence': 0.0, 'status': 'error', 'error': 'No frame could be analysed'}
+
+    confidence = float(np.mean(list(scores.values())))
+    flagged_frames = [index for index in sorted(scores) if scores[index] > 0.5]
+    result = {
+        'is_deepfake': confidence > 0.5,
+        'confidence': confidence,
+        'status': 'success',
+        'frames': frames.frame_count,
+        'fps': frames.fps,
+        'sampled': len(indices),
+        'analyzed': len(scores),
+        'skipped_similar': skipped,
+        'frame_errors': errors,
+        'early_stop': early_stop,
+        'frame_scores': [
+            {'frame': index, 'time_s': round(index / frames.fps, 3) if frames.fps else None, 'confidence': scores[index]}
+            for index in sorted(scores)
+        ],
+        'flagged_frames': flagged_frames,
+    }
+
+    if regenerator is not None and flagged and max_regenerate:
+        selected = sorted(flagged)
+        base_name = os.path.splitext(os.path.basename(str(source).rstrip(os.sep)))[0] or 'clip'
+        names = [f"{base_name}_frame{index:06d}" for index in selected]
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+            output_paths = [os.path.join(output_dir, f"{name}_regenerated{regenerator.encoding.extension}") for name in names]
+        else:
+            output_paths = [regenerator.default_output_path(name) for name in names]
+        regenerated = regenerator.regenerate_batch([flagged[index] for index in selected], output_paths)
+        result['regeneration'] = [dict(r, frame=index) for index, r in zip(selected, regenerated)]
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description='Detect deepfakes in a video clip or a sequence of frame images')
+    parser.add_argument('source', nargs='+', help='Video file, or frame images (files, globs or a directory)')
+    parser.add_argument('--every', type=int, help='Analyse every Nth frame (default: $UNAI_VIDEO_FPS frames per second)')
+    parser.add_argument('--max-frames', type=int, default=DEFAULT_MAX_FRAMES, help='Most frames to analyse (0: no limit)')
+    parser.add_argument('--keyframes', action='store_true', help='Skip sampled frames that look like one already scored')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--min-frames', type=int, default=DEFAULT_MIN_FRAMES, help='Frames scored before stopping early')
+    parser.add_argument('--margin', type=float, default=DEFAULT_MARGIN,
+                        help='Distance of the mean score from 0.5 that ends the scan early (>= 0.5 never stops)')
+    parser.add_argument('--max-regenerate', type=int, default=DEFAULT_MAX_REGENERATE)
+    parser.add_argument('--no-regenerate', action='store_true', help='Only detect')
+    parser.add_argument('--output-dir', help='Where regenerated frames go (default: the uploads folder)')
+    parser.add_argument('--fps', type=float, help='Frame rate of an image sequence, for timestamps and the default stride')
+    parser.add_argument('--backend', choices=['native', 'onnx'])
+    image_encoding.add_arguments(parser)
+    args = parser.parse_args()
+
+    source = args.source[0] if len(args.source) == 1 else args.source
+    detector = DeepfakeDetector(backend=args.backend)
+    regenerator = None if args.no_regenerate else ImageRegenerator(backend=args.backend, encoding=image_encoding.encoding_from_args(args))
+    result = detect_video(
+        source, detector, regenerator, every=args.every, max_frames=args.max_frames, keyframes=args.keyframes,
+        batch_size=args.batch_size, min_frames=args.min_frames, margin=args.margin,
+        max_regenerate=args.max_regenerate, output_dir=args.output_dir, fps=args.fps,
+    )
+    safe_print_json(result)
+    if result['status'] != 'success':
+        debug_print(f"❌ {result['error']}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()